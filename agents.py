@@ -1,8 +1,8 @@
-from crewai import Agent
 from textwrap import dedent
 from dotenv import load_dotenv
+from cassette import replay_enabled
+from model_routing import get_model_router
 import os
-from tools import SearchFilterTool, RecipeDatabaseTool, RecipeFormatterTool
 
 """
 Creating Agents Cheat Sheet:
@@ -31,33 +31,55 @@ Notes:
 
 
 class RecipeAgents:
-    def __init__(self):
+    def __init__(self, client=None, index=None, corpus=None, router=None):
+        """
+        Args:
+            client (CompletionClient): Optional HTTP client injected into all tools.
+                Defaults to the shared per-process client.
+            index (RecipeIndex): Optional local recipe index for the search and database tools.
+                Defaults to the index in RECIPE_INDEX_DIR, if set.
+            corpus (RecipeCorpus): Optional memory-mapped corpus for the database tool.
+                Defaults to the corpus in RECIPE_CORPUS_PATH, if set.
+            router (ModelRouter): Optional model router picking each agent's and tool's model.
+                Defaults to the shared router configured from the environment.
+        """
         # Load environment variables
         load_dotenv()
 
         api_key = os.getenv("OPENAI_API_KEY")
         model_name = os.getenv("OPENAI_MODEL_NAME", "ruslandev/llama-3-8b-gpt-4o")
 
-        if not api_key or not model_name:
+        if not model_name or (not api_key and not replay_enabled()):
             raise EnvironmentError("Missing OPENAI_API_KEY or OPENAI_MODEL_NAME in environment variables.")
 
-        self.llm = {
-            "model": model_name,
-            "api_key": api_key
-        }
+        # Each agent gets the model of its route; self.llm is the default route
+        self.router = router or get_model_router()
+        self.llm = self.router.routes[self.router.default_route].llm_config()
+
+        # Tools (and crewai) are imported on first use, so importing this module stays cheap
+        from tools import RecipeDatabaseTool, RecipeFormatterTool, SearchFilterTool
 
         # Initialize tools
         self.search_filter_tool = SearchFilterTool(
             name="Search Filter",
-            description="Filter recipe searches based on criteria."
+            description="Filter recipe searches based on criteria.",
+            client=client,
+            router=self.router,
+            index=index,
         )
         self.recipe_database_tool = RecipeDatabaseTool(
             name="Recipe Database",
-            description="Search in recipe database."
+            description="Search in recipe database.",
+            client=client,
+            router=self.router,
+            index=index,
+            corpus=corpus,
         )
         self.recipe_formatter_tool = RecipeFormatterTool(
             name="Recipe Formatter",
-            description="Format recipes into easy-to-follow instructions."
+            description="Format recipes into easy-to-follow instructions.",
+            client=client,
+            router=self.router,
         )
 
     def recipe_researcher(self):
@@ -67,6 +89,8 @@ class RecipeAgents:
         Returns:
             Agent: Configured recipe researcher agent.
         """
+        from crewai import Agent
+
         return Agent(
             role="Recipe Researcher",
             backstory=dedent(
@@ -80,7 +104,7 @@ class RecipeAgents:
             tools=[self.recipe_database_tool, self.search_filter_tool],
             verbose=True,
             memory=True,
-            llm=self.llm,
+            llm=self.router.route(agent="recipe_researcher").llm_config(),
             allow_delegation=True,
         )
 
@@ -91,6 +115,8 @@ class RecipeAgents:
         Returns:
             Agent: Configured recipe creator agent.
         """
+        from crewai import Agent
+
         return Agent(
             role="Recipe Creator",
             backstory=dedent(
@@ -103,7 +129,7 @@ class RecipeAgents:
             tools=[self.recipe_formatter_tool],
             verbose=True,
             memory=True,
-            llm=self.llm,
+            llm=self.router.route(agent="recipe_creator").llm_config(),
             allow_delegation=False,
         )
 
@@ -114,6 +140,8 @@ class RecipeAgents:
         Returns:
             Agent: Configured recipe formatter agent.
         """
+        from crewai import Agent
+
         return Agent(
             role="Recipe Formatter",
             backstory=dedent(
@@ -127,6 +155,6 @@ class RecipeAgents:
             tools=[self.recipe_formatter_tool],
             verbose=True,
             memory=False,
-            llm=self.llm,
+            llm=self.router.route(agent="recipe_formatter").llm_config(),
             allow_delegation=False,
         )
@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from agents import RecipeAgents
+from crew import run_recipe_request
+from model_routing import get_model_router
+from warm_cache import load_requests, mine_requests
+
+"""
+Model routing benchmark.
+
+Runs a set of requests through the full pipeline (bypassing the result cache)
+and reports latency and cost per model route: one row per agent stage and per
+tool, with the route and model it used. With --compare the same requests first
+run with every agent and tool on the default route, as a baseline for the
+routed configuration.
+
+Agent rows time the whole stage, including the tool calls the agent makes;
+their cost covers the agent's own LLM calls only, since tool calls have rows
+of their own. Costs come from the route prices (see model_routing.py) and are
+zero unless prices are configured.
+
+For repeatable numbers, replay recorded cassettes with real latency
+(LLM_CASSETTE_MODE=replay, LLM_CASSETTE_LATENCY=real); record one cassette per
+configuration, since requests to different models are recorded separately.
+
+Usage:
+    python benchmark.py --requests popular.json --compare
+    python benchmark.py --from-log requests.log --top 50 --repeat 3 --json report.json
+"""
+
+load_dotenv()
+
+
+def run_benchmark(requests, router, repeat=1):
+    """
+    Runs every request `repeat` times, one at a time, with agents built on `router`.
+
+    Returns:
+        dict: Per-route rows from the router plus request-level totals.
+    """
+    router.reset_stats()
+    recipe_agents = RecipeAgents(router=router)
+    latencies = []
+    failed = 0
+
+    for _ in range(repeat):
+        for request in requests:
+            start = time.perf_counter()
+            try:
+                formatted_recipe = run_recipe_request(
+                    request["user_preferences"],
+                    request["ingredient_filters"],
+                    request["dish_type"],
+                    recipe_agents=recipe_agents,
+                    use_cache=False,
+                )
+            except Exception as e:
+                logging.error("Benchmark request failed: %s", e)
+                formatted_recipe = None
+            latencies.append(time.perf_counter() - start)
+            failed += formatted_recipe is None
+
+    rows = router.report()
+    latencies.sort()
+    total_cost = sum(row["cost"] for row in rows)
+    return {
+        "routes": rows,
+        "requests": len(latencies),
+        "failed": failed,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "cost": total_cost,
+        "cost_per_request": total_cost / len(latencies) if latencies else 0.0,
+    }
+
+
+def format_report(name, result):
+    """
+    Returns:
+        str: A plain-text table of one benchmark run.
+    """
+    lines = [
+        f"== {name}: {result['requests']} requests, {result['failed']} failed, "
+        f"p50 {result['p50']:.2f}s, p95 {result['p95']:.2f}s, "
+        f"${result['cost']:.4f} total, ${result['cost_per_request']:.5f}/request",
+        f"{'scope':<6} {'name':<22} {'route':<10} {'model':<28} {'calls':>6} {'errors':>6} "
+        f"{'p50 s':>8} {'p95 s':>8} {'tok in':>9} {'tok out':>9} {'cost $':>10}",
+    ]
+    for row in result["routes"]:
+        lines.append(
+            f"{row['scope']:<6} {row['name']:<22} {row['route']:<10} {row['model'][:28]:<28} "
+            f"{row['calls']:>6} {row['errors']:>6} {row['p50']:>8.2f} {row['p95']:>8.2f} "
+            f"{row['tokens_in']:>9} {row['tokens_out']:>9} {row['cost']:>10.4f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Benchmark latency and cost per model route.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--requests", help="JSON file with a list of requests.")
+    source.add_argument("--from-log", help="JSONL request log to take the most frequent requests from.")
+    parser.add_argument("--top", type=int, default=20, help="Number of requests to take from the log.")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each request is run.")
+    parser.add_argument("--compare", action="store_true", help="Also run everything on the default route first.")
+    parser.add_argument("--json", help="Write the report to this JSON file too.")
+    args = parser.parse_args()
+
+    requests = load_requests(args.requests) if args.requests else mine_requests(args.from_log, args.top)
+    router = get_model_router()
+
+    configurations = [("routed", router)]
+    if args.compare:
+        configurations.insert(0, ("baseline", router.single_route()))
+
+    report = {}
+    for name, configured_router in configurations:
+        logging.info("Running %d requests x%d (%s).", len(requests), args.repeat, name)
+        report[name] = run_benchmark(requests, configured_router, repeat=args.repeat)
+        print(format_report(name, report[name]))
+
+    if args.compare:
+        baseline, routed = report["baseline"], report["routed"]
+        print(
+            f"== routed vs baseline: p50 {routed['p50'] - baseline['p50']:+.2f}s, "
+            f"mean {routed['mean'] - baseline['mean']:+.2f}s, "
+            f"cost/request {routed['cost_per_request'] - baseline['cost_per_request']:+.5f} $"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if any(result["failed"] for result in report.values()) else 0)
@@ -0,0 +1,293 @@
+import argparse
+import base64
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+"""
+Record/replay of LLM interactions.
+
+A cassette is a gzipped JSONL file with one recorded interaction per line:
+the endpoint path, a hash of the canonical request body, the response and how
+long it took. Replaying a cassette needs no API key and no network, and is
+deterministic: the n-th identical request gets the n-th recorded response (the
+last one repeats once they run out).
+
+Each interaction is tagged with its format: "json" for parsed responses recorded
+in process, "http" for raw responses (status, content type, base64 body)
+recorded by the proxy. Both can share a file; each mode only replays its own.
+All clients in a process share one Cassette per file (see get_cassette), so
+record mode appends under one lock and replay keeps one position per request.
+
+Two ways to use it:
+- In process: set LLM_CASSETTE=<path> and LLM_CASSETTE_MODE=record|replay, and
+  get_default_client() in llm_client.py wraps or replaces the HTTP client used by
+  the tools. LLM_CASSETTE_LATENCY=real replays recorded durations, zero (the
+  default) answers immediately.
+- As a proxy for every OpenAI-compatible call, including the ones crewai agents
+  make themselves: run `python cassette.py serve --cassette run.jsonl.gz --mode replay`
+  and point OPENAI_API_BASE at it.
+"""
+
+load_dotenv()
+
+
+class CassetteMissError(KeyError):
+    """
+    Raised in replay mode for a request that is not in the cassette.
+    """
+
+
+def replay_enabled():
+    """
+    Returns:
+        bool: True when LLM calls are served from a cassette, so no API key is needed.
+    """
+    return bool(os.getenv("LLM_CASSETTE")) and os.getenv("LLM_CASSETTE_MODE", "replay") == "replay"
+
+
+def request_hash(path, body):
+    encoded = json.dumps({"path": path, "body": body}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded interactions, loaded from and appended to a gzipped JSONL file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # (format, request hash) -> interactions in recording order
+        self._interactions = defaultdict(list)
+        self._replay_positions = defaultdict(int)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        interaction.setdefault("format", _response_format(interaction["response"]))
+                        self._interactions[interaction["format"], interaction["key"]].append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self._interactions.values())
+
+    def record(self, path, body, response, duration, response_format="json"):
+        """
+        Appends one interaction.
+
+        Args:
+            response: A JSON value ("json" format) or, for raw HTTP bodies ("http" format),
+                a dict with status, content_type and base64 body.
+            response_format (str): "json" or "http".
+        """
+        interaction = {
+            "key": request_hash(path, body),
+            "format": response_format,
+            "path": path,
+            "model": body.get("model"),
+            "response": response,
+            "duration": round(duration, 4),
+        }
+        with self._lock:
+            self._interactions[response_format, interaction["key"]].append(interaction)
+            # Every append adds a gzip member; readers handle multi-member files
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+
+    def replay(self, path, body, response_format="json"):
+        """
+        Returns:
+            dict: The next recorded interaction for this request, in the given format.
+
+        Raises:
+            CassetteMissError: If the request was never recorded in that format.
+        """
+        key = response_format, request_hash(path, body)
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                raise CassetteMissError(f"No recorded interaction for {path} ({body.get('model')}).")
+            position = self._replay_positions[key]
+            self._replay_positions[key] = position + 1
+            return interactions[min(position, len(interactions) - 1)]
+
+
+def _response_format(response):
+    # Interactions recorded before formats were tagged: raw HTTP responses have this exact shape
+    if isinstance(response, dict) and response.keys() == {"status", "content_type", "body"}:
+        return "http"
+    return "json"
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path):
+    """
+    Returns:
+        Cassette: The process-wide cassette for a file, loaded on first use.
+    """
+    key = os.path.abspath(path)
+    with _cassettes_lock:
+        if key not in _cassettes:
+            _cassettes[key] = Cassette(path)
+        return _cassettes[key]
+
+
+class RecordingClient:
+    """
+    Wraps a CompletionClient and records every completion it makes.
+    """
+
+    def __init__(self, client, cassette):
+        self.client = client
+        self.cassette = cassette
+
+    def create(self, model, prompt, max_tokens, temperature=0.7, **params):
+        body = dict(params, model=model, prompt=prompt, max_tokens=max_tokens, temperature=temperature)
+        start = time.perf_counter()
+        response = self.client.create(model, prompt, max_tokens, temperature, **params)
+        self.cassette.record("/completions", body, response, time.perf_counter() - start)
+        return response
+
+    def pool_stats(self):
+        return self.client.pool_stats()
+
+
+class ReplayClient:
+    """
+    Drop-in CompletionClient replacement serving completions from a cassette.
+    """
+
+    def __init__(self, cassette, real_latency=False):
+        self.cassette = cassette
+        self.real_latency = real_latency
+
+    def create(self, model, prompt, max_tokens, temperature=0.7, **params):
+        body = dict(params, model=model, prompt=prompt, max_tokens=max_tokens, temperature=temperature)
+        interaction = self.cassette.replay("/completions", body)
+        if self.real_latency:
+            time.sleep(interaction["duration"])
+        return copy.deepcopy(interaction["response"])
+
+    def pool_stats(self):
+        return {}
+
+
+def cassette_client(client_factory):
+    """
+    Builds the client for the LLM_CASSETTE settings, or None when no cassette is configured.
+
+    Args:
+        client_factory (callable): Builds the real CompletionClient, used in record mode.
+    """
+    path = os.getenv("LLM_CASSETTE")
+    if not path:
+        return None
+    # Clients for different endpoints or keys share the cassette
+    cassette = get_cassette(path)
+    if replay_enabled():
+        logging.info("Replaying %d LLM interactions from %s.", len(cassette), path)
+        return ReplayClient(cassette, real_latency=os.getenv("LLM_CASSETTE_LATENCY", "zero") == "real")
+    logging.info("Recording LLM interactions to %s.", path)
+    return RecordingClient(client_factory(), cassette)
+
+
+class CassetteProxyHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible proxy that records upstream responses or replays them from the cassette.
+    Responses are stored as raw bytes, so streamed responses replay unchanged.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        try:
+            body = json.loads(raw_body or b"{}")
+        except json.JSONDecodeError:
+            body = {"raw": raw_body.decode("utf-8", "replace")}
+        # Recorded against the endpoint, whether or not the client's base URL ends in /v1
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.startswith("/v1/"):
+            path = path[len("/v1"):]
+
+        if server.mode == "replay":
+            try:
+                interaction = server.cassette.replay(path, body, response_format="http")
+            except CassetteMissError as e:
+                self._send(404, "application/json", json.dumps({"error": e.args[0]}).encode("utf-8"))
+                return
+            if server.real_latency:
+                time.sleep(interaction["duration"])
+            response = interaction["response"]
+            self._send(response["status"], response["content_type"], base64.b64decode(response["body"]))
+            return
+
+        import httpx
+
+        headers = {"Authorization": self.headers.get("Authorization", ""), "Content-Type": "application/json"}
+        start = time.perf_counter()
+        upstream = httpx.post(server.upstream + path, content=raw_body, headers=headers, timeout=120)
+        duration = time.perf_counter() - start
+        content_type = upstream.headers.get("Content-Type", "application/json")
+        if upstream.status_code < 500:
+            server.cassette.record(
+                path,
+                body,
+                {
+                    "status": upstream.status_code,
+                    "content_type": content_type,
+                    "body": base64.b64encode(upstream.content).decode("ascii"),
+                },
+                duration,
+                response_format="http",
+            )
+        self._send(upstream.status_code, content_type, upstream.content)
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Record or replay LLM interactions.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    serve = subcommands.add_parser("serve", help="Run an OpenAI-compatible record/replay proxy.")
+    serve.add_argument("--cassette", required=True)
+    serve.add_argument("--mode", choices=("record", "replay"), default="replay")
+    serve.add_argument("--upstream", default=os.getenv("LLM_CASSETTE_UPSTREAM", "https://api.openai.com/v1"))
+    serve.add_argument("--latency", choices=("zero", "real"), default="zero")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+
+    proxy = ThreadingHTTPServer((args.host, args.port), CassetteProxyHandler)
+    proxy.cassette = get_cassette(args.cassette)
+    proxy.mode = args.mode
+    proxy.upstream = args.upstream.rstrip("/")
+    proxy.real_latency = args.latency == "real"
+    logging.info("Cassette proxy (%s) on http://%s:%d with %d interactions.", args.mode, args.host, args.port, len(proxy.cassette))
+    proxy.serve_forever()
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+"""
+Circuit breaker for the LLM completion endpoint.
+
+States:
+- CLOSED: calls go through; consecutive errors and slow calls are counted.
+- OPEN: calls fail fast with CircuitOpenError until the recovery timeout elapses.
+- HALF_OPEN: a limited number of probe calls are let through. A successful probe
+  closes the circuit, a failed one opens it again.
+
+While the circuit is open the tools answer from StaleResultCache and mark the
+answer as degraded instead of waiting on a provider that is known to be down.
+"""
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker driven by error and latency thresholds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, latency_threshold=10.0, recovery_timeout=30.0, half_open_max_calls=1):
+        """
+        Args:
+            failure_threshold (int): Consecutive failures (errors or slow calls) that open the circuit.
+            latency_threshold (float): Seconds after which a successful call still counts as a failure.
+            recovery_timeout (float): Seconds to stay open before probing in the half-open state.
+            half_open_max_calls (int): Number of concurrent probe calls allowed while half-open.
+        """
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            logging.info("Circuit breaker half-open, probing the LLM provider.")
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        logging.warning("Circuit breaker opened after %d consecutive failures.", self._failures)
+
+    def allow_request(self):
+        """
+        Returns:
+            bool: True if a call may go through right now.
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record_success(self, latency):
+        """
+        Records a completed call. Calls slower than the latency threshold count as failures.
+
+        Args:
+            latency (float): Duration of the call in seconds.
+        """
+        if latency > self.latency_threshold:
+            logging.warning("LLM call took %.2fs (threshold %.2fs).", latency, self.latency_threshold)
+            self.record_failure()
+            return
+
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                logging.info("Circuit breaker closed, LLM provider recovered.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes_in_flight = 0
+
+    def record_failure(self):
+        """
+        Records a failed call and opens the circuit when the threshold is reached.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Runs func through the breaker.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError("LLM provider circuit is open; failing fast.")
+
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+
+        self.record_success(time.monotonic() - start)
+        return result
+
+
+class StaleResultCache:
+    """
+    Bounded LRU store of the last good tool results, served when the circuit is open.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return deepcopy(self._entries[key])
+
+    def degraded(self, key, default):
+        """
+        Returns the cached value for key, or default, marked as degraded.
+
+        Args:
+            key: Cache key of the tool call.
+            default (dict): Answer to use when nothing is cached for key.
+
+        Returns:
+            dict: The answer with "degraded" set to True.
+        """
+        result = self.get(key)
+        if result is None:
+            result = deepcopy(default)
+        result["degraded"] = True
+        return result
@@ -0,0 +1,115 @@
+import copy
+import hashlib
+import json
+import re
+import threading
+
+"""
+Request canonicalization and singleflight-style coalescing.
+
+Two requests that differ only in ingredient order, casing, whitespace or
+"main_course" vs "main course" map to the same canonical key. SingleFlight uses
+that key so concurrent duplicates wait on one execution and share its result;
+each waiter gets its own copy.
+"""
+
+_WHITESPACE = re.compile(r"[\s_\-]+")
+
+
+def _normalize_text(value):
+    return _WHITESPACE.sub(" ", value).strip().casefold()
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return _normalize_text(value)
+    if isinstance(value, dict):
+        return {_normalize_text(str(key)): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        # Preference and filter lists are sets: order and duplicates carry no meaning
+        items = [_normalize(item) for item in value]
+        return sorted({json.dumps(item, sort_keys=True): item for item in items}.values(), key=json.dumps)
+    return value
+
+
+def canonicalize_request(user_preferences, ingredient_filters, dish_type):
+    """
+    Returns:
+        dict: The request with sorted, de-duplicated filters and normalized text.
+    """
+    return {
+        "user_preferences": _normalize(user_preferences or {}),
+        "ingredient_filters": _normalize(ingredient_filters or []),
+        "dish_type": _normalize(dish_type or ""),
+    }
+
+
+def request_key(user_preferences, ingredient_filters, dish_type):
+    """
+    Returns:
+        str: A stable hash of the canonical request.
+    """
+    canonical = canonicalize_request(user_preferences, ingredient_filters, dish_type)
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one execution per key at a time; concurrent callers share its outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared_total = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs), or waits for the in-flight call with the same key.
+
+        Only the caller that runs func sees its side effects (metrics, logging); the others just wait.
+
+        Returns:
+            The result of the single execution; waiters get a deep copy, so no caller can
+            change another's result. If it raised, every caller gets the exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared_total += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
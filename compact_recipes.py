@@ -0,0 +1,304 @@
+import json
+import struct
+
+import numpy as np
+from dotenv import load_dotenv
+
+from shopping_list import UNITS, parse_ingredient
+
+"""
+Compact, array-backed recipe batches passed between the pipeline stages.
+
+A RecipeBatch holds many RecipeDetail-shaped recipes in flat columns rather
+than one dict or model per recipe:
+- every string (names, ingredient lines, steps, nutrition keys) is stored once
+  per batch and referenced by a u32 ID;
+- ingredient lines are parsed once, into an interned canonical ingredient ID,
+  a unit ID and a quantity in that unit (see shopping_list.parse_ingredient), so
+  later stages can sum or filter them without reparsing;
+- numbers live in numpy arrays (cooking time, servings, quantities, nutrition),
+  and each recipe's lines, steps and nutrition are row ranges (CSR offsets).
+
+batch[i] is a CompactRecipe, a slotted view that reads like a RecipeDetail dict
+(recipe["name"], recipe.get("steps"), model_dump()), so code written for dicts
+and models accepts it. Batches serialize to one bytes blob (to_bytes / pickle)
+and load back without copying the arrays.
+"""
+
+load_dotenv()
+
+MAGIC = b"RBATCH1\0"
+NO_STRING = 0xFFFFFFFF
+FIELDS = ("recipe_id", "name", "ingredients", "steps", "cooking_time", "servings", "cuisine", "dish_type",
+          "nutrition", "notes")
+_STRING_COLUMNS = ("recipe_id", "name", "cuisine", "dish_type", "notes", "language")
+_NUMBER_COLUMNS = ("cooking_time", "servings")
+# Base units by ID; the same in every process, so unit IDs need no table in serialized batches
+UNIT_NAMES = tuple(sorted({base for base, _ in UNITS.values()}))
+_UNIT_IDS = {unit: unit_id for unit_id, unit in enumerate(UNIT_NAMES)}
+_ARRAYS = {
+    "cooking_time": np.int32, "servings": np.int32,
+    "line_starts": np.uint32, "lines": np.uint32, "ingredient_ids": np.uint32, "unit_ids": np.uint8,
+    "quantities": np.float32, "step_starts": np.uint32, "steps": np.uint32,
+    "nutrition_starts": np.uint32, "nutrition_keys": np.uint32, "nutrition_values": np.float64,
+    **{f"{column}_ids": np.uint32 for column in _STRING_COLUMNS},
+}
+
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+class Vocabulary:
+    """
+    Interned strings with dense u32 IDs.
+    """
+
+    __slots__ = ("strings", "_ids")
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self._ids = {string: string_id for string_id, string in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, string_id):
+        return None if string_id == NO_STRING else self.strings[string_id]
+
+    def id(self, string):
+        """
+        Returns:
+            int: The string's ID, added on first use; NO_STRING for None and "".
+        """
+        if string is None or string == "":
+            return NO_STRING
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = self._ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def to_bytes(self):
+        encoded = [string.encode("utf-8") for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return offsets.tobytes() + b"".join(encoded)
+
+    @classmethod
+    def from_bytes(cls, data, count):
+        offsets = np.frombuffer(data, dtype=np.uint64, count=count + 1)
+        text = bytes(data[offsets.nbytes:])
+        return cls(text[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+
+
+class CompactRecipe:
+    """
+    One recipe of a RecipeBatch, read like a RecipeDetail-shaped dict.
+    """
+
+    __slots__ = ("batch", "row")
+
+    def __init__(self, batch, row):
+        self.batch = batch
+        self.row = row
+
+    def __getitem__(self, field):
+        value = self.batch.field(self.row, field)
+        if value is None and field not in FIELDS and field != "language":
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        value = self.batch.field(self.row, field)
+        return default if value is None else value
+
+    def keys(self):
+        return FIELDS
+
+    def __getattr__(self, field):
+        if field in FIELDS:
+            return self.batch.field(self.row, field)
+        raise AttributeError(field)
+
+    @property
+    def ingredient_ids(self):
+        return self.batch.ingredient_ids[self.batch.line_starts[self.row]:self.batch.line_starts[self.row + 1]]
+
+    @property
+    def unit_ids(self):
+        return self.batch.unit_ids[self.batch.line_starts[self.row]:self.batch.line_starts[self.row + 1]]
+
+    @property
+    def quantities(self):
+        return self.batch.quantities[self.batch.line_starts[self.row]:self.batch.line_starts[self.row + 1]]
+
+    def model_dump(self):
+        """
+        Returns:
+            dict: The recipe as a plain RecipeDetail-shaped dict.
+        """
+        recipe = {field: self.batch.field(self.row, field) for field in FIELDS}
+        for field in ("name", "notes", "recipe_id"):
+            recipe[field] = recipe[field] or ""
+        language = self.batch.field(self.row, "language")
+        if language:
+            recipe["language"] = language
+        return recipe
+
+    def __repr__(self):
+        return f"CompactRecipe(recipe_id={self.recipe_id!r}, name={self.name!r})"
+
+
+class RecipeBatch:
+    """
+    Immutable columnar batch of recipes.
+    """
+
+    def __init__(self, recipes=()):
+        """
+        Args:
+            recipes (iterable): RecipeDetail-shaped dicts, models or CompactRecipes.
+        """
+        self.strings = Vocabulary()
+        self.ingredients = Vocabulary()
+        columns = {name: [] for name in _ARRAYS}
+        for name in ("line_starts", "step_starts", "nutrition_starts"):
+            columns[name].append(0)
+
+        for recipe in recipes:
+            if hasattr(recipe, "model_dump"):
+                recipe = recipe.model_dump()
+            for column in _STRING_COLUMNS:
+                value = recipe.get(column)
+                columns[f"{column}_ids"].append(self.strings.id(None if value is None else str(value)))
+            for column in _NUMBER_COLUMNS:
+                value = recipe.get(column)
+                columns[column].append(-1 if value is None else int(value))
+            for line in recipe.get("ingredients") or []:
+                quantity, unit, name = parse_ingredient(line)
+                columns["lines"].append(self.strings.id(line))
+                columns["ingredient_ids"].append(self.ingredients.id(name))
+                columns["unit_ids"].append(_UNIT_IDS[unit])
+                columns["quantities"].append(np.nan if quantity is None else quantity)
+            columns["steps"].extend(self.strings.id(step) for step in recipe.get("steps") or [])
+            for key, value in (recipe.get("nutrition") or {}).items():
+                columns["nutrition_keys"].append(self.strings.id(key))
+                columns["nutrition_values"].append(value)
+            columns["line_starts"].append(len(columns["lines"]))
+            columns["step_starts"].append(len(columns["steps"]))
+            columns["nutrition_starts"].append(len(columns["nutrition_keys"]))
+
+        for name, dtype in _ARRAYS.items():
+            setattr(self, name, np.array(columns[name], dtype=dtype))
+
+    def __len__(self):
+        return len(self.recipe_id_ids)
+
+    def __getitem__(self, row):
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return CompactRecipe(self, row % len(self))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield CompactRecipe(self, row)
+
+    def field(self, row, field):
+        """
+        Returns:
+            The value of one RecipeDetail field of a recipe (or its "language"), None when unset.
+        """
+        if field in _STRING_COLUMNS:
+            return self.strings[int(getattr(self, f"{field}_ids")[row])]
+        if field in _NUMBER_COLUMNS:
+            value = int(getattr(self, field)[row])
+            return None if value < 0 else value
+        if field in ("ingredients", "steps"):
+            ids = self.lines if field == "ingredients" else self.steps
+            starts = self.line_starts if field == "ingredients" else self.step_starts
+            return [self.strings[string_id] or "" for string_id in ids[starts[row]:starts[row + 1]].tolist()]
+        if field == "nutrition":
+            start, end = self.nutrition_starts[row], self.nutrition_starts[row + 1]
+            keys = [self.strings[key] for key in self.nutrition_keys[start:end].tolist()]
+            return dict(zip(keys, self.nutrition_values[start:end].tolist()))
+        return None
+
+    def to_dicts(self):
+        """
+        Returns:
+            list: Every recipe as a plain RecipeDetail-shaped dict.
+        """
+        return [recipe.model_dump() for recipe in self]
+
+    def ingredient_name(self, ingredient_id):
+        return self.ingredients[int(ingredient_id)]
+
+    def shopping_rows(self, servings=None):
+        """
+        The parsed ingredient lines of every recipe, for shopping_list.build_shopping_list.
+
+        Args:
+            servings (int): Scale every recipe with known servings to this many servings.
+
+        Returns:
+            tuple: (canonical names, base units, quantities (NaN when unknown), recipe IDs, unparsed lines).
+        """
+        counts = np.diff(self.line_starts.astype(np.int64))
+        scale = np.ones(len(self), dtype=np.float64)
+        if servings:
+            known = self.servings > 0
+            scale[known] = servings / self.servings[known]
+        parsed = self.ingredient_ids != NO_STRING
+        quantities = (self.quantities.astype(np.float64) * np.repeat(scale, counts))[parsed]
+        rows = np.repeat(np.arange(len(self)), counts)[parsed]
+        names = [self.ingredients.strings[ingredient_id] for ingredient_id in self.ingredient_ids[parsed].tolist()]
+        units = [UNIT_NAMES[unit_id] for unit_id in self.unit_ids[parsed].tolist()]
+        recipe_ids = [self.strings[self.recipe_id_ids[row]] or "" for row in rows.tolist()]
+        unparsed = [self.strings[line] for line in self.lines[~parsed].tolist()]
+        return names, units, quantities, recipe_ids, unparsed
+
+    # -- Serialization -------------------------------------------------------
+
+    def to_bytes(self):
+        """
+        Returns:
+            bytes: The batch in a self-describing binary form (see from_bytes).
+        """
+        strings, ingredients = self.strings.to_bytes(), self.ingredients.to_bytes()
+        header = json.dumps({
+            "arrays": [[name, len(getattr(self, name))] for name in _ARRAYS],
+            "strings": [len(self.strings), len(strings)],
+            "ingredients": [len(self.ingredients), len(ingredients)],
+        }).encode("utf-8")
+        # Every section starts 8-byte aligned, so the arrays load in place
+        parts = [MAGIC, _padded(struct.pack("<I", len(header)) + header), _padded(strings), _padded(ingredients)]
+        parts.extend(_padded(getattr(self, name).tobytes()) for name in _ARRAYS)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Loads a batch written by to_bytes; the arrays share the given buffer.
+        """
+        data = memoryview(data)
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a recipe batch.")
+        (header_length,) = struct.unpack_from("<I", data, len(MAGIC))
+        position = len(MAGIC) + 4
+        header = json.loads(bytes(data[position:position + header_length]))
+        position += header_length + (-(header_length + 4) % 8)
+
+        batch = cls.__new__(cls)
+        for vocabulary in ("strings", "ingredients"):
+            count, length = header[vocabulary]
+            setattr(batch, vocabulary, Vocabulary.from_bytes(data[position:position + length], count))
+            position += length + (-length % 8)
+        for name, length in header["arrays"]:
+            dtype = np.dtype(_ARRAYS[name])
+            setattr(batch, name, np.frombuffer(data, dtype=dtype, count=length, offset=position))
+            position += length * dtype.itemsize + (-length * dtype.itemsize % 8)
+        return batch
+
+    def __reduce__(self):
+        return RecipeBatch.from_bytes, (self.to_bytes(),)
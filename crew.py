@@ -1,9 +1,21 @@
 import logging
-from crewai import Crew, Process
-from tasks import RecipeTasks
-from agents import RecipeAgents
 from dotenv import load_dotenv
+from cassette import replay_enabled
+from coalescing import SingleFlight, request_key
+from compact_recipes import RecipeBatch
+from dietary_rules import Restrictions, get_recipe_masks
+from meal_plan import get_plan_catalog, plan_meals
+from metrics import CACHE_REQUESTS, ERRORS, IN_FLIGHT, REQUESTS, STAGE_LATENCY
+from profiling import profile_request
+from recipe_index import get_recipe_index
+from result_cache import get_result_cache
+from scheduler import DagScheduler, TaskNode
+from schemas import CustomRecipe, FormattedRecipe, RecipeDetails, SearchResults
+from shopping_list import build_shopping_list
+from structured_output import StructuredOutputError, parse_stage_output
+from tokenization import tokenize
 import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -13,12 +25,54 @@ load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 model_name = os.getenv("OPENAI_MODEL_NAME", "ruslandev/llama-3-8b-gpt-4o")
 
-if not api_key or not model_name:
+# Replaying a cassette needs no API key
+if not model_name or (not api_key and not replay_enabled()):
     raise EnvironmentError("Missing OPENAI_API_KEY or OPENAI_MODEL_NAME in environment variables.")
 
+# Dish types counted under their own REQUESTS label, normalized like the recipe index's facets;
+# every other value is counted as "other" so user input cannot grow the label set
+METRIC_DISH_TYPES = {
+    " ".join(tokenize(dish_type, "en"))
+    for dish_type in (
+        "main course", "side dish", "dessert", "appetizer", "starter", "salad", "soup", "bread",
+        "breakfast", "brunch", "lunch", "dinner", "snack", "sandwich", "beverage", "drink",
+        "sauce", "marinade", "fingerfood", "tajine", "couscous", "pastry",
+    )
+}
+
+
+def dish_type_label(dish_type):
+    """
+    Returns:
+        str: The REQUESTS label for a requested dish type: its normalized form if known, else "other".
+    """
+    label = " ".join(tokenize(str(dish_type or "")))
+    return label if label in METRIC_DISH_TYPES else "other"
+
+
+def preload():
+    """
+    Imports the agent, task and tool modules (and crewai with them) now rather than on first use.
+
+    The crew modules defer these heavy imports, so CLIs and jobs that never build an agent
+    start fast. Long-running services call this before forking, so workers share the
+    loaded modules copy-on-write and the first request does not pay for them.
+    """
+    import crewai  # noqa: F401
+    import agents  # noqa: F401
+    import tasks  # noqa: F401
+    import tools  # noqa: F401
+
 
 class RecipeCrew:
-    def __init__(self, user_preferences, ingredient_filters, dish_type):
+    def __init__(self, user_preferences, ingredient_filters, dish_type, recipe_agents=None, page_size=None):
+        """
+        Args:
+            recipe_agents (RecipeAgents): Optional prebuilt agent factory, so long-running
+                workers build tools and clients once instead of per request.
+            page_size (int): Maximum number of search results fetched and formatted.
+                Defaults to SEARCH_PAGE_SIZE.
+        """
         # Validate input keys
         required_keys = ["dietary_restrictions", "preferred_cuisine", "avoid_ingredients", "servings"]
         for key in required_keys:
@@ -26,120 +80,317 @@ class RecipeCrew:
                 raise KeyError(f"Missing required key in user_preferences: '{key}'")
 
         self.user_preferences = user_preferences
+        self.restrictions = Restrictions(user_preferences)
         self.ingredient_filters = ingredient_filters
         self.dish_type = dish_type
+        self.page_size = page_size or int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+        self.next_cursor = None
+        self.recipe_details = RecipeBatch()
+
+        from agents import RecipeAgents
+        from tasks import RecipeTasks
 
         # Initialize agents
-        recipe_agents = RecipeAgents()
+        recipe_agents = recipe_agents or RecipeAgents()
         self.recipe_researcher = recipe_agents.recipe_researcher()
         self.recipe_creator = recipe_agents.recipe_creator()
         self.recipe_formatter = recipe_agents.recipe_formatter()
+        self.router = recipe_agents.router
 
-        # Initialize tasks
-        recipe_tasks = RecipeTasks()
-        self.tasks = [
-            recipe_tasks.search_recipes(
-                agent=self.recipe_researcher,
-                user_preferences=self.user_preferences,
-                ingredient_filters=self.ingredient_filters,
-                dish_type=self.dish_type,
-            ),
-            recipe_tasks.fetch_recipe_details(
-                agent=self.recipe_researcher,
-                recipe_ids=[],  # Dynamically updated later
-            ),
-            recipe_tasks.generate_custom_recipe(
-                agent=self.recipe_creator,
-                user_preferences=self.user_preferences,
-                ingredient_filters=self.ingredient_filters,
-            ),
-            recipe_tasks.format_recipe(
-                agent=self.recipe_formatter,
-                recipe_details=[],  # Dynamically updated later
-                custom_recipe=None,  # Dynamically updated later
-            ),
-        ]
-
-        # Setup the crew configuration
-        self.crew = Crew(
-            agents=[self.recipe_researcher, self.recipe_creator, self.recipe_formatter],
-            tasks=self.tasks,
-            process=Process.sequential,
-            memory=True,
-            cache=True,
-            max_rpm=100,
-            verbose=True,
-            share_crew=True,
-        )
+        # Each stage declares the values it reads and produces, mirroring the inputs and
+        # outputs of its Task in tasks.py. The scheduler runs generate alongside
+        # search -> fetch, since it needs neither of their results.
+        self.recipe_tasks = RecipeTasks()
+        self.scheduler = DagScheduler([
+            TaskNode("search", self._search, ["user_preferences", "ingredient_filters", "dish_type"], ["recipe_ids"]),
+            TaskNode("fetch", self._fetch, ["recipe_ids"], ["recipe_details"]),
+            TaskNode("generate", self._generate, ["user_preferences", "ingredient_filters"], ["custom_recipe"]),
+            TaskNode("format", self._format, ["recipe_details", "custom_recipe"], ["formatted_recipe"]),
+        ])
 
-    def run(self):
-        logging.info("Starting the recipe generation process...")
+    def run(self, profile=None, request_id=None):
+        """
+        Runs the pipeline, profiling it when RECIPE_PROFILE or the profile flag asks for it.
 
-        try:
-            # Step 1: Search for recipes
-            search_inputs = {
-                "user_preferences": self.user_preferences,
-                "ingredient_filters": self.ingredient_filters,
-                "dish_type": self.dish_type,
-            }
-            search_result = self.crew.kickoff(inputs=search_inputs)
-            logging.info("Search Result: %s", search_result)
+        Args:
+            profile: Per-request profiling flag: True, "all", or e.g. "cpu,wall".
+            request_id (str): Request ID used in profiling artifact names.
 
-            if not search_result or "recipe_ids" not in search_result:
-                raise KeyError("Search task failed. 'recipe_ids' key is missing.")
+        Returns:
+            FormattedRecipe: The formatted recipe, or None if the pipeline failed.
+        """
+        with profile_request(request_id, profile):
+            return self._run_pipeline()
 
-            recipe_ids = search_result["recipe_ids"]
-            logging.info("Recipe IDs Retrieved: %s", recipe_ids)
+    def shopping_list(self):
+        """
+        Returns:
+            dict: The combined shopping list of the recipes fetched by the last run,
+                scaled to the requested servings (see shopping_list.build_shopping_list).
+        """
+        return build_shopping_list(self.recipe_details, servings=self.user_preferences.get("servings"))
 
-            # Step 2: Fetch recipe details
-            fetch_inputs = {"recipe_ids": recipe_ids}
-            fetch_result = self.crew.kickoff(inputs=fetch_inputs)
-            logging.info("Fetch Result: %s", fetch_result)
+    def _kickoff(self, stage, agent_name, task, inputs, output_model):
+        return kickoff_stage(stage, agent_name, getattr(self, agent_name), task, inputs, output_model, self.router)
 
-            if not fetch_result or "recipe_details" not in fetch_result:
-                raise KeyError("Fetch task failed. 'recipe_details' key is missing.")
-
-            recipe_details = fetch_result["recipe_details"]
-            logging.info("Fetched Recipe Details: %s", recipe_details)
+    def _search(self, user_preferences, ingredient_filters, dish_type):
+        task = self.recipe_tasks.search_recipes(
+            agent=self.recipe_researcher,
+            user_preferences=user_preferences,
+            ingredient_filters=ingredient_filters,
+            dish_type=dish_type,
+        )
+        search_inputs = {
+            "user_preferences": user_preferences,
+            "ingredient_filters": ingredient_filters,
+            "dish_type": dish_type,
+            "page_size": self.page_size,
+        }
+        search_result = self._kickoff("search", "recipe_researcher", task, search_inputs, SearchResults)
 
-            # Step 3: Generate a custom recipe
-            generate_inputs = {
-                "user_preferences": self.user_preferences,
-                "ingredient_filters": self.ingredient_filters,
-            }
-            generate_result = self.crew.kickoff(inputs=generate_inputs)
-            logging.info("Generate Result: %s", generate_result)
+        # Only the first page goes through the fetch and format stages
+        self.next_cursor = search_result.next_cursor
+        recipe_ids = search_result.recipe_ids
+        recipe_masks = get_recipe_masks() if self.restrictions else None
+        if recipe_masks is not None:
+            index = get_recipe_index()
+            snapshot = index.snapshot() if index is not None else None
+            # IDs outside the catalog (found by the model) are checked on their ingredients in _fetch
+            recipe_ids = [
+                recipe_id for recipe_id in recipe_ids
+                if recipe_masks.allows(recipe_id, self.restrictions, snapshot, unknown=True)
+            ]
+        return {"recipe_ids": recipe_ids[:self.page_size]}
 
-            if not generate_result or "custom_recipe" not in generate_result:
-                raise KeyError("Generate task failed. 'custom_recipe' key is missing.")
+    def _fetch(self, recipe_ids):
+        task = self.recipe_tasks.fetch_recipe_details(agent=self.recipe_researcher, recipe_ids=recipe_ids)
+        fetch_result = self._kickoff("fetch", "recipe_researcher", task, {"recipe_ids": recipe_ids}, RecipeDetails)
+        recipe_details = []
+        for detail in fetch_result.recipes:
+            # Recipes the search could not check (e.g. found by the model) are checked on their ingredients
+            if self.restrictions and not self.restrictions.allows(detail.model_dump()):
+                logging.warning(
+                    "Dropped recipe %s: %s", detail.recipe_id, ", ".join(self.restrictions.violations(detail.model_dump()))
+                )
+                continue
+            recipe_details.append(detail)
+        # Held and passed on as one compact batch rather than a model per recipe
+        self.recipe_details = RecipeBatch(recipe_details)
+        return {"recipe_details": self.recipe_details}
 
-            custom_recipe = generate_result["custom_recipe"]
-            logging.info("Custom Recipe Generated: %s", custom_recipe)
+    def _generate(self, user_preferences, ingredient_filters):
+        task = self.recipe_tasks.generate_custom_recipe(
+            agent=self.recipe_creator,
+            user_preferences=user_preferences,
+            ingredient_filters=ingredient_filters,
+        )
+        generate_inputs = {"user_preferences": user_preferences, "ingredient_filters": ingredient_filters}
+        custom_recipe = self._kickoff("generate", "recipe_creator", task, generate_inputs, CustomRecipe)
+        if self.restrictions and not self.restrictions.allows(custom_recipe.model_dump()):
+            logging.warning(
+                "Custom recipe breaks the dietary restrictions: %s",
+                ", ".join(self.restrictions.violations(custom_recipe.model_dump())),
+            )
+        return {"custom_recipe": RecipeBatch([custom_recipe])[0]}
 
-            # Step 4: Format the recipe
-            format_inputs = {
-                "recipe_details": recipe_details,
-                "custom_recipe": custom_recipe,
-            }
-            formatted_result = self.crew.kickoff(inputs=format_inputs)
-            logging.info("Formatted Result: %s", formatted_result)
+    def _format(self, recipe_details, custom_recipe):
+        format_inputs = {
+            "recipe_details": recipe_details.to_dicts(),
+            "custom_recipe": custom_recipe.model_dump(),
+        }
+        task = self.recipe_tasks.format_recipe(agent=self.recipe_formatter, **format_inputs)
+        return {"formatted_recipe": self._kickoff("format", "recipe_formatter", task, format_inputs, FormattedRecipe)}
 
-            if not formatted_result or "formatted_recipe" not in formatted_result:
-                raise KeyError("Format task failed. 'formatted_recipe' key is missing.")
+    def _run_pipeline(self):
+        logging.info("Starting the recipe generation process...")
 
-            formatted_recipe = formatted_result["formatted_recipe"]
+        try:
+            values = self.scheduler.run({
+                "user_preferences": self.user_preferences,
+                "ingredient_filters": self.ingredient_filters,
+                "dish_type": self.dish_type,
+            })
+            formatted_recipe = values["formatted_recipe"]
             logging.info("Final Formatted Recipe: %s", formatted_recipe)
 
             return formatted_recipe
 
+        except StructuredOutputError as e:
+            ERRORS.inc(type=type(e).__name__)
+            logging.error("Stage output could not be parsed: %s", e)
         except KeyError as e:
+            ERRORS.inc(type=type(e).__name__)
             logging.error("KeyError: %s", e)
         except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
             logging.error("An unexpected error occurred: %s", e)
 
         return None
 
 
+def kickoff_stage(stage, agent_name, agent, task, inputs, output_model, router):
+    """
+    Runs one task as a single-agent crew and parses its typed output.
+
+    The stage's latency and the agent's own token usage are recorded against the
+    agent's model route.
+    """
+    from crewai import Crew, Process
+
+    crew = Crew(
+        agents=[agent],
+        tasks=[task],
+        process=Process.sequential,
+        memory=True,
+        cache=True,
+        max_rpm=100,
+        verbose=True,
+        share_crew=True,
+    )
+    route = router.route(agent=agent_name)
+    start = time.perf_counter()
+    with STAGE_LATENCY.time(stage=stage):
+        try:
+            output = crew.kickoff(inputs=inputs)
+        except Exception:
+            router.record("agent", agent_name, route, time.perf_counter() - start, error=True)
+            raise
+    usage = getattr(output, "token_usage", None) or getattr(crew, "usage_metrics", None) or {}
+    router.record(
+        "agent",
+        agent_name,
+        route,
+        time.perf_counter() - start,
+        _usage_value(usage, "prompt_tokens"),
+        _usage_value(usage, "completion_tokens"),
+    )
+
+    result = parse_stage_output(output, output_model)
+    logging.info("%s Result: %s", stage.capitalize(), result)
+    return result
+
+
+def _usage_value(usage, name):
+    # crewai reports token usage as a dict or as a UsageMetrics object, depending on the version
+    value = usage.get(name, 0) if isinstance(usage, dict) else getattr(usage, name, 0)
+    return value or 0
+
+
+recipe_flight = SingleFlight()
+
+
+def run_recipe_request(
+    user_preferences, ingredient_filters, dish_type, recipe_agents=None, use_cache=True, profile=None, request_id=None
+):
+    """
+    Runs the recipe pipeline, serving from the result cache and coalescing concurrent identical requests.
+
+    Requests are identical when their canonical form matches (see coalescing.request_key).
+    A cache hit skips every agent; duplicates arriving while one is running wait for it
+    and share its result.
+
+    Args:
+        use_cache (bool): Set to False to bypass the cache lookup (the result is still stored).
+        profile: Per-request profiling flag, see RecipeCrew.run.
+        request_id (str): Request ID used in profiling artifact names.
+
+    Returns:
+        FormattedRecipe: The formatted recipe, or None if the pipeline failed.
+    """
+    key = request_key(user_preferences, ingredient_filters, dish_type)
+    result_cache = get_result_cache()
+    REQUESTS.inc(dish_type=dish_type_label(dish_type))
+
+    if use_cache:
+        cached = result_cache.get(key)
+        CACHE_REQUESTS.inc(cache="result", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logging.info("Result cache hit for request %s.", key[:12])
+            return FormattedRecipe.model_validate(cached)
+
+    @IN_FLIGHT.track_inprogress()
+    def run_pipeline():
+        recipe_crew = RecipeCrew(user_preferences, ingredient_filters, dish_type, recipe_agents=recipe_agents)
+        formatted_recipe = recipe_crew.run(profile=profile, request_id=request_id)
+        if formatted_recipe is not None:
+            result_cache.set(key, formatted_recipe.model_dump())
+        return formatted_recipe
+
+    return recipe_flight.do(key, run_pipeline)
+
+
+def invalidate_recipe_request(user_preferences, ingredient_filters, dish_type):
+    """
+    Drops the cached result for a request and every request equivalent to it.
+
+    Returns:
+        bool: True if a cached result was removed.
+    """
+    return get_result_cache().invalidate(request_key(user_preferences, ingredient_filters, dish_type))
+
+
+def run_meal_plan(user_preferences, days=7, recipe_agents=None):
+    """
+    Plans meals from the local catalog, then sends only the chosen recipes through the LLM.
+
+    The chosen catalog recipes go through the formatter once each. Only slots no catalog
+    recipe fits get a custom recipe from the Recipe Creator, seeded with the plan's
+    ingredients so it reuses them.
+
+    Returns:
+        dict: The plan (see meal_plan.MealPlanner.plan) plus "formatted_recipes" by recipe ID,
+            "custom_recipes" for the unfilled slots and the combined "shopping_list".
+    """
+    from agents import RecipeAgents
+    from tasks import RecipeTasks
+
+    catalog = get_plan_catalog()
+    plan = plan_meals(user_preferences, days=days, recipes=catalog)
+    recipe_agents = recipe_agents or RecipeAgents()
+    logging.info(
+        "Planned %d meals (%d distinct ingredients), %d slots left for the creator.",
+        len(plan["recipe_ids"]), len(plan["shopping_ingredients"]), len(plan["unfilled"]),
+    )
+
+    plan["custom_recipes"] = []
+    if plan["unfilled"]:
+        recipe_tasks = RecipeTasks()
+        recipe_creator = recipe_agents.recipe_creator()
+        for gap in plan["unfilled"]:
+            preferences = dict(user_preferences, meal=gap["slot"])
+            ingredient_filters = plan["shopping_ingredients"][:10]
+            task = recipe_tasks.generate_custom_recipe(
+                agent=recipe_creator, user_preferences=preferences, ingredient_filters=ingredient_filters
+            )
+            try:
+                custom_recipe = kickoff_stage(
+                    "generate",
+                    "recipe_creator",
+                    recipe_creator,
+                    task,
+                    {"user_preferences": preferences, "ingredient_filters": ingredient_filters},
+                    CustomRecipe,
+                    recipe_agents.router,
+                )
+            except Exception as e:
+                ERRORS.inc(type=type(e).__name__)
+                logging.error("Custom recipe for day %d %s failed: %s", gap["day"], gap["slot"], e)
+                continue
+            plan["custom_recipes"].append(dict(gap, recipe=custom_recipe.model_dump()))
+
+    details = [catalog.get(recipe_id) for recipe_id in plan["recipe_ids"]]
+    formatted = recipe_agents.recipe_formatter_tool._run({"result_details": details}) if details else {}
+    plan["shopping_list"] = build_shopping_list(
+        details + [custom["recipe"] for custom in plan["custom_recipes"]], servings=user_preferences.get("servings")
+    )
+    plan["formatted_recipes"] = {
+        detail["recipe_id"]: result
+        for detail, result in zip(details, formatted.get("formatted_results", []))
+        if "error" not in result
+    }
+    return plan
+
+
 if __name__ == "__main__":
     logging.info("## Welcome to the Recipe Generator Crew ##")
 
@@ -158,7 +409,7 @@ if __name__ == "__main__":
         formatted_recipe = recipe_crew.run()
 
         if formatted_recipe:
-            logging.info("Formatted Recipe:\n%s", formatted_recipe)
+            logging.info("Formatted Recipe:\n%s", formatted_recipe.render())
         else:
             logging.warning("Failed to generate a formatted recipe.")
     except KeyError as e:
@@ -0,0 +1,434 @@
+import logging
+from array import array
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pantry import canonical_ingredient
+from recipe_index import DerivedIndex, tokenize
+from tokenization import fold
+
+"""
+Dietary restrictions and allergens as bitmasks.
+
+Every canonical ingredient maps to a mask of the categories it belongs to
+(meat, dairy, gluten, ...), and a recipe's mask is the OR of its ingredients'.
+The user's dietary_restrictions and avoid_ingredients compile into a mask of
+forbidden categories, so checking a recipe is a single AND:
+
+    eligible = recipe_mask & forbidden == 0
+
+Recipe masks are precomputed for the local catalog (see get_recipe_masks) and
+applied as a hard filter before any LLM stage, instead of trusting the prompt.
+
+dietary_restrictions are looked up in RESTRICTIONS (English and French diet and
+allergen names). Values with no ingredient category ("low carb") and unknown
+values are logged and left to the prompt; they never become ingredient words.
+Avoided ingredients that are not a known category or diet ("coriander") are
+matched as plain ingredient words.
+"""
+
+load_dotenv()
+
+CATEGORIES = (
+    "meat", "pork", "poultry", "fish", "shellfish", "egg", "dairy", "honey", "gluten",
+    "tree_nut", "peanut", "soy", "sesame", "alcohol", "gelatin", "mustard", "celery",
+)
+CATEGORY_BITS = {category: 1 << position for position, category in enumerate(CATEGORIES)}
+
+
+def _mask(categories):
+    mask = 0
+    for category in categories:
+        mask |= CATEGORY_BITS[category]
+    return mask
+
+
+# Ingredient words (after recipe_index.tokenize) in each category
+CATEGORY_KEYWORDS = {
+    "meat": {
+        "beef", "lamb", "veal", "mutton", "venison", "steak", "mince", "goat", "rabbit", "salami", "chorizo",
+        "merguez", "kefta", "khlii", "gueddid", "mrouzia",
+    },
+    "pork": {
+        "pork", "bacon", "ham", "prosciutto", "pancetta", "lard", "sausage", "chorizo", "salami", "guanciale",
+        "lardon", "jambon", "porc", "saucisson",
+    },
+    "poultry": {"chicken", "turkey", "duck", "goose", "quail", "pigeon", "dinde", "canard"},
+    "fish": {"fish", "salmon", "tuna", "cod", "anchovy", "sardine", "trout", "mackerel", "halibut", "haddock"},
+    "shellfish": {"shrimp", "prawn", "crab", "lobster", "mussel", "clam", "oyster", "scallop", "squid", "octopus"},
+    "egg": {"egg", "mayonnaise", "meringue"},
+    "dairy": {
+        "milk", "butter", "cheese", "cream", "yogurt", "ghee", "parmesan", "mozzarella", "feta", "ricotta",
+        "mascarpone", "buttermilk", "whey", "smen", "jben", "lben", "raib", "fromage", "creme", "yaourt",
+    },
+    "honey": {"honey"},
+    "gluten": {
+        "wheat", "flour", "bread", "pasta", "spaghetti", "noodle", "barley", "rye", "couscous", "breadcrumb",
+        "semolina", "bulgur", "seitan", "tortilla", "cracker", "panko", "vermicelli", "vermicelle", "warka",
+        "msemen", "baghrir", "harcha", "chebakia",
+    },
+    "tree_nut": {"almond", "walnut", "cashew", "pecan", "pistachio", "hazelnut", "macadamia", "nut", "noix", "amlou"},
+    "peanut": {"peanut"},
+    "soy": {"soy", "tofu", "tempeh", "edamame", "miso"},
+    "sesame": {"sesame", "tahini", "jljlan"},
+    "alcohol": {"wine", "beer", "rum", "vodka", "brandy", "whisky", "sake", "mirin"},
+    "gelatin": {"gelatin", "gelatine"},
+    "mustard": {"mustard"},
+    "celery": {"celery", "celeriac"},
+}
+
+# Keywords are written plainly and matched in their tokenized form ("octopus" -> "octopu"), as
+# stemmed in English and in French text ("noix" -> "noi")
+CATEGORY_KEYWORDS = {
+    category: {" ".join(tokenize(keyword, language)) for keyword in keywords for language in ("en", "fr")} - {""}
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+# Whole canonical names whose words would otherwise put them in the wrong category
+INGREDIENT_OVERRIDES = {
+    "coconut milk": set(), "almond milk": {"tree_nut"}, "oat milk": set(), "soy milk": {"soy"},
+    "rice milk": set(), "peanut butter": {"peanut"}, "almond butter": {"tree_nut"}, "cocoa butter": set(),
+    "nutmeg": set(), "butternut squash": set(), "coconut cream": set(), "gluten free flour": set(),
+    "rice flour": set(), "corn tortilla": set(), "rice noodle": set(), "soy sauce": {"soy", "gluten"},
+}
+
+_OVERRIDES = {canonical_ingredient(name): _mask(categories) for name, categories in INGREDIENT_OVERRIDES.items()}
+
+_ANIMAL = {"meat", "pork", "poultry", "fish", "shellfish", "gelatin"}
+
+# Diets and allergen names (as written in user_preferences, English or French) -> forbidden categories.
+# Diets no ingredient category captures map to no categories and are left to the prompt.
+RESTRICTIONS = {
+    "vegetarian": _ANIMAL,
+    "vegan": _ANIMAL | {"egg", "dairy", "honey"},
+    "pescatarian": {"meat", "pork", "poultry", "gelatin"},
+    "halal": {"pork", "alcohol", "gelatin"},
+    "kosher": {"pork", "shellfish"},
+    "gluten free": {"gluten"},
+    "dairy free": {"dairy"},
+    "lactose free": {"dairy"},
+    "nut free": {"tree_nut", "peanut"},
+    "pork free": {"pork"},
+    "alcohol free": {"alcohol"},
+    "egg free": {"egg"},
+    "gluten": {"gluten"},
+    "dairy": {"dairy"},
+    "lactose": {"dairy"},
+    "meat": {"meat", "pork", "poultry"},
+    "seafood": {"fish", "shellfish"},
+    "nut": {"tree_nut", "peanut"},
+    "nuts": {"tree_nut", "peanut"},
+    "tree nut": {"tree_nut"},
+    "vegetarien": _ANIMAL,
+    "vegetarienne": _ANIMAL,
+    "vegetalien": _ANIMAL | {"egg", "dairy", "honey"},
+    "vegetalienne": _ANIMAL | {"egg", "dairy", "honey"},
+    "pescetarien": {"meat", "pork", "poultry", "gelatin"},
+    "casher": {"pork", "shellfish"},
+    "sans gluten": {"gluten"},
+    "sans lactose": {"dairy"},
+    "sans produits laitiers": {"dairy"},
+    "sans porc": {"pork"},
+    "sans viande": {"meat", "pork", "poultry"},
+    "sans alcool": {"alcohol"},
+    "sans oeuf": {"egg"},
+    "sans oeufs": {"egg"},
+    "sans noix": {"tree_nut", "peanut"},
+    "sans arachide": {"peanut"},
+    "low carb": set(),
+    "keto": set(),
+    "low fat": set(),
+    "low sodium": set(),
+    "low calorie": set(),
+    "high protein": set(),
+    "diabetic": set(),
+    "sans sucre": set(),
+}
+RESTRICTIONS.update({category.replace("_", " "): {category} for category in CATEGORIES})
+# Values that mean "no restriction"
+NO_RESTRICTION = {"none", "no", "nothing", "no restriction", "no restrictions", "n a", "aucun", "aucune", "rien"}
+
+
+def _restriction_name(item):
+    return " ".join(fold(item).replace("-", " ").replace("_", " ").replace("/", " ").split())
+
+
+_RESTRICTION_MASKS = {_restriction_name(name): _mask(categories) for name, categories in RESTRICTIONS.items()}
+# Also matched in their tokenized form, so plurals and lexicon spellings find the same entry. Not when
+# the entry forbids nothing, or when that form is an ingredient ("sans sucre" -> "sugar", "sans noix"
+# -> "noi") outside exactly the entry's categories: avoiding the ingredient must not find another entry
+for _name, _mask_value in list(_RESTRICTION_MASKS.items()):
+    _alias = " ".join(tokenize(_name))
+    _alias_categories = _mask(category for category, keywords in CATEGORY_KEYWORDS.items() if _alias in keywords)
+    if _mask_value and _alias_categories in (0, _mask_value):
+        _RESTRICTION_MASKS.setdefault(_alias, _mask_value)
+
+
+def restriction_mask(item):
+    """
+    Returns:
+        int: The forbidden category mask of a diet or allergen name, 0 for a known diet
+            without categories or "none", and None for names that are not known.
+    """
+    name = _restriction_name(item)
+    if not name or name in NO_RESTRICTION:
+        return 0
+    mask = _RESTRICTION_MASKS.get(name)
+    if mask is None:
+        mask = _RESTRICTION_MASKS.get(" ".join(tokenize(name)))
+    return mask
+
+
+def ingredient_mask(ingredient):
+    """
+    Returns:
+        int: The category mask of a canonical ingredient name.
+    """
+    override = _OVERRIDES.get(ingredient)
+    if override is not None:
+        return override
+    words = set(ingredient.split())
+    return _mask(category for category, keywords in CATEGORY_KEYWORDS.items() if words & keywords)
+
+
+def recipe_mask(recipe):
+    """
+    Returns:
+        int: The OR of the category masks of a recipe's ingredients.
+    """
+    mask = 0
+    for line in recipe.get("ingredients") or []:
+        ingredient = canonical_ingredient(line)
+        if ingredient:
+            mask |= ingredient_mask(ingredient)
+    return mask
+
+
+def _as_list(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+class Restrictions:
+    """
+    A user's dietary restrictions and avoided ingredients, compiled once per request.
+    """
+
+    def __init__(self, user_preferences):
+        self.forbidden = 0
+        # Avoided ingredients that are not a known category, matched word by word
+        self.words = set()
+        for item in _as_list(user_preferences.get("dietary_restrictions")):
+            mask = restriction_mask(item)
+            if mask is None:
+                logging.warning("Unknown dietary restriction '%s'; left to the prompt.", item)
+            else:
+                self.forbidden |= mask
+        for item in _as_list(user_preferences.get("avoid_ingredients")):
+            mask = restriction_mask(item)
+            if mask is None:
+                self.words.update(tokenize(str(item).replace("-", " ")))
+            else:
+                self.forbidden |= mask
+
+    def __bool__(self):
+        return bool(self.forbidden or self.words)
+
+    def allows(self, recipe, mask=None):
+        """
+        Checks one recipe.
+
+        Args:
+            recipe (dict): A RecipeDetail-shaped dict.
+            mask (int): The recipe's precomputed mask, if known.
+        """
+        if (recipe_mask(recipe) if mask is None else mask) & self.forbidden:
+            return False
+        if self.words:
+            for line in recipe.get("ingredients") or []:
+                if set((canonical_ingredient(line) or "").split()) & self.words:
+                    return False
+        return True
+
+    def violations(self, recipe):
+        """
+        Returns:
+            list: The categories and avoided words a recipe breaks, for logging.
+        """
+        mask = recipe_mask(recipe) & self.forbidden
+        broken = [category for category in CATEGORIES if mask & CATEGORY_BITS[category]]
+        for line in recipe.get("ingredients") or []:
+            broken.extend(sorted(set((canonical_ingredient(line) or "").split()) & self.words))
+        return broken
+
+
+class RecipeMasks:
+    """
+    Precomputed category masks for a recipe catalog, filtered in bulk with numpy.
+
+    Also keeps, for every canonical ingredient word, the rows of the recipes
+    using it, so avoided ingredients outside any category ("coriander") are
+    filtered as hard as categories.
+    """
+
+    def __init__(self, recipes, sequence=None):
+        """
+        Args:
+            recipes (iterable): RecipeDetail-shaped dicts.
+            sequence (int): Recipe index sequence the recipes were read at; None for a static corpus.
+        """
+        self.sequence = sequence
+        self.recipe_ids = []
+        masks = []
+        self.word_ids = {}
+        word_ids = array("i")
+        word_rows = array("i")
+        for row, recipe in enumerate(recipes):
+            self.recipe_ids.append(str(recipe["recipe_id"]))
+            mask = 0
+            words = set()
+            for line in recipe.get("ingredients") or []:
+                ingredient = canonical_ingredient(line)
+                if ingredient:
+                    mask |= ingredient_mask(ingredient)
+                    words.update(ingredient.split())
+            masks.append(mask)
+            for word in words:
+                word_ids.append(self.word_ids.setdefault(word, len(self.word_ids)))
+                word_rows.append(row)
+        self.masks = np.array(masks, dtype=np.uint64)
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(self.recipe_ids)}
+        # (recipe ID list, its rows here) of the structure eligible_rows last mapped to
+        self._row_map = (None, None)
+
+        # Rows per word, CSR style; the stable sort keeps each word's rows ascending
+        word_ids = np.array(word_ids, dtype=np.int32)
+        self.word_rows = np.array(word_rows, dtype=np.int32)[np.argsort(word_ids, kind="stable")]
+        self.word_starts = np.zeros(len(self.word_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(word_ids, minlength=len(self.word_ids)), out=self.word_starts[1:])
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def mask(self, recipe_id):
+        """
+        Returns:
+            int: The recipe's mask, or None for recipes not in the catalog.
+        """
+        row = self.rows.get(str(recipe_id))
+        return None if row is None else int(self.masks[row])
+
+    def rows_using(self, word):
+        """
+        Returns:
+            numpy.ndarray: The ascending rows of the recipes with an ingredient containing the word.
+        """
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            return self.word_rows[:0]
+        return self.word_rows[self.word_starts[word_id]:self.word_starts[word_id + 1]]
+
+    def eligible(self, forbidden, words=()):
+        """
+        Returns:
+            numpy.ndarray: A boolean array over the catalog rows, True where no forbidden
+                category and no avoided ingredient word occurs.
+        """
+        eligible = (self.masks & np.uint64(forbidden)) == 0
+        for word in words:
+            eligible[self.rows_using(word)] = False
+        return eligible
+
+    def current(self, snapshot):
+        """
+        Returns:
+            bool: Whether the masks were built from the catalog version of an index snapshot
+                (None for the corpus, which does not change).
+        """
+        return snapshot is None or self.sequence == snapshot.sequence
+
+    def allows(self, recipe_id, restrictions, snapshot=None, unknown=False):
+        """
+        Checks a recipe against the category and avoided ingredient rules, failing closed.
+
+        Args:
+            snapshot (IndexSnapshot): The snapshot being searched. The masks are rebuilt in the
+                background after a write, so while they are older than the snapshot, or do not
+                know the recipe yet, the recipe's current record is checked instead.
+            unknown (bool): Result for recipes with no record to check, e.g. found by the model;
+                only pass True when they are checked later on their ingredients.
+
+        Returns:
+            bool: Whether the recipe passes.
+        """
+        row = self.rows.get(str(recipe_id))
+        if row is None or not self.current(snapshot):
+            recipe = snapshot.get(recipe_id) if snapshot is not None else None
+            if recipe is not None:
+                return restrictions.allows(recipe)
+            # Deleted since the masks were built, or never in the catalog
+            return unknown and row is None
+        if int(self.masks[row]) & restrictions.forbidden:
+            return False
+        for word in restrictions.words:
+            rows = self.rows_using(word)
+            position = np.searchsorted(rows, row)
+            if position < len(rows) and rows[position] == row:
+                return False
+        return True
+
+    def eligible_rows(self, restrictions, recipe_ids):
+        """
+        Checks a whole catalog structure built from the same source, e.g. a PantryIndex.
+
+        Args:
+            recipe_ids (list): The structure's recipe ID per row.
+
+        Returns:
+            numpy.ndarray: A boolean array over the structure's rows, True where the recipe passes
+                the category and avoided ingredient checks; recipes the masks do not know fail.
+        """
+        eligible = self.eligible(restrictions.forbidden, restrictions.words)
+        mapped_ids, rows = self._row_map
+        if mapped_ids is not recipe_ids:
+            # Built from the same catalog version, the rows line up; otherwise map them once per structure
+            if recipe_ids == self.recipe_ids:
+                rows = None
+            else:
+                rows = np.array([self.rows.get(recipe_id, -1) for recipe_id in recipe_ids], dtype=np.int64)
+            self._row_map = (recipe_ids, rows)
+        if rows is None:
+            return eligible
+        return (rows >= 0) & eligible[rows]
+
+
+_recipe_masks = DerivedIndex("dietary masks")
+
+
+def get_recipe_masks(index=None, corpus=None):
+    """
+    Returns RecipeMasks for the local catalog, or None when there is none.
+
+    Built from the recipe index when one is configured (and rebuilt in the
+    background once its snapshot has changed), otherwise from the recipe corpus.
+    """
+    if index is None and corpus is None:
+        from recipe_corpus import get_recipe_corpus
+        from recipe_index import get_recipe_index
+
+        index = get_recipe_index()
+        corpus = None if index is not None else get_recipe_corpus()
+
+    if index is not None:
+        snapshot = index.snapshot()
+        source = (id(index), snapshot.sequence)
+        recipes = (recipe for _, recipe in snapshot.recipes.items())
+    elif corpus is not None:
+        source = (id(corpus), None)
+        recipes = iter(corpus)
+    else:
+        return None
+
+    return _recipe_masks.get(source, lambda: RecipeMasks(recipes, sequence=source[1]))
@@ -0,0 +1,581 @@
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from array import array
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+from recipe_index import DerivedIndex
+from tokenization import tokenize
+
+"""
+Full-text recipe search with BM25 ranking.
+
+Searches recipe titles, ingredients and steps for free text such as
+'slow-cooked with "preserved lemon"'. Terms come from tokenization.tokenize,
+like the ingredient index, so queries match across languages and spellings.
+
+Scoring is BM25F: each field's term frequency is normalized by the field's
+length and weighted by its boost (FULL_TEXT_BOOSTS, title 3, ingredients 2,
+steps 1 by default) before the BM25 saturation. Unquoted words are optional
+and rank by score; adjacent query words also score as a phrase. Quoted phrases
+are required. Phrases are matched through word pairs (bigrams), hashed into a
+fixed number of posting lists next to the words, so they need no positions;
+longer phrases match when all their words and pairs occur.
+
+Two backends share one interface (search(query, dish_type, offset, limit, accept)):
+- FullTextIndex: in memory. Posting lists are delta- and varbyte-compressed
+  row numbers with a precomputed float16 score per posting, so a query only
+  decodes and adds them up with numpy: about 3.5 bytes per posting.
+- SqliteFullTextIndex: an SQLite FTS5 table (FULL_TEXT_BACKEND=sqlite) at
+  FULL_TEXT_DB_PATH, for catalogs that should not live in memory. It is
+  rebuilt only when the catalog changed. Prefork workers share the file: it is
+  in WAL mode so searches never wait for a rebuild, and rebuilds are serialized,
+  so only the first worker to see a new catalog rewrites the table.
+"""
+
+load_dotenv()
+
+FIELDS = ("title", "ingredients", "steps")
+FIELD_BOOSTS = {"title": 3.0, "ingredients": 2.0, "steps": 1.0}
+
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def _boosts():
+    # FULL_TEXT_BOOSTS="title=4,steps=0.5" overrides single fields
+    boosts = dict(FIELD_BOOSTS)
+    for item in os.getenv("FULL_TEXT_BOOSTS", "").split(","):
+        field, _, value = item.partition("=")
+        if field.strip() in boosts and value:
+            boosts[field.strip()] = float(value)
+    return boosts
+
+
+def recipe_fields(recipe):
+    """
+    Returns:
+        tuple: The recipe's title, ingredients and steps, each a list of lines.
+    """
+    return (
+        [recipe.get("name") or ""],
+        list(recipe.get("ingredients") or []),
+        list(recipe.get("steps") or []),
+    )
+
+
+def _bigrams(terms):
+    return [f"{first} {second}" for first, second in zip(terms, terms[1:])]
+
+
+def parse_query(query):
+    """
+    Splits a query into optional terms and required phrases.
+
+    Returns:
+        tuple: (optional terms, including the bigrams of adjacent words; list of
+            required phrases, each a list of terms).
+    """
+    phrases = [tokenize(phrase) for phrase in _PHRASE.findall(query)]
+    words = tokenize(_PHRASE.sub(" ", query))
+    terms = list(dict.fromkeys(words + _bigrams(words)))
+    return terms, [phrase for phrase in phrases if phrase]
+
+
+def _varbyte(values):
+    # 7 bits per byte, with the high bit set on every byte but the last of each value
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        lengths += values >= (1 << shift)
+    ends = np.cumsum(lengths)
+    positions = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths, lengths)
+    encoded = ((np.repeat(values, lengths) >> (7 * positions).astype(np.uint32)) & 0x7F).astype(np.uint8)
+    encoded[positions < np.repeat(lengths, lengths) - 1] |= 0x80
+    return encoded, ends
+
+
+def _unvarbyte(encoded):
+    ends = np.flatnonzero(encoded < 0x80)
+    if len(ends) == len(encoded):
+        return encoded.astype(np.uint32)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    positions = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    parts = (encoded & 0x7F).astype(np.uint32) << (7 * positions).astype(np.uint32)
+    return np.add.reduceat(parts, starts)
+
+
+class PostingList:
+    """
+    Compressed row numbers of one term, with a score per row.
+
+    Rows are split into blocks of BLOCK_SIZE. Each block stores its first row
+    and varbyte-encoded deltas, so single blocks decode on their own and lookups
+    of a few rows skip the rest of the list.
+    """
+
+    __slots__ = ("data", "firsts", "offsets", "impacts", "max_impact")
+
+    BLOCK_SIZE = 128
+
+    def __init__(self, data, firsts, offsets, impacts, max_impact):
+        """
+        Args:
+            data (numpy.ndarray): The encoded deltas of all blocks, as uint8.
+            firsts (numpy.ndarray): First row of each block.
+            offsets (numpy.ndarray): Start of each block in data, plus the end of the last.
+            impacts (numpy.ndarray): Score of the term in each row.
+            max_impact (float): The highest of those scores.
+        """
+        self.data = data
+        self.firsts = firsts
+        self.offsets = offsets
+        self.impacts = impacts
+        self.max_impact = max_impact
+
+    def __len__(self):
+        return len(self.impacts)
+
+    def decode(self, blocks=None):
+        """
+        Args:
+            blocks (numpy.ndarray): Sorted block numbers to decode; all blocks by default.
+
+        Returns:
+            tuple: (row numbers, positions of those rows in the list, e.g. to index impacts).
+        """
+        if blocks is None:
+            blocks = np.arange(len(self.firsts))
+            encoded = self.data
+        else:
+            starts = self.offsets[blocks]
+            lengths = self.offsets[blocks + 1] - starts
+            gathered = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            encoded = self.data[gathered]
+        sizes = np.minimum(self.BLOCK_SIZE, len(self) - blocks * self.BLOCK_SIZE)
+        block_starts = np.cumsum(sizes) - sizes
+        positions = np.arange(sizes.sum()) + np.repeat(blocks * self.BLOCK_SIZE - block_starts, sizes)
+        totals = np.cumsum(_unvarbyte(encoded), dtype=np.int64)
+        rows = totals - np.repeat(totals[block_starts] - self.firsts[blocks], sizes)
+        return rows, positions
+
+    def lookup(self, rows):
+        """
+        Returns:
+            tuple: (numpy.ndarray, numpy.ndarray): The term's score in each of the given sorted rows
+                (0 where it does not occur) and whether it occurs there.
+        """
+        blocks = np.unique(np.searchsorted(self.firsts, rows, side="right") - 1)
+        blocks = blocks[blocks >= 0]
+        scores = np.zeros(len(rows), dtype=np.float32)
+        if not len(blocks):
+            return scores, np.zeros(len(rows), dtype=bool)
+        block_rows, positions = self.decode(None if len(blocks) * 2 > len(self.firsts) else blocks)
+        found = np.minimum(np.searchsorted(block_rows, rows), len(block_rows) - 1)
+        hits = block_rows[found] == rows
+        scores[hits] = self.impacts[positions[found[hits]]]
+        return scores, hits
+
+
+class FullTextIndex:
+    """
+    In-memory BM25F index over recipe titles, ingredients and steps.
+    """
+
+    def __init__(self, recipes, boosts=None, k1=1.2, b=0.75, lazy_share=0.02, bigram_buckets=1 << 22):
+        """
+        Args:
+            recipes (iterable): RecipeDetail-shaped dicts.
+            boosts (dict): Weight per field; defaults to FIELD_BOOSTS and FULL_TEXT_BOOSTS.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 length normalization.
+            lazy_share (float): Terms in more than this share of recipes (and at least
+                10000) are looked up per candidate rather than scanned, when that is safe.
+            bigram_buckets (int): Word pairs are hashed into this many posting lists instead
+                of keeping a vocabulary of every pair. Required phrases also require their
+                words, so a collision rarely matches.
+        """
+        self.boosts = np.array([(boosts or _boosts())[field] for field in FIELDS], dtype=np.float32)
+        self.recipe_ids = []
+        self.names = []
+        self.dish_type_codes = {}
+        dish_types = []
+        lengths = []
+        self.bigram_buckets = bigram_buckets
+        self.vocabulary = {}
+        # One entry per (recipe, term), sorted into posting lists at the end
+        entry_terms, entry_rows = array("I"), array("I")
+        entry_counts = [array("B") for _ in FIELDS]
+
+        for row, recipe in enumerate(recipes):
+            self.recipe_ids.append(str(recipe["recipe_id"]))
+            self.names.append(recipe.get("name") or "")
+            dish_type = " ".join(tokenize(recipe.get("dish_type") or ""))
+            dish_types.append(self.dish_type_codes.setdefault(dish_type, len(self.dish_type_codes)))
+            language = recipe.get("language")
+            counters = []
+            for lines in recipe_fields(recipe):
+                counter = Counter()
+                for line in lines:
+                    terms = tokenize(line, language)
+                    counter.update(terms)
+                    counter.update(_bigrams(terms))
+                counters.append(counter)
+            lengths.append([sum(count for term, count in counter.items() if " " not in term) for counter in counters])
+            for term in set().union(*counters):
+                entry_terms.append(self._term_key(term, add=True))
+                entry_rows.append(row)
+                for field, counter in enumerate(counters):
+                    entry_counts[field].append(min(counter.get(term, 0), 255))
+
+        self.dish_types = np.array(dish_types, dtype=np.int32)
+        self.lazy_postings = max(10000, int(lazy_share * len(self.recipe_ids)))
+        lengths = np.array(lengths, dtype=np.float32).reshape(-1, len(FIELDS))
+        average_lengths = np.maximum(lengths.mean(axis=0), 1.0) if len(lengths) else np.ones(len(FIELDS))
+
+        terms = np.frombuffer(entry_terms, dtype=np.uint32)
+        rows = np.frombuffer(entry_rows, dtype=np.uint32)
+        counts = np.stack([np.frombuffer(field_counts, dtype=np.uint8) for field_counts in entry_counts], axis=1)
+        # Rows are appended in order, so a stable sort by term keeps each posting list sorted by row
+        order = np.argsort(terms, kind="stable")
+        terms, rows, counts = terms[order], rows[order], counts[order]
+        bounds = np.flatnonzero(np.diff(terms)) + 1
+        starts = np.concatenate(([0], bounds)).astype(np.int64)
+        ends = np.concatenate((bounds, [len(terms)])).astype(np.int64)
+        if not len(terms):
+            starts = ends = starts[:0]
+
+        # BM25F scores do not depend on the query, so every posting stores its score (impact)
+        # and a query only adds them up
+        tf = (counts * self.boosts / (1.0 - b + b * lengths[rows] / average_lengths)).sum(axis=1)
+        df = np.repeat(ends - starts, ends - starts)
+        idf = np.log(1.0 + (len(self.recipe_ids) - df + 0.5) / (df + 0.5))
+        impacts = (idf * tf * (k1 + 1) / (tf + k1)).astype(np.float16)
+
+        # All posting lists in one set of arrays, in the order of their term keys
+        self.term_keys = terms[starts].astype(np.int64)
+        self.impacts = impacts
+        self.term_starts = np.concatenate((starts, [len(rows)])).astype(np.int64)
+        self.max_impacts = np.maximum.reduceat(impacts, starts) if len(starts) else impacts
+        position = np.arange(len(rows)) - np.repeat(starts, ends - starts)
+        block_starts = np.flatnonzero(position % PostingList.BLOCK_SIZE == 0)
+        deltas = np.diff(rows, prepend=np.uint32(0)).astype(np.uint32)
+        deltas[block_starts] = 0
+        self.block_firsts = rows[block_starts]
+        self.term_blocks = np.concatenate(([0], np.cumsum(-(-(ends - starts) // PostingList.BLOCK_SIZE)))).astype(np.int64)
+        data, byte_ends = [], []
+        for chunk in range(0, len(deltas), 1 << 22):
+            encoded, chunk_ends = _varbyte(deltas[chunk:chunk + (1 << 22)])
+            byte_ends.append(chunk_ends + sum(len(part) for part in data))
+            data.append(encoded)
+        self.data = np.concatenate(data) if data else np.zeros(0, dtype=np.uint8)
+        byte_ends = np.concatenate(byte_ends) if byte_ends else np.zeros(0, dtype=np.int64)
+        block_lasts = np.concatenate((block_starts[1:], [len(rows)])) - 1 if len(rows) else block_starts
+        self.block_offsets = np.concatenate(([0], byte_ends[block_lasts])).astype(np.int64)
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def _term_key(self, term, add=False):
+        # Word pairs hash to keys below bigram_buckets, words get the keys above
+        if " " in term:
+            return zlib.crc32(term.encode()) % self.bigram_buckets
+        if add:
+            return self.bigram_buckets + self.vocabulary.setdefault(term, len(self.vocabulary))
+        word_id = self.vocabulary.get(term)
+        return None if word_id is None else self.bigram_buckets + word_id
+
+    def postings(self, term):
+        """
+        Returns:
+            PostingList: The term's postings, or None for terms no recipe contains.
+        """
+        key = self._term_key(term)
+        term_id = int(np.searchsorted(self.term_keys, key)) if key is not None else len(self.term_keys)
+        if term_id == len(self.term_keys) or self.term_keys[term_id] != key:
+            return None
+        first_block, end_block = self.term_blocks[term_id], self.term_blocks[term_id + 1]
+        base = self.block_offsets[first_block]
+        return PostingList(
+            self.data[base:self.block_offsets[end_block]],
+            self.block_firsts[first_block:end_block],
+            self.block_offsets[first_block:end_block + 1] - base,
+            self.impacts[self.term_starts[term_id]:self.term_starts[term_id + 1]],
+            float(self.max_impacts[term_id]),
+        )
+
+    def search(self, query, dish_type=None, offset=0, limit=10, accept=None):
+        """
+        Ranks recipes against a query.
+
+        Args:
+            query (str): Free text; "quoted phrases" are required.
+            dish_type (str): Only return recipes of this dish type.
+            offset (int): Number of ranked (and accepted) results to skip.
+            limit (int): Number of results to return.
+            accept (callable): Optional recipe_id -> bool filter applied while ranking.
+
+        Returns:
+            list: Dicts with recipe_id, name and score, best first.
+        """
+        if limit <= 0:
+            return []
+        terms, phrases = parse_query(query)
+        scores = np.zeros(len(self), dtype=np.float32)
+        # Rows matching every phrase: the rarest phrase term is scanned, the others only looked up
+        phrase_postings = [self.postings(term) for phrase in phrases for term in phrase + _bigrams(phrase)]
+        if None in phrase_postings:
+            return []
+        required = None
+        for posting in sorted(phrase_postings, key=len):
+            if required is None:
+                required, positions = posting.decode()
+                required_scores = posting.impacts[positions].astype(np.float32)
+            else:
+                term_scores, hits = posting.lookup(required)
+                required, required_scores = required[hits], required_scores[hits] + term_scores[hits]
+        if required is not None:
+            scores[required] += required_scores
+
+        # Terms in a large share of the catalog score low and cost the most to scan.
+        # They are only looked up for the rows that can still reach the results.
+        postings = [posting for posting in map(self.postings, terms) if posting is not None]
+        common = [posting for posting in postings if len(posting) > self.lazy_postings]
+        for posting in postings:
+            if len(posting) <= self.lazy_postings:
+                rows, positions = posting.decode()
+                scores[rows] += posting.impacts[positions]
+
+        dish_type_code = self.dish_type_codes.get(" ".join(tokenize(dish_type)), -1) if dish_type else None
+
+        def eligible_rows():
+            rows = required if required is not None else np.flatnonzero(scores > 0)
+            if dish_type_code is not None:
+                rows = rows[self.dish_types[rows] == dish_type_code]
+            return rows
+
+        rows = eligible_rows()
+        wanted = offset + limit
+        # Scan common terms, highest possible score first, until the rest cannot change the page
+        common.sort(key=lambda posting: posting.max_impact)
+        while common:
+            threshold = -np.partition(-scores[rows], wanted - 1)[wanted - 1] if wanted <= len(rows) else 0.0
+            bound = sum(posting.max_impact for posting in common)
+            # Rows the scanned terms scored below threshold - bound cannot make the page, even
+            # with every remaining term, so only the others get exact scores, when they are few
+            candidates = rows[scores[rows] + bound >= threshold] if threshold > bound else None
+            if candidates is not None and len(candidates) * 8 <= sum(len(posting) for posting in common):
+                candidate_scores = scores[candidates] + sum(posting.lookup(candidates)[0] for posting in common)
+                ranked = self._accepted(candidates, candidate_scores, wanted, accept)
+                if len(ranked) == wanted:
+                    return self._results(candidates[ranked[offset:]], candidate_scores[ranked[offset:]])
+                break
+            posting = common.pop()
+            common_rows, positions = posting.decode()
+            scores[common_rows] += posting.impacts[positions]
+            rows = eligible_rows()
+        for posting in common:
+            common_rows, positions = posting.decode()
+            scores[common_rows] += posting.impacts[positions]
+        if common:
+            rows = eligible_rows()
+        ranked = self._accepted(rows, scores[rows], wanted, accept, exhaustive=True)
+        return self._results(rows[ranked[offset:]], scores[rows[ranked[offset:]]])
+
+    def _accepted(self, rows, row_scores, wanted, accept, exhaustive=False):
+        # Positions in rows of the first `wanted` accepted rows, best score first, then row order.
+        # Ranks only as deep as needed, deeper while accept drops results; without exhaustive,
+        # only the first `wanted` ranked rows are trusted.
+        depth = wanted
+        while True:
+            ranked = np.arange(len(rows))
+            if depth < len(rows):
+                top = np.argpartition(-row_scores, depth - 1)[:depth]
+                # Add everything tied with the last row, so pages stay stable under ties
+                ranked = np.flatnonzero(row_scores >= row_scores[top].min())
+            ranked = ranked[np.lexsort((rows[ranked], -row_scores[ranked]))]
+            if not exhaustive:
+                ranked = ranked[:wanted]
+            accepted = []
+            for position in ranked:
+                if accept is None or accept(self.recipe_ids[rows[position]]):
+                    accepted.append(position)
+                    if len(accepted) == wanted:
+                        break
+            if len(accepted) == wanted or len(ranked) == len(rows) or not exhaustive:
+                return np.array(accepted, dtype=np.int64)
+            depth *= 2
+
+    def _results(self, rows, row_scores):
+        return [
+            {"recipe_id": self.recipe_ids[row], "name": self.names[row], "score": float(score)}
+            for row, score in zip(rows, row_scores)
+        ]
+
+
+class SqliteFullTextIndex:
+    """
+    The same search on an SQLite FTS5 table, kept on disk.
+
+    Fields are stored as tokenize() terms, so queries match the way they do in
+    FullTextIndex; ranking uses FTS5's bm25() with the field boosts as column weights.
+    """
+
+    def __init__(self, path, boosts=None, timeout=30.0):
+        """
+        Args:
+            path (str): Database file.
+            boosts (dict): Weight per field; defaults to FIELD_BOOSTS and FULL_TEXT_BOOSTS.
+            timeout (float): Seconds to wait for another process's write before
+                sqlite3.OperationalError ("database is locked").
+        """
+        self.path = path
+        self.boosts = boosts or _boosts()
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS recipe_text USING fts5("
+                "recipe_id UNINDEXED, name UNINDEXED, dish_type UNINDEXED, title, ingredients, steps, "
+                "tokenize = 'unicode61 remove_diacritics 0')"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS recipe_text_source (source TEXT)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=self.timeout)
+        return connection
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM recipe_text").fetchone()[0]
+
+    def source(self):
+        row = self._connection().execute("SELECT source FROM recipe_text_source").fetchone()
+        return row[0] if row else None
+
+    def rebuild(self, recipes, source):
+        """
+        Replaces the table's contents in one transaction, unless it already holds the source.
+
+        Args:
+            recipes (iterable): RecipeDetail-shaped dicts.
+            source (str): Identifies the catalog version, so unchanged catalogs are not rebuilt.
+
+        Returns:
+            bool: Whether the table was rebuilt.
+        """
+        def rows():
+            for recipe in recipes:
+                language = recipe.get("language")
+                yield (
+                    str(recipe["recipe_id"]),
+                    recipe.get("name") or "",
+                    " ".join(tokenize(recipe.get("dish_type") or "")),
+                    *("\n".join(" ".join(tokenize(line, language)) for line in lines) for lines in recipe_fields(recipe)),
+                )
+
+        with self._connection() as connection:
+            # Takes the write lock up front: a worker that waited for another's rebuild
+            # finds the table current and skips its own
+            connection.execute("BEGIN IMMEDIATE")
+            if self.source() == source:
+                return False
+            connection.execute("DELETE FROM recipe_text")
+            connection.executemany("INSERT INTO recipe_text VALUES (?, ?, ?, ?, ?, ?)", rows())
+            connection.execute("DELETE FROM recipe_text_source")
+            connection.execute("INSERT INTO recipe_text_source VALUES (?)", (source,))
+        return True
+
+    def search(self, query, dish_type=None, offset=0, limit=10, accept=None):
+        """
+        Ranks recipes against a query; see FullTextIndex.search.
+        """
+        terms, phrases = parse_query(query)
+        words = [term for term in terms if " " not in term]
+        if not words and not phrases:
+            return []
+        match = " AND ".join(f'"{" ".join(phrase)}"' for phrase in phrases)
+        if words:
+            optional = " OR ".join(f'"{term}"' for term in terms)
+            match = f"({optional}) AND {match}" if match else optional
+        weights = ", ".join(str(self.boosts[field]) for field in FIELDS)
+        sql = (
+            f"SELECT recipe_id, name, -bm25(recipe_text, 0, 0, 0, {weights}) AS score FROM recipe_text "
+            "WHERE recipe_text MATCH ?"
+        )
+        parameters = [match]
+        if dish_type:
+            sql += " AND dish_type = ?"
+            parameters.append(" ".join(tokenize(dish_type)))
+        sql += " ORDER BY score DESC, rowid"
+        if accept is None:
+            sql += " LIMIT ? OFFSET ?"
+            parameters += [limit, offset]
+
+        results = []
+        skipped = 0
+        for recipe_id, name, score in self._connection().execute(sql, parameters):
+            if accept is not None:
+                if not accept(recipe_id):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+            results.append({"recipe_id": recipe_id, "name": name, "score": score})
+            if len(results) == limit:
+                break
+        return results
+
+
+_full_text_index = DerivedIndex("full-text index")
+
+
+def get_full_text_index(index=None, corpus=None):
+    """
+    Returns the full-text index over the local catalog, or None when there is none.
+
+    Built from the recipe index when one is configured (and rebuilt in the
+    background once its snapshot has changed), otherwise from the recipe corpus.
+    FULL_TEXT_BACKEND picks "memory" (the default) or "sqlite".
+
+    Args:
+        index (RecipeIndex): Recipe index to use. Defaults to RECIPE_INDEX_DIR.
+        corpus (RecipeCorpus): Corpus to use without an index. Defaults to RECIPE_CORPUS_PATH.
+    """
+    if index is None and corpus is None:
+        from recipe_corpus import get_recipe_corpus
+        from recipe_index import get_recipe_index
+
+        index = get_recipe_index()
+        corpus = None if index is not None else get_recipe_corpus()
+
+    if index is not None:
+        snapshot = index.snapshot()
+        source = (id(index), snapshot.sequence)
+        stored_source = f"index:{os.path.abspath(index.directory)}:{snapshot.sequence}"
+        recipes = (recipe for _, recipe in snapshot.recipes.items())
+    elif corpus is not None:
+        source = (id(corpus), None)
+        stored_source = f"corpus:{os.path.abspath(corpus.path)}:{os.path.getmtime(corpus.path)}"
+        recipes = iter(corpus)
+    else:
+        return None
+
+    def build():
+        if os.getenv("FULL_TEXT_BACKEND", "memory") != "sqlite":
+            return FullTextIndex(recipes)
+        # Searches keep reading the table's last committed contents while it is rebuilt. A
+        # sqlite3.OperationalError (another worker held it past the timeout) keeps the previous index.
+        full_text_index = SqliteFullTextIndex(
+            os.getenv("FULL_TEXT_DB_PATH", "recipe_text.db"), timeout=float(os.getenv("FULL_TEXT_DB_TIMEOUT", "30"))
+        )
+        if full_text_index.source() != stored_source:
+            full_text_index.rebuild(recipes, stored_source)
+        return full_text_index
+
+    return _full_text_index.get(source, build)
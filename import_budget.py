@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from dotenv import load_dotenv
+
+"""
+Import-time budget check.
+
+CLIs and short-lived job workers pay the import time of every module they
+load, on every start. The crew modules therefore import crewai, crewai_tools,
+langchain and openai only on first use, when an agent, task or tool is built
+(crew.preload() loads them up front for long-running services).
+
+This check imports each entry point in a fresh interpreter with
+`python -X importtime`. It fails when:
+- the module's cumulative import time (the fastest of --runs, as load on the
+  machine only ever adds time) is more than IMPORT_BUDGET_TOLERANCE (default
+  20%) above its recorded baseline, scaled by IMPORT_BUDGET_SCALE for slower
+  machines; IMPORT_BUDGET_SLACK_MS (default 5 ms) is added so the fastest
+  modules do not fail on timer noise;
+- the import pulls in one of the deferred dependencies.
+
+Baselines live in import_baseline.json next to this file. Record them again
+with --record (and more --runs), on the machine the check runs on, after an
+intended change.
+
+Usage:
+    python import_budget.py
+    python import_budget.py --modules crew ingest --runs 9
+    python import_budget.py --report 15
+    python import_budget.py --record
+"""
+
+load_dotenv()
+
+ENTRY_POINTS = (
+    "crew",
+    "agents",
+    "tasks",
+    "server",
+    "warm_cache",
+    "benchmark",
+    "ingest",
+    "near_duplicates",
+    "full_text",
+    "meal_plan",
+    "recipe_index",
+    "recipe_corpus",
+)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_baseline.json")
+# Imported on first use only; importing any entry point above must not load them
+DEFERRED = ("crewai", "crewai_tools", "langchain", "langchain_core", "langchain_community", "openai")
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def measure(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple: (cumulative import time in ms, {imported module: self time in ms}).
+
+    Raises:
+        RuntimeError: When the import fails.
+    """
+    env = dict(os.environ)
+    # The crew modules refuse to import without model settings; no call is made
+    if not env.get("OPENAI_API_KEY"):
+        env["OPENAI_API_KEY"] = "import-budget-check"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        error = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"import {module} failed:\n{error}")
+
+    cumulative = None
+    self_times = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_time, total, indent, name = match.groups()
+        self_times[name] = int(self_time) / 1000
+        if len(indent) == 1 and name == module:
+            cumulative = int(total) / 1000
+    return cumulative, self_times
+
+
+def load_baseline(path=BASELINE_PATH):
+    """
+    Returns:
+        dict: Module -> recorded cumulative import time in ms, empty when nothing was recorded.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """
+    Records the measured times as the new baseline, keeping modules that were not measured.
+    """
+    baseline = load_baseline(path)
+    baseline.update({result["module"]: round(result["ms"], 1) for result in results})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(baseline.items())), f, indent=2)
+        f.write("\n")
+
+
+def check(modules, runs=5, scale=1.0, tolerance=0.2, slack=5.0, baseline=None):
+    """
+    Measures modules against their recorded baselines.
+
+    Args:
+        scale (float): Factor applied to every baseline, for machines slower than the recording one.
+        tolerance (float): Allowed relative increase over the scaled baseline.
+        slack (float): Milliseconds added to every budget, to absorb timer noise.
+        baseline (dict): Module -> baseline ms. Defaults to load_baseline().
+
+    Returns:
+        list: Per module a dict with its fastest "ms", "budget_ms" (None without a baseline),
+            the "deferred" dependencies it imported, the "slowest" imports of its last run and "ok".
+    """
+    baseline = load_baseline() if baseline is None else baseline
+    results = []
+    for module in modules:
+        # The first run also writes bytecode caches, so it is not timed
+        measure(module)
+        timings = []
+        for _ in range(runs):
+            cumulative, self_times = measure(module)
+            timings.append(cumulative)
+        budget = baseline.get(module)
+        budget = budget * scale * (1 + tolerance) + slack if budget is not None else None
+        milliseconds = min(timings)
+        deferred = sorted({name.split(".")[0] for name in self_times} & set(DEFERRED))
+        results.append({
+            "module": module,
+            "ms": milliseconds,
+            "budget_ms": budget,
+            "deferred": deferred,
+            "slowest": sorted(self_times.items(), key=lambda item: item[1], reverse=True),
+            "ok": not deferred and (budget is None or milliseconds <= budget),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail when entry points import too slowly or too eagerly.")
+    parser.add_argument("--modules", nargs="+", default=list(ENTRY_POINTS), help="Modules to check.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed imports per module; the fastest counts.")
+    parser.add_argument("--scale", type=float, default=float(os.getenv("IMPORT_BUDGET_SCALE", "1")))
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("IMPORT_BUDGET_TOLERANCE", "0.2")))
+    parser.add_argument("--slack", type=float, default=float(os.getenv("IMPORT_BUDGET_SLACK_MS", "5")))
+    parser.add_argument("--report", type=int, default=0, help="Also list each module's N slowest imports.")
+    parser.add_argument("--record", action="store_true", help="Record the measured times as the new baseline.")
+    args = parser.parse_args()
+
+    # While recording, only the deferred dependencies are checked
+    results = check(
+        args.modules,
+        runs=args.runs,
+        scale=args.scale,
+        tolerance=args.tolerance,
+        slack=args.slack,
+        baseline={} if args.record else None,
+    )
+    if args.record:
+        save_baseline(results)
+        print(f"Recorded the baseline of {len(results)} modules in {BASELINE_PATH}.")
+    for result in results:
+        budget = f"{result['budget_ms']:.0f} ms" if result["budget_ms"] is not None else "-"
+        status = "ok" if result["ok"] else "FAIL"
+        deferred = f"  imports {', '.join(result['deferred'])}" if result["deferred"] else ""
+        print(f"{status:4}  {result['module']:18} {result['ms']:8.1f} ms  (budget {budget}){deferred}")
+        for name, milliseconds in result["slowest"][:args.report]:
+            print(f"        {milliseconds:8.1f} ms  {name}")
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
@@ -0,0 +1,607 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from schemas import RecipeDetail
+
+"""
+Parallel, resumable ingestion of recipe dumps into the local recipe index.
+
+Input files are streamed from disk, never loaded whole:
+- JSONL (.jsonl, .ndjson): one recipe object per line;
+- CSV (.csv): one recipe per row, list columns as JSON arrays or "|"-separated;
+- schema.org Recipe documents (.html, .htm, .json, .jsonld): the Recipe objects of
+  their JSON-LD, including those inside @graph.
+
+The main process cuts the input into chunks (INGEST_CHUNK_SIZE records, or
+INGEST_FILES_PER_CHUNK documents). A process pool parses and normalizes the
+chunks into RecipeDetail-shaped dicts, and the main process writes each chunk
+to the index in one batch: one WAL append and fsync, atomic for readers.
+Chunks are written in input order with a bounded number in flight, so memory
+stays flat however large the dump.
+
+Resuming: after writes, the byte offset reached in each file (the number of
+documents done, for document files) is checkpointed. A restarted run skips
+what the checkpoint covers. Chunks written after the last checkpoint are read
+again and upserted, so a crash at any point loses and duplicates nothing.
+
+With --dedup, near-duplicates (see near_duplicates) are dropped. The workers
+compute the MinHash signatures; the main process checks them against the
+catalog.
+
+Usage:
+    python ingest.py dumps/ --index recipe_index --workers 4
+    python ingest.py recipes.jsonl pages/ --dedup --mapping duplicates.json
+"""
+
+load_dotenv()
+
+FORMATS = {
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".csv": "csv",
+    ".html": "document",
+    ".htm": "document",
+    ".json": "document",
+    ".jsonld": "document",
+}
+
+# Source field names -> RecipeDetail field
+_ALIASES = {
+    "id": "recipe_id",
+    "title": "name",
+    "directions": "steps",
+    "instructions": "steps",
+    "method": "steps",
+    "total_time": "cooking_time",
+    "yield": "servings",
+    "category": "dish_type",
+    "course": "dish_type",
+    "description": "notes",
+    "lang": "language",
+}
+_LIST_FIELDS = ("ingredients", "steps")
+
+_JSON_LD = re.compile(r"<script[^>]*application/ld\+json[^>]*>(.*?)</script>", re.IGNORECASE | re.DOTALL)
+_DURATION = re.compile(r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:[\d.]+S)?)?$", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_TAG = re.compile(r"<[^>]+>")
+
+
+def _minutes(value):
+    # ISO 8601 durations ("PT1H30M") or plain numbers of minutes
+    if isinstance(value, str):
+        match = _DURATION.match(value.strip())
+        if match and any(match.groups()):
+            days, hours, minutes = (int(group or 0) for group in match.groups())
+            return days * 1440 + hours * 60 + minutes
+    return value
+
+
+def _text(value):
+    if isinstance(value, dict):
+        value = value.get("text") or value.get("name") or ""
+    return " ".join(_TAG.sub(" ", str(value)).split())
+
+
+def _list(value):
+    # JSON arrays, "|"- or newline-separated text, or a single value
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped.startswith("["):
+            try:
+                value = json.loads(stripped)
+            except ValueError:
+                pass
+        if isinstance(value, str):
+            separator = "|" if "|" in value else "\n"
+            return [part.strip() for part in value.split(separator) if part.strip()]
+    if not isinstance(value, list):
+        value = [value]
+    return [text for text in map(_text, value) if text]
+
+
+def _instructions(value):
+    # schema.org recipeInstructions: text, HowToStep objects or HowToSections of steps
+    steps = []
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, dict) and item.get("itemListElement"):
+            steps.extend(_instructions(item["itemListElement"]))
+        else:
+            steps.extend(_list(item))
+    return steps
+
+
+def _nutrition(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    nutrition = {}
+    for key, amount in (value or {}).items():
+        if key.startswith("@"):
+            continue
+        match = _NUMBER.search(str(amount))
+        if match:
+            # schema.org "fatContent" -> "fat"
+            key = re.sub(r"(?<!^)(?=[A-Z])", "_", key[:-7] if key.endswith("Content") else key).lower()
+            nutrition[key] = float(match.group().replace(",", "."))
+    return nutrition
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+def _is_recipe(item):
+    types = item.get("@type")
+    return "Recipe" in (types if isinstance(types, list) else [types])
+
+
+def _schema_recipe(item):
+    return {
+        "recipe_id": item.get("identifier") or item.get("@id") or item.get("url"),
+        "name": item.get("name"),
+        "ingredients": _list(item.get("recipeIngredient") or item.get("ingredients")),
+        "steps": _instructions(item.get("recipeInstructions") or []),
+        "cooking_time": _minutes(item.get("totalTime") or item.get("cookTime")),
+        "servings": _first(item.get("recipeYield")),
+        "cuisine": _first(item.get("recipeCuisine")),
+        "dish_type": _first(item.get("recipeCategory")),
+        "nutrition": _nutrition(item.get("nutrition")),
+        "notes": _text(item.get("description") or ""),
+        "language": item.get("inLanguage"),
+    }
+
+
+def normalize(record):
+    """
+    Maps a source record to a RecipeDetail-shaped dict.
+
+    Accepts schema.org Recipe objects and flat records using RecipeDetail field
+    names or common aliases ("title", "directions", ...). Recipes without an ID
+    get one derived from their name and ingredients, so re-ingesting them is idempotent.
+
+    Raises:
+        ValueError: For records with neither a name nor ingredients.
+    """
+    if _is_recipe(record):
+        recipe = _schema_recipe(record)
+    else:
+        recipe = {}
+        for key, value in record.items():
+            field = _ALIASES.get(str(key).strip().lower(), str(key).strip().lower())
+            if value not in (None, "") and recipe.get(field) in (None, ""):
+                recipe[field] = value
+        for field in _LIST_FIELDS:
+            recipe[field] = _list(recipe.get(field))
+        recipe["cooking_time"] = _minutes(recipe.get("cooking_time"))
+        recipe["nutrition"] = _nutrition(recipe.get("nutrition"))
+        if "calories" in recipe and "calories" not in recipe["nutrition"]:
+            recipe["nutrition"].update(_nutrition({"calories": recipe["calories"]}))
+
+    if not recipe.get("name") and not recipe.get("ingredients"):
+        raise ValueError("record has neither a name nor ingredients")
+    if not recipe.get("recipe_id"):
+        digest = hashlib.sha1(json.dumps([recipe.get("name"), recipe["ingredients"]]).encode("utf-8"))
+        recipe["recipe_id"] = digest.hexdigest()[:16]
+    language = _first(recipe.get("language"))
+    normalized = RecipeDetail.model_validate({key: value for key, value in recipe.items() if value is not None})
+    recipe = normalized.model_dump()
+    if isinstance(language, str) and language:
+        recipe["language"] = language.split("-")[0].lower()
+    return recipe
+
+
+def document_recipes(text):
+    """
+    Returns:
+        list: The schema.org Recipe objects in an HTML page's JSON-LD, or in a JSON-LD document.
+    """
+    blocks = _JSON_LD.findall(text) if "<" in text.lstrip()[:1] else [text]
+    recipes = []
+    pending = []
+    for block in blocks:
+        try:
+            pending.append(json.loads(block))
+        except ValueError:
+            continue
+    while pending:
+        item = pending.pop()
+        if isinstance(item, list):
+            pending.extend(reversed(item))
+        elif isinstance(item, dict):
+            if _is_recipe(item):
+                recipes.append(item)
+            elif "@graph" in item:
+                pending.extend(reversed(item["@graph"]) if isinstance(item["@graph"], list) else [item["@graph"]])
+    return recipes
+
+
+# -- Workers -----------------------------------------------------------------
+
+_detector = None
+
+
+def _init_worker(dedup):
+    global _detector
+    if dedup:
+        from near_duplicates import NearDuplicateDetector
+
+        _detector = NearDuplicateDetector()
+
+
+def parse_chunk(kind, payload):
+    """
+    Parses and normalizes one chunk in a worker process.
+
+    Args:
+        kind (str): "jsonl" (payload: raw lines), "csv" (payload: (header, rows)),
+            "document" (payload: file paths) or "recipe" (payload: normalized recipes).
+
+    Returns:
+        dict: "recipes", their "signatures" when deduplicating, and "errors" as
+            (position in the chunk, message) pairs.
+    """
+    records, errors = [], []
+    if kind == "jsonl":
+        for position, line in enumerate(payload):
+            try:
+                if line.strip():
+                    records.append((position, json.loads(line)))
+            except ValueError as e:
+                errors.append((position, str(e)))
+    elif kind == "csv":
+        header, rows = payload
+        records = [(position, dict(zip(header, row))) for position, row in enumerate(rows)]
+    elif kind == "document":
+        for position, path in enumerate(payload):
+            try:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    records.extend((position, item) for item in document_recipes(f.read()))
+            except OSError as e:
+                errors.append((position, str(e)))
+    else:
+        records = list(enumerate(payload))
+
+    recipes = []
+    for position, record in records:
+        try:
+            recipes.append(record if kind == "recipe" else normalize(record))
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append((position, str(e)))
+    signatures = [_detector.signature(recipe) for recipe in recipes] if _detector is not None else None
+    return {"recipes": recipes, "signatures": signatures, "errors": errors}
+
+
+# -- Reading -----------------------------------------------------------------
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _lines(f, offset):
+    # Raw lines with the byte offset after each
+    for line in f:
+        offset += len(line)
+        yield line, offset
+
+
+def read_chunks(path, kind, offset, chunk_size):
+    """
+    Streams a JSONL or CSV file from a byte offset in chunks of records.
+
+    Yields:
+        tuple: (payload for parse_chunk, byte offset after the chunk).
+    """
+    with open(path, "rb") as f:
+        if kind == "jsonl":
+            f.seek(offset)
+            chunk = []
+            for line, end in _lines(f, offset):
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield chunk, end
+                    chunk = []
+            if chunk:
+                yield chunk, end
+            return
+
+        # CSV records can span lines, so the offset is only taken between records
+        position = [0]
+
+        def decoded(lines):
+            for line, end in lines:
+                position[0] = end
+                yield line.decode("utf-8", errors="replace")
+
+        reader = csv.reader(decoded(_lines(f, 0)))
+        header = next(reader, None)
+        if header is None:
+            return
+        if offset > position[0]:
+            f.seek(offset)
+            reader = csv.reader(decoded(_lines(f, offset)))
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                yield (header, rows), position[0]
+                rows = []
+        if rows:
+            yield (header, rows), position[0]
+
+
+def input_files(paths):
+    """
+    Returns:
+        list: The ingestible files in the given files and directories (recursively), sorted.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                found for found in glob.glob(os.path.join(path, "**", "*"), recursive=True) if os.path.isfile(found)
+            )
+        else:
+            files.append(path)
+    return sorted(os.path.abspath(found) for found in files if os.path.splitext(found)[1].lower() in FORMATS)
+
+
+# -- Checkpoints -------------------------------------------------------------
+
+
+class Checkpoint:
+    """
+    Progress of an ingestion run: per input, the fingerprint it was read with and how far it was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.positions = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.positions = json.load(f)
+
+    def start(self, key, fingerprint):
+        """
+        Returns:
+            int: Where to resume an input: 0 unless it was checkpointed with the same fingerprint.
+        """
+        entry = self.positions.get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            self.positions[key] = {"fingerprint": fingerprint, "position": 0}
+        return self.positions[key]["position"]
+
+    def advance(self, key, position):
+        self.positions[key]["position"] = position
+
+    def save(self):
+        if not self.path:
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.positions, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+
+# -- Pipeline ----------------------------------------------------------------
+
+
+class Ingestion:
+    """
+    One ingestion run into a RecipeIndex.
+    """
+
+    def __init__(self, index, workers=None, chunk_size=None, files_per_chunk=None, checkpoint=None,
+                 detector=None, checkpoint_every=10.0, progress_every=5.0):
+        """
+        Args:
+            index (RecipeIndex): Index to write to.
+            workers (int): Worker processes (default INGEST_WORKERS, else the CPU count).
+            chunk_size (int): JSONL/CSV records per chunk and index write (default INGEST_CHUNK_SIZE).
+            files_per_chunk (int): Documents per chunk (default INGEST_FILES_PER_CHUNK).
+            checkpoint (Checkpoint): Where to resume from and record progress.
+            detector (NearDuplicateDetector): Drops near-duplicates when given.
+            checkpoint_every (float): Seconds between checkpoints.
+            progress_every (float): Seconds between progress reports.
+        """
+        self.index = index
+        self.workers = int(workers or os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+        self.chunk_size = int(chunk_size or os.getenv("INGEST_CHUNK_SIZE", "1000"))
+        self.files_per_chunk = int(files_per_chunk or os.getenv("INGEST_FILES_PER_CHUNK", "50"))
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.detector = detector
+        self.checkpoint_every = checkpoint_every
+        self.progress_every = progress_every
+        self.stats = {"recipes": 0, "duplicates": 0, "errors": 0, "bytes": 0}
+
+    def _units(self, files):
+        # (input key, kind, payload, position after the chunk, bytes in the chunk)
+        documents = [path for path in files if FORMATS[os.path.splitext(path)[1].lower()] == "document"]
+        for path in files:
+            kind = FORMATS[os.path.splitext(path)[1].lower()]
+            if kind == "document":
+                continue
+            offset = self.checkpoint.start(path, _fingerprint(path))
+            for payload, end in read_chunks(path, kind, offset, self.chunk_size):
+                yield path, kind, payload, end, end - offset
+                offset = end
+
+        if documents:
+            key = "documents:" + hashlib.sha1("\n".join(documents).encode("utf-8")).hexdigest()
+            done = self.checkpoint.start(key, {"files": len(documents)})
+            for start in range(done, len(documents), self.files_per_chunk):
+                chunk = documents[start:start + self.files_per_chunk]
+                yield key, "document", chunk, start + len(chunk), sum(os.path.getsize(path) for path in chunk)
+
+    def seed(self, pool):
+        """
+        Adds the recipes already in the index to the detector, so new recipes are checked against them.
+        """
+        recipes = [recipe for _, recipe in self.index.snapshot().recipes.items()]
+        chunks = [recipes[start:start + self.chunk_size] for start in range(0, len(recipes), self.chunk_size)]
+        for result in pool.map(parse_chunk, ["recipe"] * len(chunks), chunks):
+            for recipe, signatures in zip(result["recipes"], result["signatures"]):
+                self.detector.add(recipe, signatures)
+        if recipes:
+            logging.info("Seeded duplicate detection with %d indexed recipes.", len(recipes))
+
+    def write(self, recipes):
+        """
+        Upserts recipes into the index in one batch.
+        """
+        snapshot = self.index.snapshot()
+        operations, batch = [], set()
+        for recipe in recipes:
+            exists = recipe["recipe_id"] in batch or snapshot.get(recipe["recipe_id"]) is not None
+            operations.append(("update" if exists else "add", recipe))
+            batch.add(recipe["recipe_id"])
+        if operations:
+            self.index.apply(operations)
+
+    def _commit(self, key, end, size, result, source):
+        recipes = result["recipes"]
+        if self.detector is not None:
+            kept = []
+            for recipe, signatures in zip(recipes, result["signatures"]):
+                # add() returns the recorded canonical ID for IDs seen before: a kept recipe read
+                # again (after a crash, or re-ingested) is upserted, a recorded duplicate stays dropped
+                if self.detector.add(recipe, signatures) == str(recipe["recipe_id"]):
+                    kept.append(recipe)
+            self.stats["duplicates"] += len(recipes) - len(kept)
+            recipes = kept
+        self.write(recipes)
+        for position, message in result["errors"][:3]:
+            logging.warning("Skipped record %d of a chunk of %s: %s", position, source, message)
+        self.stats["recipes"] += len(recipes)
+        self.stats["errors"] += len(result["errors"])
+        self.stats["bytes"] += size
+        self.checkpoint.advance(key, end)
+
+    def run(self, files, on_checkpoint=None):
+        """
+        Ingests files, resuming from the checkpoint.
+
+        Args:
+            files (list): Input file paths (see input_files).
+            on_checkpoint (callable): Called before each checkpoint is saved, e.g. to persist a duplicate mapping.
+
+        Returns:
+            dict: Counts of recipes written, duplicates dropped, records skipped and bytes read.
+        """
+        start = last_progress = last_checkpoint = time.monotonic()
+
+        def checkpoint():
+            if on_checkpoint:
+                on_checkpoint()
+            self.checkpoint.save()
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.detector is not None,)
+        ) as pool:
+            if self.detector is not None:
+                self.seed(pool)
+            pending = deque()
+            units = self._units(files)
+            while True:
+                # Keep the pool busy, but only a bounded number of chunks in memory
+                while len(pending) < self.workers * 2:
+                    unit = next(units, None)
+                    if unit is None:
+                        break
+                    key, kind, payload, end, size = unit
+                    source = key if kind != "document" else payload[0]
+                    pending.append((key, end, size, source, pool.submit(parse_chunk, kind, payload)))
+                if not pending:
+                    break
+                key, end, size, source, future = pending.popleft()
+                self._commit(key, end, size, future.result(), source)
+
+                now = time.monotonic()
+                if now - last_checkpoint >= self.checkpoint_every:
+                    checkpoint()
+                    last_checkpoint = now
+                if now - last_progress >= self.progress_every:
+                    self._report(now - start, source)
+                    last_progress = now
+        checkpoint()
+        self._report(time.monotonic() - start, None)
+        return dict(self.stats)
+
+    def _report(self, elapsed, source):
+        elapsed = max(elapsed, 1e-9)
+        logging.info(
+            "%d recipes (%.0f/s, %.1f MB/s), %d duplicates, %d skipped%s",
+            self.stats["recipes"],
+            self.stats["recipes"] / elapsed,
+            self.stats["bytes"] / elapsed / 1e6,
+            self.stats["duplicates"],
+            self.stats["errors"],
+            f" - reading {os.path.basename(source)}" if source else "",
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Stream recipe dumps into the local recipe index.")
+    parser.add_argument("inputs", nargs="+", help="JSONL, CSV, HTML or JSON-LD files, or directories of them.")
+    parser.add_argument("--index", default=os.getenv("RECIPE_INDEX_DIR"), help="Recipe index directory.")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count).")
+    parser.add_argument("--chunk-size", type=int, help="Records per chunk and index write.")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: ingest_checkpoint.json in the index).")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and read everything again.")
+    parser.add_argument("--dedup", action="store_true", help="Drop near-duplicate recipes.")
+    parser.add_argument("--mapping", default=os.getenv("DEDUP_MAPPING_PATH"), help="Duplicate -> canonical JSON file.")
+    args = parser.parse_args()
+    if not args.index:
+        parser.error("--index or RECIPE_INDEX_DIR is required")
+
+    from recipe_index import RecipeIndex
+
+    index = RecipeIndex(args.index)
+    checkpoint_path = args.checkpoint or os.path.join(args.index, "ingest_checkpoint.json")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    detector, save_mapping_file = None, None
+    if args.dedup:
+        from near_duplicates import NearDuplicateDetector, load_mapping, save_mapping
+
+        detector = NearDuplicateDetector()
+        mapping = load_mapping(args.mapping)
+
+        def save_mapping_file():
+            if args.mapping:
+                mapping.update(detector.mapping())
+                save_mapping(mapping, args.mapping)
+
+    files = input_files(args.inputs)
+    logging.info("Ingesting %d files into %s.", len(files), args.index)
+    ingestion = Ingestion(index, workers=args.workers, chunk_size=args.chunk_size,
+                          checkpoint=Checkpoint(checkpoint_path), detector=detector)
+    try:
+        stats = ingestion.run(files, on_checkpoint=save_mapping_file)
+    finally:
+        index.close()
+    logging.info("Done: %s", stats)
+    sys.exit(1 if stats["errors"] and not stats["recipes"] else 0)
@@ -0,0 +1,168 @@
+import importlib.util
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+
+from cassette import cassette_client
+
+"""
+Pooled keep-alive HTTP client for the completion endpoint.
+
+One CompletionClient is shared per process (see get_default_client). It keeps
+TLS connections alive between calls, uses HTTP/2 when the optional `h2` package
+is installed, and tracks how busy its connection pool is.
+"""
+
+load_dotenv()
+
+
+class CompletionClient:
+    """
+    Thin client for the `/completions` endpoint on top of a pooled httpx.Client.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url="https://api.openai.com/v1",
+        max_connections=20,
+        max_keepalive_connections=10,
+        keepalive_expiry=30.0,
+        timeout=30.0,
+        http2=None,
+    ):
+        """
+        Args:
+            api_key (str): API key sent as a bearer token.
+            base_url (str): Base URL of the OpenAI-compatible API.
+            max_connections (int): Size of the connection pool.
+            max_keepalive_connections (int): Idle connections kept open for reuse.
+            keepalive_expiry (float): Seconds an idle connection is kept alive.
+            timeout (float): Request timeout in seconds.
+            http2 (bool): Force HTTP/2 on or off. Defaults to on when `h2` is installed.
+        """
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+
+        self.max_connections = max_connections
+        self.http2 = http2
+        self._client = httpx.Client(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=timeout,
+            http2=http2,
+        )
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests_total = 0
+        self._errors_total = 0
+
+    def create(self, model, prompt, max_tokens, temperature=0.7, **params):
+        """
+        Requests a completion.
+
+        Returns:
+            dict: The decoded JSON response, shaped like the legacy `openai.Completion` result.
+
+        Raises:
+            httpx.HTTPError: On transport errors or non-2xx responses.
+        """
+        payload = {"model": model, "prompt": prompt, "max_tokens": max_tokens, "temperature": temperature}
+        payload.update(params)
+
+        with self._lock:
+            self._in_flight += 1
+            self._requests_total += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            response = self._client.post("/completions", json=payload)
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            with self._lock:
+                self._errors_total += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def pool_stats(self):
+        """
+        Returns:
+            dict: Connection pool utilization metrics.
+        """
+        with self._lock:
+            return {
+                "max_connections": self.max_connections,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "utilization": self._in_flight / self.max_connections,
+                "requests_total": self._requests_total,
+                "errors_total": self._errors_total,
+                "http2": self.http2,
+            }
+
+    def close(self):
+        self._client.close()
+
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    Returns the process-wide CompletionClient, configured from environment variables.
+
+    A forked child gets its own client instead of sharing the parent's sockets.
+    With LLM_CASSETTE set, the client records to or replays from that cassette.
+    """
+    return get_client()
+
+
+def get_client(base_url=None, api_key=None):
+    """
+    Returns the process-wide CompletionClient for an endpoint, e.g. the one of a model route.
+
+    Args:
+        base_url (str): Endpoint. Defaults to OPENAI_API_BASE.
+        api_key (str): API key. Defaults to OPENAI_API_KEY.
+    """
+    global _clients_pid
+
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        key = (base_url, api_key)
+        if key not in _clients:
+            def build():
+                return _build_client(base_url, api_key)
+
+            _clients[key] = cassette_client(build) or build()
+        return _clients[key]
+
+
+def _build_client(base_url=None, api_key=None):
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise EnvironmentError("Missing OPENAI_API_KEY in environment variables.")
+
+    return CompletionClient(
+        api_key=api_key,
+        base_url=base_url or os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
+        max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30")),
+        timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "30")),
+    )
@@ -0,0 +1,369 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from dietary_rules import Restrictions, ingredient_mask
+from pantry import canonical_ingredient
+from recipe_index import DerivedIndex, tokenize
+
+"""
+Weekly meal planning over the local recipe catalog.
+
+Instead of running the pipeline once per meal, MealPlanner picks a whole plan
+from the catalog at once:
+- hard constraints: the user's diet and avoided ingredients (dietary_rules.py),
+  the dish types allowed in each meal slot, no recipe twice, at most
+  max_per_cuisine recipes of one cuisine, and no day above the daily calorie
+  maximum;
+- objective: reuse ingredients across the week (fewer distinct ingredients to
+  buy), a bonus for the preferred cuisine, and days close to the middle of the
+  daily calorie range. The daily minimum is only part of this objective, not a
+  hard constraint: a day can end up below it when the catalog has nothing
+  better, and such days are reported in the plan's "under_calories".
+
+What the solver needs per recipe (normalized dish type and cuisine, calories,
+canonical ingredients, dietary mask) is computed once per catalog version by
+PlanCatalog and shared by every plan.
+
+The solver fills slots greedily with the best feasible recipe, then improves
+the plan with rounds of single-slot swaps until no swap helps. Slots nothing
+fits stay empty; run_meal_plan in crew.py has the Recipe Creator fill those and
+sends only the selected recipes through the formatter.
+"""
+
+load_dotenv()
+
+# Dish types (normalized with recipe_index.tokenize) that fit each meal slot
+MEAL_SLOT_DISH_TYPES = {
+    "breakfast": {"breakfast", "brunch"},
+    "lunch": {"lunch", "salad", "soup", "sandwich", "main course", "main"},
+    "dinner": {"dinner", "main course", "main", "soup"},
+}
+
+
+class PlanCatalog:
+    """
+    The per-recipe data MealPlanner uses, computed once for a recipe catalog.
+    """
+
+    def __init__(self, recipes):
+        self.recipes = {}
+        self.ingredients = {}
+        self.words = {}
+        self.masks = {}
+        self.cuisines = {}
+        self.calories = {}
+        # Recipes without a dish type fit any slot
+        self.slots = {slot: [] for slot in MEAL_SLOT_DISH_TYPES}
+        for recipe in recipes:
+            recipe_id = recipe.get("recipe_id")
+            if not recipe_id:
+                continue
+            ingredients = {canonical_ingredient(line) for line in recipe.get("ingredients") or []}
+            ingredients.discard(None)
+            mask = 0
+            for ingredient in ingredients:
+                mask |= ingredient_mask(ingredient)
+            self.recipes[recipe_id] = recipe
+            self.ingredients[recipe_id] = frozenset(ingredients)
+            self.words[recipe_id] = frozenset(word for ingredient in ingredients for word in ingredient.split())
+            self.masks[recipe_id] = mask
+            self.cuisines[recipe_id] = " ".join(tokenize(recipe.get("cuisine") or ""))
+            self.calories[recipe_id] = float((recipe.get("nutrition") or {}).get("calories") or 0.0)
+            dish_type = " ".join(tokenize(recipe.get("dish_type") or ""))
+            for slot, allowed in MEAL_SLOT_DISH_TYPES.items():
+                if not dish_type or dish_type in allowed:
+                    self.slots[slot].append(recipe_id)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def get(self, recipe_id):
+        """
+        Returns:
+            dict: The recipe record, or None.
+        """
+        return self.recipes.get(recipe_id)
+
+
+class MealPlanner:
+    """
+    Picks a multi-day meal plan from a recipe catalog.
+    """
+
+    def __init__(
+        self,
+        catalog,
+        days=7,
+        slots=("breakfast", "lunch", "dinner"),
+        daily_calories=(1600, 2400),
+        max_per_cuisine=None,
+        reuse_weight=1.0,
+        new_ingredient_weight=0.5,
+        cuisine_bonus=1.0,
+        improve_rounds=3,
+        max_candidates=2000,
+    ):
+        """
+        Args:
+            catalog (PlanCatalog): The catalog to plan from, or an iterable of RecipeDetail-shaped
+                dicts to build one from; nutrition is per serving.
+            days (int): Number of days to plan.
+            slots (tuple): Meal slots per day, keys of MEAL_SLOT_DISH_TYPES.
+            daily_calories (tuple): (min, max) calories per day; None to skip the check. The
+                maximum is a hard limit, the minimum only a target (see the module docstring).
+            max_per_cuisine (int): Most recipes of one cuisine in the plan. Defaults to a third of the slots.
+            reuse_weight (float): Reward per ingredient a recipe shares with the rest of the plan.
+            new_ingredient_weight (float): Penalty per ingredient the plan did not need yet.
+            cuisine_bonus (float): Reward for a recipe of the preferred cuisine.
+            improve_rounds (int): Maximum rounds of swap improvements after the greedy pass.
+            max_candidates (int): Recipes considered per meal slot, the ones with the best
+                standalone score, which bounds the solver's work on large catalogs.
+        """
+        self.catalog = catalog if isinstance(catalog, PlanCatalog) else PlanCatalog(catalog)
+        self.days = days
+        self.slots = tuple(slots)
+        self.daily_calories = daily_calories
+        self.max_per_cuisine = max_per_cuisine or max(1, -(-days * len(self.slots) // 3))
+        self.reuse_weight = reuse_weight
+        self.new_ingredient_weight = new_ingredient_weight
+        self.cuisine_bonus = cuisine_bonus
+        self.improve_rounds = improve_rounds
+        self.max_candidates = max_candidates
+
+    def _eligible(self, user_preferences):
+        restrictions = Restrictions(user_preferences)
+        catalog = self.catalog
+        return {
+            recipe_id for recipe_id in catalog.recipes
+            if not catalog.masks[recipe_id] & restrictions.forbidden
+            and not catalog.words[recipe_id] & restrictions.words
+        }
+
+    def _calories(self, recipe):
+        return self.catalog.calories[recipe["recipe_id"]]
+
+    def _cuisine(self, recipe):
+        return self.catalog.cuisines[recipe["recipe_id"]]
+
+    def _score(self, recipe, ingredient_counts, preferred_cuisine):
+        ingredients = self.catalog.ingredients[recipe["recipe_id"]]
+        shared = sum(1 for ingredient in ingredients if ingredient_counts.get(ingredient, 0) > 0)
+        score = self.reuse_weight * shared - self.new_ingredient_weight * (len(ingredients) - shared)
+        if preferred_cuisine and self._cuisine(recipe) == preferred_cuisine:
+            score += self.cuisine_bonus
+        return score
+
+    def _calorie_penalty(self, day_calories):
+        if not self.daily_calories:
+            return 0.0
+        low, high = self.daily_calories
+        # One point per 100 kcal away from the middle of the range
+        return abs(day_calories - (low + high) / 2) / 100
+
+    def _feasible(self, recipe, plan, slot_index, used, cuisine_counts):
+        if recipe["recipe_id"] in used:
+            return False
+        cuisine = self._cuisine(recipe)
+        if cuisine and cuisine_counts.get(cuisine, 0) >= self.max_per_cuisine:
+            return False
+        if self.daily_calories:
+            day = slot_index // len(self.slots)
+            day_slots = range(day * len(self.slots), (day + 1) * len(self.slots))
+            others = sum(self._calories(plan[i]) for i in day_slots if i != slot_index and plan[i] is not None)
+            if others + self._calories(recipe) > self.daily_calories[1]:
+                return False
+        return True
+
+    def plan(self, user_preferences):
+        """
+        Builds a meal plan for the user.
+
+        Args:
+            user_preferences (dict): dietary_restrictions, avoid_ingredients, preferred_cuisine, servings.
+
+        Returns:
+            dict: days (each with its meals and calories), recipe_ids, shopping_ingredients,
+                unfilled slots, the days under the daily calorie minimum, and the reuse ratio
+                (ingredient uses per distinct ingredient).
+        """
+        preferred_cuisine = " ".join(tokenize(user_preferences.get("preferred_cuisine") or ""))
+        eligible = self._eligible(user_preferences)
+        candidates = {}
+        for slot in self.slots:
+            ranked = sorted(
+                (
+                    self.catalog.recipes[recipe_id]
+                    for recipe_id in self.catalog.slots.get(slot, ())
+                    if recipe_id in eligible
+                ),
+                key=lambda recipe: -self._score(recipe, {}, preferred_cuisine),
+            )
+            candidates[slot] = ranked[:self.max_candidates]
+        slot_count = self.days * len(self.slots)
+
+        plan = [None] * slot_count
+        used = set()
+        cuisine_counts = {}
+        ingredient_counts = {}
+
+        def place(slot_index, recipe):
+            plan[slot_index] = recipe
+            used.add(recipe["recipe_id"])
+            cuisine = self._cuisine(recipe)
+            if cuisine:
+                cuisine_counts[cuisine] = cuisine_counts.get(cuisine, 0) + 1
+            for ingredient in self.catalog.ingredients[recipe["recipe_id"]]:
+                ingredient_counts[ingredient] = ingredient_counts.get(ingredient, 0) + 1
+
+        def remove(slot_index):
+            recipe = plan[slot_index]
+            plan[slot_index] = None
+            used.discard(recipe["recipe_id"])
+            cuisine = self._cuisine(recipe)
+            if cuisine:
+                cuisine_counts[cuisine] -= 1
+            for ingredient in self.catalog.ingredients[recipe["recipe_id"]]:
+                ingredient_counts[ingredient] -= 1
+            return recipe
+
+        def day_calories(slot_index):
+            day = slot_index // len(self.slots)
+            return sum(
+                self._calories(recipe)
+                for recipe in plan[day * len(self.slots):(day + 1) * len(self.slots)]
+                if recipe is not None
+            )
+
+        def slot_score(slot_index, recipe):
+            score = self._score(recipe, ingredient_counts, preferred_cuisine)
+            # Once the rest of the day is planned, score how close the day gets to the calorie target
+            day = slot_index // len(self.slots)
+            day_slots = range(day * len(self.slots), (day + 1) * len(self.slots))
+            if self.daily_calories and all(plan[i] is not None for i in day_slots if i != slot_index):
+                score -= self._calorie_penalty(day_calories(slot_index) + self._calories(recipe))
+            return score
+
+        def best_for(slot_index):
+            slot = self.slots[slot_index % len(self.slots)]
+            best, best_score = None, None
+            for recipe in candidates[slot]:
+                if not self._feasible(recipe, plan, slot_index, used, cuisine_counts):
+                    continue
+                score = slot_score(slot_index, recipe)
+                if best_score is None or score > best_score:
+                    best, best_score = recipe, score
+            return best, best_score
+
+        # Greedy pass, one slot at a time in day order
+        for slot_index in range(slot_count):
+            recipe, _ = best_for(slot_index)
+            if recipe is not None:
+                place(slot_index, recipe)
+
+        # Swap improvements: re-pick each slot given everything else, keep the change if it scores better
+        for _ in range(self.improve_rounds):
+            improved = False
+            for slot_index in range(slot_count):
+                if plan[slot_index] is None:
+                    continue
+                current = remove(slot_index)
+                current_score = slot_score(slot_index, current)
+                recipe, score = best_for(slot_index)
+                if recipe is not None and score > current_score + 1e-9:
+                    place(slot_index, recipe)
+                    improved = True
+                else:
+                    place(slot_index, current)
+            if not improved:
+                break
+
+        return self._summary(plan, ingredient_counts)
+
+    def _summary(self, plan, ingredient_counts):
+        days = []
+        unfilled = []
+        for day in range(self.days):
+            meals = []
+            for position, slot in enumerate(self.slots):
+                recipe = plan[day * len(self.slots) + position]
+                if recipe is None:
+                    unfilled.append({"day": day + 1, "slot": slot})
+                    meals.append({"slot": slot, "recipe_id": None})
+                    continue
+                meals.append({
+                    "slot": slot,
+                    "recipe_id": recipe["recipe_id"],
+                    "name": recipe.get("name", ""),
+                    "calories": self._calories(recipe) or None,
+                })
+            days.append({"day": day + 1, "meals": meals, "calories": sum(meal.get("calories") or 0 for meal in meals)})
+
+        shopping = sorted(ingredient for ingredient, count in ingredient_counts.items() if count > 0)
+        uses = sum(ingredient_counts.values())
+        minimum = self.daily_calories[0] if self.daily_calories else 0
+        return {
+            "days": days,
+            "recipe_ids": [recipe["recipe_id"] for recipe in plan if recipe is not None],
+            "shopping_ingredients": shopping,
+            "unfilled": unfilled,
+            "under_calories": [day["day"] for day in days if day["calories"] < minimum],
+            "reuse_ratio": round(uses / len(shopping), 2) if shopping else 0.0,
+        }
+
+
+_plan_catalog = DerivedIndex("meal plan catalog")
+
+
+def get_plan_catalog(index=None, corpus=None):
+    """
+    Returns the PlanCatalog of the local catalog, empty when there is none.
+
+    Built from the recipe index when one is configured (and rebuilt in the
+    background once its snapshot has changed), otherwise from the recipe corpus.
+
+    Args:
+        index (RecipeIndex): Recipe index to use. Defaults to RECIPE_INDEX_DIR.
+        corpus (RecipeCorpus): Corpus to use without an index. Defaults to RECIPE_CORPUS_PATH.
+    """
+    if index is None and corpus is None:
+        from recipe_corpus import get_recipe_corpus
+        from recipe_index import get_recipe_index
+
+        index = get_recipe_index()
+        corpus = None if index is not None else get_recipe_corpus()
+
+    if index is not None:
+        snapshot = index.snapshot()
+        source = (id(index), snapshot.sequence)
+        recipes = (recipe for _, recipe in snapshot.recipes.items())
+    elif corpus is not None:
+        source = (id(corpus), None)
+        recipes = iter(corpus)
+    else:
+        logging.warning("No local recipe catalog configured (RECIPE_INDEX_DIR or RECIPE_CORPUS_PATH).")
+        return PlanCatalog(())
+
+    return _plan_catalog.get(source, lambda: PlanCatalog(recipes)) or PlanCatalog(())
+
+
+def plan_meals(user_preferences, days=7, recipes=None, **options):
+    """
+    Plans meals from the local catalog.
+
+    Args:
+        user_preferences (dict): See MealPlanner.plan.
+        days (int): Number of days to plan.
+        recipes (PlanCatalog): Catalog to plan from, or a list of recipes. Defaults to get_plan_catalog().
+        **options: Further MealPlanner settings.
+
+    Returns:
+        dict: The plan, see MealPlanner.plan.
+    """
+    options.setdefault(
+        "daily_calories",
+        (int(os.getenv("MEAL_PLAN_MIN_CALORIES", "1600")), int(os.getenv("MEAL_PLAN_MAX_CALORIES", "2400"))),
+    )
+    planner = MealPlanner(get_plan_catalog() if recipes is None else recipes, days=days, **options)
+    return planner.plan(user_preferences)
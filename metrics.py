@@ -0,0 +1,316 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+
+from dotenv import load_dotenv
+
+"""
+Prometheus-format metrics for the recipe pipeline.
+
+Metrics live in an in-process registry and are rendered in the Prometheus text
+exposition format by render(), which the HTTP service exposes on /metrics.
+
+Multi-process mode: when PROMETHEUS_MULTIPROC_DIR is set, every process writes
+its values to <dir>/metrics_<pid>.json once a second, and render() aggregates
+all files. Counters and histograms are summed over every process that ever
+wrote, gauges over the processes still alive. That way any pre-forked worker
+can answer a scrape for the whole service. Clear the directory when the service
+starts.
+"""
+
+load_dotenv()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def track_inprogress(self, **labels):
+        """
+        Returns:
+            A context manager / decorator that counts the calls currently inside it.
+        """
+        gauge = self
+
+        class _InProgress(ContextDecorator):
+            def __enter__(self):
+                gauge.inc(**labels)
+                return self
+
+            def __exit__(self, *exc_info):
+                gauge.dec(**labels)
+                return False
+
+        return _InProgress()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, then sum and count
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        """
+        Returns:
+            A context manager / decorator observing the wall-clock duration of its body.
+        """
+        histogram = self
+
+        class _Timer(ContextDecorator):
+            def _recreate_cm(self):
+                # A fresh timer per decorated call, so concurrent calls do not share a start time
+                return _Timer()
+
+            def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+            def __exit__(self, *exc_info):
+                histogram.observe(time.perf_counter() - self.start, **labels)
+                return False
+
+        return _Timer()
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), list(value)] for key, value in self._values.items()]
+
+
+class Registry:
+    """
+    Holds metrics and renders them, aggregating across processes in multi-process mode.
+    """
+
+    def __init__(self, multiprocess_dir=None, flush_interval=1.0):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._flusher_pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent reports its own values; a child starting from a copy would count them twice
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric._lock = threading.Lock()
+            metric._values = {}
+        self._lock = threading.Lock()
+        self._ensure_flusher()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # Started lazily, and again in every forked child
+        if not self.multiprocess_dir or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+
+        def flush_periodically():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        threading.Thread(target=flush_periodically, daemon=True).start()
+
+    def _snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                "kind": metric.kind,
+                "documentation": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": [b for b in getattr(metric, "buckets", ()) if b != float("inf")],
+                "values": metric.dump(),
+            }
+            for metric in metrics
+        }
+
+    def flush(self):
+        """
+        Writes this process's values to the multi-process directory.
+        """
+        if not self.multiprocess_dir:
+            return
+        self._ensure_flusher()
+        path = os.path.join(self.multiprocess_dir, f"metrics_{os.getpid()}.json")
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(temporary_path, path)
+
+    def _collect(self):
+        if not self.multiprocess_dir:
+            return self._snapshot()
+
+        self.flush()
+        merged = {}
+        for filename in os.listdir(self.multiprocess_dir):
+            if not (filename.startswith("metrics_") and filename.endswith(".json")):
+                continue
+            pid = int(filename[len("metrics_"):-len(".json")])
+            try:
+                with open(os.path.join(self.multiprocess_dir, filename), encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(pid)
+
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, values={}))
+                if metric["kind"] == "gauge" and not alive:
+                    continue
+                for labels, value in metric["values"]:
+                    key = tuple(labels)
+                    if metric["kind"] == "histogram":
+                        current = target["values"].get(key)
+                        target["values"][key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        target["values"][key] = target["values"].get(key, 0.0) + value
+
+        for metric in merged.values():
+            metric["values"] = [[list(key), value] for key, value in metric["values"].items()]
+        return merged
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, metric in sorted(self._collect().items()):
+            lines.append(f"# HELP {name} {metric['documentation']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for label_values, value in metric["values"]:
+                labels = list(zip(metric["labelnames"], label_values))
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-2]):
+                    cumulative += count
+                    bucket_labels = labels + [("le", _format_value(bound))]
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(value[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry(multiprocess_dir=os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+atexit.register(REGISTRY.flush)
+
+
+def render():
+    return REGISTRY.render()
+
+
+# Pipeline metrics
+LLM_CALLS = Counter("recipe_llm_calls_total", "Completion calls by tool and model.", ["tool", "model"])
+LLM_TOKENS = Counter("recipe_llm_tokens_total", "Completion tokens by direction (in/out) and model.", ["direction", "model"])
+LLM_COST = Counter("recipe_llm_cost_usd_total", "Completion cost in USD by model route and model.", ["route", "model"])
+LLM_LATENCY = Histogram("recipe_llm_latency_seconds", "Completion latency by model route.", ["route"])
+CACHE_REQUESTS = Counter("recipe_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"])
+ERRORS = Counter("recipe_errors_total", "Errors by exception type.", ["type"])
+REQUESTS = Counter("recipe_requests_total", "Recipe requests by dish type.", ["dish_type"])
+STAGE_LATENCY = Histogram("recipe_stage_latency_seconds", "Pipeline stage latency.", ["stage"])
+TOOL_LATENCY = Histogram("recipe_tool_latency_seconds", "Tool run latency.", ["tool"])
+IN_FLIGHT = Gauge("recipe_in_flight_requests", "Recipe requests currently being processed.")
+LLM_IN_FLIGHT = Gauge("recipe_llm_in_flight_calls", "Completion calls currently waiting on the provider.")
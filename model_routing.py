@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+"""
+Per-agent and per-tool model routing.
+
+Every agent and every tool LLM call picks a route: a named model tier with its
+own model, endpoint and price. Rules are checked in order and the first match
+wins; a rule can match on
+- "agent" or "tool": the agent method or tool name, e.g. "recipe_formatter"
+- "task": the kind of work, see TASK_TYPES (search, fetch, generate, format)
+- "max_input_chars" / "min_input_chars": the prompt size of a tool call, so large
+  inputs can escalate from a small model with a short context window
+Anything no rule matches goes to the default route.
+
+Without a config file there are two routes: "default" (OPENAI_MODEL_NAME) and
+"fast" (OPENAI_FAST_MODEL_NAME, falling back to the default model), and search
+and format work with prompts up to MODEL_FAST_MAX_INPUT_CHARS goes to "fast".
+MODEL_ROUTES_PATH points at a JSON file replacing that config:
+
+    {
+      "default_route": "default",
+      "routes": {
+        "default": {"model": "gpt-4o", "price_in": 2.5, "price_out": 10},
+        "fast": {"model": "gpt-4o-mini", "base_url": "...", "price_in": 0.15, "price_out": 0.6}
+      },
+      "rules": [
+        {"agent": "recipe_formatter", "route": "fast"},
+        {"tool": "search_filter_tool", "max_input_chars": 12000, "route": "fast"}
+      ]
+    }
+
+Prices are USD per million tokens. A route without "api_key" or "base_url" uses
+OPENAI_API_KEY / OPENAI_API_BASE. The router also keeps per-route latency, token
+and cost statistics, which benchmark.py turns into a report.
+"""
+
+load_dotenv()
+
+# The kind of work each agent and tool does, used by "task" rules
+TASK_TYPES = {
+    "recipe_researcher": "search",
+    "recipe_creator": "generate",
+    "recipe_formatter": "format",
+    "search_filter_tool": "search",
+    "recipe_database_tool": "fetch",
+    "recipe_formatter_tool": "format",
+}
+
+
+class ModelRoute:
+    """
+    A model tier: which model to call, where, and what it costs.
+    """
+
+    def __init__(self, name, model, api_key=None, base_url=None, price_in=0.0, price_out=0.0):
+        """
+        Args:
+            name (str): Route name used in rules and reports.
+            model (str): Model name sent to the provider.
+            api_key (str): API key, when it differs from OPENAI_API_KEY.
+            base_url (str): Endpoint, when it differs from OPENAI_API_BASE.
+            price_in (float): USD per million prompt tokens.
+            price_out (float): USD per million completion tokens.
+        """
+        self.name = name
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.price_in = float(price_in)
+        self.price_out = float(price_out)
+
+    def cost(self, tokens_in, tokens_out):
+        """
+        Returns:
+            float: The price in USD of a call with the given token counts.
+        """
+        return (tokens_in * self.price_in + tokens_out * self.price_out) / 1_000_000
+
+    def llm_config(self):
+        """
+        Returns:
+            dict: The `llm` settings for a crewai Agent on this route.
+        """
+        config = {"model": self.model, "api_key": self.api_key or os.getenv("OPENAI_API_KEY")}
+        base_url = self.base_url or os.getenv("OPENAI_API_BASE")
+        if base_url:
+            config["base_url"] = base_url
+        return config
+
+
+class ModelRouter:
+    """
+    Picks a route for an agent or a tool call and records how each route performs.
+    """
+
+    def __init__(self, routes, rules=(), default_route="default"):
+        """
+        Args:
+            routes (dict): ModelRoute objects by name.
+            rules (list): Rule dicts, checked in order; see the module docstring.
+            default_route (str): Route used when no rule matches.
+
+        Raises:
+            ValueError: If a rule or the default route names an unknown route.
+        """
+        self.routes = dict(routes)
+        self.rules = [dict(rule) for rule in rules]
+        self.default_route = default_route
+        for name in [default_route] + [rule.get("route") for rule in self.rules]:
+            if name not in self.routes:
+                raise ValueError(f"Unknown model route: {name}")
+
+        self._stats = defaultdict(lambda: {"calls": 0, "errors": 0, "latencies": [], "tokens_in": 0, "tokens_out": 0, "cost": 0.0})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the router from MODEL_ROUTES_PATH, or the default two-tier config.
+        """
+        path = os.getenv("MODEL_ROUTES_PATH")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            routes = {name: ModelRoute(name, **settings) for name, settings in config["routes"].items()}
+            return cls(routes, config.get("rules", []), config.get("default_route", "default"))
+
+        model_name = os.getenv("OPENAI_MODEL_NAME", "ruslandev/llama-3-8b-gpt-4o")
+        routes = {
+            "default": ModelRoute(
+                "default",
+                model_name,
+                price_in=os.getenv("OPENAI_MODEL_PRICE_IN", "0"),
+                price_out=os.getenv("OPENAI_MODEL_PRICE_OUT", "0"),
+            ),
+            "fast": ModelRoute(
+                "fast",
+                os.getenv("OPENAI_FAST_MODEL_NAME", model_name),
+                api_key=os.getenv("OPENAI_FAST_API_KEY"),
+                base_url=os.getenv("OPENAI_FAST_API_BASE"),
+                price_in=os.getenv("OPENAI_FAST_MODEL_PRICE_IN", os.getenv("OPENAI_MODEL_PRICE_IN", "0")),
+                price_out=os.getenv("OPENAI_FAST_MODEL_PRICE_OUT", os.getenv("OPENAI_MODEL_PRICE_OUT", "0")),
+            ),
+        }
+        max_input_chars = int(os.getenv("MODEL_FAST_MAX_INPUT_CHARS", "16000"))
+        rules = [
+            {"task": "search", "max_input_chars": max_input_chars, "route": "fast"},
+            {"task": "format", "max_input_chars": max_input_chars, "route": "fast"},
+        ]
+        return cls(routes, rules)
+
+    def single_route(self, name=None):
+        """
+        Returns:
+            ModelRouter: A router sending everything to one route, e.g. as a benchmark baseline.
+        """
+        return ModelRouter(self.routes, default_route=name or self.default_route)
+
+    def route(self, agent=None, tool=None, input_chars=0):
+        """
+        Picks the route for an agent or a tool call.
+
+        Args:
+            agent (str): Agent name, e.g. "recipe_creator".
+            tool (str): Tool name, e.g. "search_filter_tool".
+            input_chars (int): Prompt size of the call; 0 for agents.
+
+        Returns:
+            ModelRoute: The first matching rule's route, or the default route.
+        """
+        task = TASK_TYPES.get(agent or tool)
+        for rule in self.rules:
+            if "agent" in rule and rule["agent"] != agent:
+                continue
+            if "tool" in rule and rule["tool"] != tool:
+                continue
+            if "task" in rule and rule["task"] != task:
+                continue
+            if input_chars > rule.get("max_input_chars", input_chars):
+                continue
+            if input_chars < rule.get("min_input_chars", 0):
+                continue
+            return self.routes[rule["route"]]
+        return self.routes[self.default_route]
+
+    def record(self, scope, name, route, latency, tokens_in=0, tokens_out=0, error=False):
+        """
+        Records one call (scope "tool") or one agent stage (scope "agent") on a route.
+        Failed calls count as errors and stay out of the latency percentiles.
+
+        Returns:
+            float: The cost of the call in USD.
+        """
+        cost = route.cost(tokens_in, tokens_out)
+        with self._lock:
+            stats = self._stats[(scope, name, route.name)]
+            stats["calls"] += 1
+            if error:
+                stats["errors"] += 1
+            else:
+                stats["latencies"].append(latency)
+            stats["tokens_in"] += tokens_in
+            stats["tokens_out"] += tokens_out
+            stats["cost"] += cost
+        return cost
+
+    def report(self):
+        """
+        Returns:
+            list: One dict per (scope, name, route) with call counts, latency percentiles,
+                token totals and cost.
+        """
+        with self._lock:
+            items = [(key, dict(stats, latencies=sorted(stats["latencies"]))) for key, stats in self._stats.items()]
+
+        rows = []
+        for (scope, name, route_name), stats in sorted(items):
+            latencies = stats["latencies"]
+            rows.append({
+                "scope": scope,
+                "name": name,
+                "route": route_name,
+                "model": self.routes[route_name].model,
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "tokens_in": stats["tokens_in"],
+                "tokens_out": stats["tokens_out"],
+                "cost": stats["cost"],
+            })
+        return rows
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """
+    Returns the process-wide ModelRouter, configured from environment variables.
+    """
+    global _model_router
+
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter.from_env()
+        return _model_router
@@ -0,0 +1,323 @@
+import argparse
+import json
+import logging
+import os
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pantry import canonical_ingredient
+from tokenization import tokenize
+
+"""
+Near-duplicate recipe detection at ingest time, with MinHash and LSH.
+
+Imported dumps hold many near-copies of one recipe (reformatted, an ingredient
+added, steps reworded). Each recipe is described by two sets:
+- its canonical ingredients ("2 tbsp olive oil" -> "olive oil");
+- the word shingles of its steps (every run of DEDUP_SHINGLE_SIZE tokenized words).
+
+Each set gets a MinHash signature, whose positions agree between two recipes
+with a probability equal to the Jaccard similarity of their sets. Signatures
+are cut into bands and every band is hashed into a bucket, so a new recipe is
+only compared with the recipes sharing a bucket with it, not the whole catalog.
+Bands and rows per band are chosen for the threshold. Candidates are then
+confirmed on their estimated similarity:
+
+    similarity = w * J(ingredients) + (1 - w) * J(step shingles)
+
+with w = DEDUP_INGREDIENT_WEIGHT. A recipe whose similarity to a kept recipe
+reaches DEDUP_THRESHOLD is a duplicate. It is not indexed but mapped to that
+recipe, its canonical representative (the first one seen).
+
+Usage:
+    python near_duplicates.py dump.jsonl --output unique.jsonl --mapping duplicates.json
+    python near_duplicates.py dump.jsonl --index recipe_index --mapping duplicates.json
+"""
+
+load_dotenv()
+
+# Universal hashing (a * x + b) mod p over 31-bit shingle hashes; the products fit in uint64
+_PRIME = np.uint64((1 << 31) - 1)
+PARTS = ("ingredients", "steps")
+
+
+def lsh_parameters(threshold, num_perm, false_negative_weight=0.8):
+    """
+    Picks the banding of a num_perm-long signature for a similarity threshold.
+
+    Minimizes the weighted false positive and false negative probability masses,
+    assuming similarities are spread evenly. Candidates are confirmed afterwards,
+    so a false positive only costs a comparison and missed duplicates weigh more.
+
+    Returns:
+        tuple: (bands, rows per band).
+    """
+    similarities = np.linspace(0.0, 1.0, 201)
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        probability = 1.0 - (1.0 - similarities**rows) ** bands
+        error = (1.0 - false_negative_weight) * probability[similarities < threshold].sum()
+        error += false_negative_weight * (1.0 - probability[similarities >= threshold]).sum()
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def recipe_shingles(recipe, shingle_size=3):
+    """
+    Returns:
+        tuple: (set of canonical ingredients, set of step shingles).
+    """
+    ingredients = set()
+    for line in recipe.get("ingredients") or []:
+        ingredient = canonical_ingredient(line)
+        if ingredient:
+            ingredients.add(ingredient)
+    words = tokenize(" ".join(str(step) for step in recipe.get("steps") or []), recipe.get("language"))
+    steps = {" ".join(words[start:start + shingle_size]) for start in range(max(len(words) - shingle_size + 1, 1))}
+    steps.discard("")
+    return ingredients, steps
+
+
+class NearDuplicateDetector:
+    """
+    Incremental MinHash LSH index over the recipes kept so far.
+    """
+
+    def __init__(self, threshold=None, num_perm=None, ingredient_weight=None, shingle_size=None, seed=1):
+        """
+        Args:
+            threshold (float): Similarity from which a recipe is a duplicate (default DEDUP_THRESHOLD).
+            num_perm (int): MinHash permutations per set (default DEDUP_NUM_PERM).
+            ingredient_weight (float): Weight of the ingredient similarity (default DEDUP_INGREDIENT_WEIGHT).
+            shingle_size (int): Words per step shingle (default DEDUP_SHINGLE_SIZE).
+            seed (int): Seed of the hash permutations; signatures only compare under the same seed.
+        """
+        self.threshold = float(threshold if threshold is not None else os.getenv("DEDUP_THRESHOLD", "0.8"))
+        self.num_perm = int(num_perm or os.getenv("DEDUP_NUM_PERM", "64"))
+        self.ingredient_weight = float(
+            ingredient_weight if ingredient_weight is not None else os.getenv("DEDUP_INGREDIENT_WEIGHT", "0.5")
+        )
+        self.shingle_size = int(shingle_size or os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+        # A duplicate reaches the threshold on at least one of the two sets, so banding each set
+        # for the threshold finds it
+        self.bands, self.rows = lsh_parameters(self.threshold, self.num_perm)
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=(self.num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=(self.num_perm, 1), dtype=np.uint64)
+
+        # Kept recipes: row -> ID and signatures (one row of num_perm per part, all-max for empty sets)
+        self.kept_ids = []
+        self._rows = {}
+        self._signatures = np.empty((1024, len(PARTS), self.num_perm), dtype=np.uint32)
+        self._buckets = [[{} for _ in range(self.bands)] for _ in PARTS]
+        # Every recipe seen -> its canonical representative; duplicates of each representative
+        self.canonical = {}
+        self.duplicates = {}
+
+    def __len__(self):
+        return len(self.kept_ids)
+
+    def signature(self, recipe):
+        """
+        Returns:
+            numpy.ndarray: (len(PARTS), num_perm) uint32 MinHash signatures of a recipe.
+        """
+        signatures = np.full((len(PARTS), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        for part, shingles in enumerate(recipe_shingles(recipe, self.shingle_size)):
+            if shingles:
+                hashes = np.fromiter(
+                    (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+                ) % _PRIME
+                signatures[part] = ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+        return signatures
+
+    def similarity(self, signatures, other):
+        """
+        Returns:
+            float: The estimated weighted similarity of two recipes' signatures. Only the
+                sets that are not empty in both recipes count.
+        """
+        empty = np.iinfo(np.uint32).max
+        weights = (self.ingredient_weight, 1.0 - self.ingredient_weight)
+        total, weight = 0.0, 0.0
+        for part in range(len(PARTS)):
+            if signatures[part, 0] == empty and other[part, 0] == empty:
+                continue
+            total += weights[part] * float(np.mean(signatures[part] == other[part]))
+            weight += weights[part]
+        return total / weight if weight else 1.0
+
+    def _band_keys(self, signatures):
+        for part in range(len(PARTS)):
+            if signatures[part, 0] == np.iinfo(np.uint32).max:
+                continue
+            for band in range(self.bands):
+                yield part, band, signatures[part, band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, recipe, signatures=None):
+        """
+        Finds the kept recipe a recipe duplicates.
+
+        Returns:
+            tuple: (canonical recipe ID, similarity), or (None, 0.0) when it is not a duplicate.
+        """
+        if signatures is None:
+            signatures = self.signature(recipe)
+        candidates = set()
+        for part, band, key in self._band_keys(signatures):
+            candidates.update(self._buckets[part][band].get(key, ()))
+        best, best_similarity = None, 0.0
+        for row in sorted(candidates):
+            similarity = self.similarity(signatures, self._signatures[row])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = row, similarity
+        return (None, 0.0) if best is None else (self.kept_ids[best], best_similarity)
+
+    def add(self, recipe, signatures=None):
+        """
+        Adds a recipe, keeping it unless it duplicates a kept one.
+
+        Args:
+            recipe (dict): A RecipeDetail-shaped dict.
+            signatures (numpy.ndarray): The recipe's signatures, if already computed
+                (e.g. in a worker process by a detector with the same settings).
+
+        Returns:
+            str: The recipe's canonical ID: its own when kept, else its representative's.
+        """
+        recipe_id = str(recipe["recipe_id"])
+        if recipe_id in self.canonical:
+            return self.canonical[recipe_id]
+        if signatures is None:
+            signatures = self.signature(recipe)
+        canonical_id, _ = self.find(recipe, signatures)
+        if canonical_id is not None:
+            self.canonical[recipe_id] = canonical_id
+            self.duplicates.setdefault(canonical_id, []).append(recipe_id)
+            return canonical_id
+
+        row = len(self.kept_ids)
+        if row == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+        self._signatures[row] = signatures
+        self.kept_ids.append(recipe_id)
+        self._rows[recipe_id] = row
+        for part, band, key in self._band_keys(signatures):
+            self._buckets[part][band].setdefault(key, []).append(row)
+        self.canonical[recipe_id] = recipe_id
+        return recipe_id
+
+    def mapping(self):
+        """
+        Returns:
+            dict: Duplicate recipe ID -> canonical recipe ID.
+        """
+        return {
+            recipe_id: canonical_id for recipe_id, canonical_id in self.canonical.items() if recipe_id != canonical_id
+        }
+
+
+def deduplicate(recipes, detector=None):
+    """
+    Yields the recipes that are not near-duplicates of an earlier one.
+
+    Args:
+        recipes (iterable): RecipeDetail-shaped dicts (or models).
+        detector (NearDuplicateDetector): Detector to add to, e.g. seeded with the existing catalog.
+    """
+    detector = detector if detector is not None else NearDuplicateDetector()
+    for recipe in recipes:
+        if hasattr(recipe, "model_dump"):
+            recipe = recipe.model_dump()
+        recipe_id = str(recipe["recipe_id"])
+        # IDs seen before (e.g. already in the catalog) are not ingested again
+        if recipe_id not in detector.canonical and detector.add(recipe) == recipe_id:
+            yield recipe
+
+
+def load_mapping(path):
+    """
+    Returns:
+        dict: Duplicate recipe ID -> canonical recipe ID from a mapping file, empty when there is none.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_mapping(mapping, path):
+    """
+    Writes a duplicate -> canonical mapping, replacing the file atomically.
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, ensure_ascii=False, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Drop near-duplicate recipes from a JSONL recipe dump.")
+    parser.add_argument("input", help="JSONL file with one RecipeDetail-shaped recipe per line.")
+    parser.add_argument("--output", help="JSONL file to write the kept recipes to.")
+    parser.add_argument("--index", help="Recipe index directory to add the kept recipes to.")
+    parser.add_argument("--mapping", default=os.getenv("DEDUP_MAPPING_PATH"), help="Duplicate -> canonical JSON file.")
+    parser.add_argument("--threshold", type=float, help="Similarity from which a recipe is a duplicate.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Recipes per index write.")
+    args = parser.parse_args()
+    if not args.output and not args.index:
+        parser.error("one of --output or --index is required")
+
+    detector = NearDuplicateDetector(threshold=args.threshold)
+    index = None
+    if args.index:
+        from recipe_index import RecipeIndex
+
+        # Recipes already in the index are representatives for the new ones
+        index = RecipeIndex(args.index)
+        for _, recipe in index.snapshot().recipes.items():
+            detector.add(recipe)
+    mapping = load_mapping(args.mapping)
+    logging.info("Bands %d x %d rows, threshold %.2f.", detector.bands, detector.rows, detector.threshold)
+
+    seen = len(detector.canonical)
+    kept = 0
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    batch = []
+    try:
+        for recipe in deduplicate(_read_jsonl(args.input), detector):
+            kept += 1
+            if output:
+                output.write(json.dumps(recipe, ensure_ascii=False) + "\n")
+            if index is not None:
+                batch.append(("add", recipe))
+                if len(batch) >= args.batch_size:
+                    index.apply(batch)
+                    batch = []
+        if index is not None and batch:
+            index.apply(batch)
+    finally:
+        if output:
+            output.close()
+        if index is not None:
+            index.close()
+
+    mapping.update(detector.mapping())
+    if args.mapping:
+        save_mapping(mapping, args.mapping)
+    read = len(detector.canonical) - seen
+    logging.info("Kept %d of %d new recipes; %d near-duplicates mapped.", kept, read, read - kept)
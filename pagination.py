@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+
+from dotenv import load_dotenv
+
+"""
+Opaque continuation tokens for paginated search results.
+
+A cursor encodes where the next page starts (the last recipe ID seen for index
+searches, an offset for LLM searches) plus a fingerprint of the query, so a
+cursor cannot be replayed against a different query. When CURSOR_SECRET is set,
+cursors are also signed so clients cannot forge positions.
+"""
+
+load_dotenv()
+
+
+class InvalidCursorError(ValueError):
+    """
+    Raised for malformed, tampered or mismatched cursors.
+    """
+
+
+def query_fingerprint(query):
+    """
+    Returns:
+        str: A short stable hash of a query dict.
+    """
+    encoded = json.dumps(query, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def _signature(payload):
+    secret = os.getenv("CURSOR_SECRET", "")
+    if not secret:
+        return b""
+    return hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).digest()[:16]
+
+
+def encode_cursor(query, position):
+    """
+    Args:
+        query (dict): The query the cursor belongs to.
+        position (dict): Where the next page starts, e.g. {"after": "r42"} or {"offset": 20}.
+
+    Returns:
+        str: An opaque URL-safe token.
+    """
+    payload = json.dumps({"q": query_fingerprint(query), "p": position}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(_signature(payload) + payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, query):
+    """
+    Returns:
+        dict: The position stored in the cursor, or an empty dict for no cursor.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed, tampered with or belongs to another query.
+    """
+    if not cursor:
+        return {}
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except ValueError as e:
+        raise InvalidCursorError("Malformed cursor.") from e
+
+    signature_length = len(_signature(b""))
+    signature, payload = raw[:signature_length], raw[signature_length:]
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise InvalidCursorError("Cursor signature mismatch.")
+    try:
+        state = json.loads(payload)
+    except ValueError as e:
+        raise InvalidCursorError("Malformed cursor.") from e
+    if state.get("q") != query_fingerprint(query):
+        raise InvalidCursorError("Cursor belongs to a different query.")
+    return state["p"]
+
+
+def iter_pages(fetch_page, cursor=None):
+    """
+    Follows continuation tokens lazily, one page at a time.
+
+    Args:
+        fetch_page (callable): Takes a cursor (or None) and returns (items, next_cursor).
+        cursor (str): Cursor to start from.
+
+    Yields:
+        list: One page of items; stops after the page without a next cursor.
+    """
+    while True:
+        items, cursor = fetch_page(cursor)
+        if items:
+            yield items
+        if not cursor:
+            return
@@ -0,0 +1,239 @@
+import os
+import re
+
+import numpy as np
+from dotenv import load_dotenv
+
+from recipe_index import DerivedIndex, tokenize
+
+"""
+Pantry-match search: "what can I cook with what I have".
+
+Every recipe's ingredients are reduced to canonical ingredient IDs ("2 cloves
+garlic, minced" -> "garlic") and stored as a bitset, one row of packed uint64
+words per recipe. A pantry becomes a bitset over the same IDs, and for every
+recipe at once
+    have    = popcount(recipe & pantry)
+    missing = ingredient count - have
+so ranking hundreds of thousands of recipes is a few vectorized passes.
+
+Only the PANTRY_BITSET_WIDTH most frequent ingredients get a bit, which keeps a
+row at width / 8 bytes. Rarer ingredients are matched through small posting
+arrays instead, so they still count towards coverage.
+"""
+
+load_dotenv()
+
+# Preparation and quality words that do not change what the ingredient is
+_DESCRIPTORS = {
+    "boneless", "skinless", "chopped", "diced", "minced", "sliced", "grated", "shredded", "crushed", "ground",
+    "dried", "frozen", "cooked", "raw", "ripe", "peeled", "extra", "virgin", "unsalted", "salted", "whole",
+    "finely", "roughly", "thinly", "optional", "taste", "plus", "more", "about", "into", "piece", "pieces",
+}
+_POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def canonical_ingredient(text):
+    """
+    Reduces an ingredient line to its canonical name.
+
+    Returns:
+        str: e.g. "olive oil" for "2 tbsp extra virgin olive oil", or None for lines
+            with no ingredient words.
+    """
+    # "garlic, minced" / "butter (softened)": the ingredient comes before the comma or parenthesis
+    text = re.split(r"[,(]", str(text), maxsplit=1)[0]
+    words = [word for word in tokenize(text) if word not in _DESCRIPTORS]
+    return " ".join(words) or None
+
+
+def popcount_rows(words):
+    """
+    Returns:
+        numpy.ndarray: The number of set bits in each row of a 2-D uint64 array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class PantryIndex:
+    """
+    Ingredient bitsets for a recipe catalog, ranked against a pantry.
+    """
+
+    def __init__(self, recipes, width=1024):
+        """
+        Args:
+            recipes (iterable): RecipeDetail-shaped dicts.
+            width (int): Number of ingredients with a bit; rounded up to a multiple of 64.
+        """
+        self.recipe_ids = []
+        self.names = []
+        dish_types = []
+        recipe_ingredients = []
+        frequency = {}
+        for recipe in recipes:
+            ingredients = {canonical_ingredient(line) for line in recipe.get("ingredients") or []}
+            ingredients.discard(None)
+            self.recipe_ids.append(str(recipe["recipe_id"]))
+            self.names.append(recipe.get("name") or "")
+            dish_types.append(" ".join(tokenize(recipe.get("dish_type") or "")))
+            recipe_ingredients.append(ingredients)
+            for ingredient in ingredients:
+                frequency[ingredient] = frequency.get(ingredient, 0) + 1
+
+        # Most frequent first, so the bitset covers as many ingredient occurrences as possible
+        self.vocabulary = sorted(frequency, key=lambda ingredient: (-frequency[ingredient], ingredient))
+        self.ingredient_ids = {ingredient: position for position, ingredient in enumerate(self.vocabulary)}
+        self.width = min(-(-max(width, 1) // 64) * 64, -(-len(self.vocabulary) // 64) * 64 or 64)
+        self.dish_type_codes = {}
+        self.dish_types = np.array(
+            [self.dish_type_codes.setdefault(dish_type, len(self.dish_type_codes)) for dish_type in dish_types],
+            dtype=np.int32,
+        )
+
+        count = len(self.recipe_ids)
+        self.bits = np.zeros((count, self.width // 64), dtype=np.uint64)
+        self.sizes = np.zeros(count, dtype=np.int32)
+        # Canonical ingredient IDs per recipe, CSR style, to list what a match is missing
+        self.offsets = np.zeros(count + 1, dtype=np.int64)
+        rare_rows = {}
+        ids = []
+        for row, ingredients in enumerate(recipe_ingredients):
+            for ingredient in ingredients:
+                ingredient_id = self.ingredient_ids[ingredient]
+                ids.append(ingredient_id)
+                if ingredient_id < self.width:
+                    self.bits[row, ingredient_id // 64] |= np.uint64(1 << (ingredient_id % 64))
+                else:
+                    rare_rows.setdefault(ingredient_id, []).append(row)
+            self.sizes[row] = len(ingredients)
+            self.offsets[row + 1] = len(ids)
+        self.ingredients = np.array(ids, dtype=np.int32)
+        self.rare_rows = {ingredient_id: np.array(rows, dtype=np.int32) for ingredient_id, rows in rare_rows.items()}
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def pantry_ids(self, pantry):
+        """
+        Returns:
+            set: Canonical ingredient IDs of the pantry items the catalog knows about.
+        """
+        ids = set()
+        for item in pantry:
+            ingredient_id = self.ingredient_ids.get(canonical_ingredient(item))
+            if ingredient_id is not None:
+                ids.add(ingredient_id)
+        return ids
+
+    def match(
+        self, pantry, max_missing=None, min_coverage=0.0, dish_type=None, eligible=None, accept=None, offset=0, limit=10
+    ):
+        """
+        Ranks recipes by how few ingredients are missing from the pantry, then by coverage.
+
+        Args:
+            pantry (list): Ingredients the user has, in any format ("2 eggs", "olive oil").
+            max_missing (int): Drop recipes missing more ingredients than this.
+            min_coverage (float): Drop recipes with a lower share of ingredients in the pantry.
+            dish_type (str): Only rank recipes of this dish type.
+            eligible (numpy.ndarray): Optional boolean array over the rows; only True rows are ranked.
+            accept (callable): Optional recipe_id -> bool filter applied to the ranked results;
+                offset and limit count accepted results.
+            offset (int): Number of ranked (and accepted) results to skip, for pagination.
+            limit (int): Number of results to return.
+
+        Returns:
+            list: Dicts with recipe_id, name, coverage, and missing_ingredients, best first.
+        """
+        pantry_ids = self.pantry_ids(pantry)
+        query = np.zeros(self.width // 64, dtype=np.uint64)
+        for ingredient_id in pantry_ids:
+            if ingredient_id < self.width:
+                query[ingredient_id // 64] |= np.uint64(1 << (ingredient_id % 64))
+
+        have = popcount_rows(self.bits & query)
+        for ingredient_id in pantry_ids:
+            if ingredient_id >= self.width:
+                np.add.at(have, self.rare_rows[ingredient_id], 1)
+        missing = self.sizes - have
+        coverage = np.divide(have, self.sizes, out=np.zeros(len(self), dtype=np.float64), where=self.sizes > 0)
+
+        ranked_rows = (self.sizes > 0) & (coverage >= min_coverage)
+        if max_missing is not None:
+            ranked_rows &= missing <= max_missing
+        if dish_type:
+            ranked_rows &= self.dish_types == self.dish_type_codes.get(" ".join(tokenize(dish_type)), -1)
+        if eligible is not None:
+            ranked_rows &= eligible
+        rows = np.flatnonzero(ranked_rows)
+
+        # Missing count dominates; coverage (< 1 after scaling) breaks ties, then the row order
+        score = missing[rows] + (1.0 - coverage[rows]) * 0.5
+        end = min(offset + limit, len(rows))
+        if end <= offset:
+            return []
+        if accept is not None:
+            # Rank every row: how deep the accepted results go is only known while walking them
+            accepted = []
+            for row in rows[np.lexsort((rows, score))]:
+                if accept(self.recipe_ids[row]):
+                    accepted.append(row)
+                    if len(accepted) == offset + limit:
+                        break
+            ranked = accepted[offset:]
+        else:
+            if end < len(rows):
+                # Keep everything tied with the last result, so pages stay stable under ties
+                keep = score <= np.partition(score, end - 1)[end - 1]
+                rows, score = rows[keep], score[keep]
+            ranked = rows[np.lexsort((rows, score))][offset:end]
+
+        results = []
+        for row in ranked:
+            ingredient_ids = self.ingredients[self.offsets[row]:self.offsets[row + 1]]
+            results.append({
+                "recipe_id": self.recipe_ids[row],
+                "name": self.names[row],
+                "coverage": round(float(coverage[row]), 3),
+                "missing_ingredients": sorted(
+                    self.vocabulary[ingredient_id] for ingredient_id in ingredient_ids if ingredient_id not in pantry_ids
+                ),
+            })
+        return results
+
+
+_pantry_index = DerivedIndex("pantry bitsets")
+
+
+def get_pantry_index(index=None, corpus=None):
+    """
+    Returns a PantryIndex over the local catalog, or None when there is none.
+
+    Built from the recipe index when one is configured (and rebuilt in the
+    background once its snapshot has changed), otherwise from the recipe corpus.
+
+    Args:
+        index (RecipeIndex): Recipe index to use. Defaults to RECIPE_INDEX_DIR.
+        corpus (RecipeCorpus): Corpus to use without an index. Defaults to RECIPE_CORPUS_PATH.
+    """
+    if index is None and corpus is None:
+        from recipe_corpus import get_recipe_corpus
+        from recipe_index import get_recipe_index
+
+        index = get_recipe_index()
+        corpus = None if index is not None else get_recipe_corpus()
+
+    if index is not None:
+        snapshot = index.snapshot()
+        source = (id(index), snapshot.sequence)
+        recipes = (recipe for _, recipe in snapshot.recipes.items())
+    elif corpus is not None:
+        source = (id(corpus), None)
+        recipes = iter(corpus)
+    else:
+        return None
+
+    return _pantry_index.get(source, lambda: PantryIndex(recipes, width=int(os.getenv("PANTRY_BITSET_WIDTH", "1024"))))
@@ -0,0 +1,274 @@
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+"""
+On-demand profiling of individual recipe requests.
+
+Profiling is enabled for every request with RECIPE_PROFILE (a comma-separated
+list of "cpu", "memory", "wall", or "all"). Add "request" to the list to let a
+single request opt in through the `profile` argument of RecipeCrew.run / the
+"profile" request flag; without it request flags are ignored.
+
+Artifacts land in RECIPE_PROFILE_DIR (default ./profiles), named after the
+request ID and stage. A request ID other than 1-64 letters, digits, "_" or "-"
+is replaced by a generated one, so clients cannot choose paths.
+- <request_id>.<stage>.prof       cProfile stats, open with pstats or snakeviz; a
+                                   stage nested in another on the same thread is
+                                   covered by the outer stage's profile
+- <request_id>.<stage>.memory.txt  top allocation sites from tracemalloc
+- <request_id>.<stage>.wall.txt    sampled wall-clock stacks in collapsed
+                                   (flamegraph.pl) format
+
+Pipeline stages run on scheduler threads and are profiled there, each as its own
+stage. The "request" artifacts cover all of them: its CPU profile merges the
+stage threads' profiles, and its wall-clock sampler samples every thread that
+is running a stage of the request.
+
+When RECIPE_PROFILE is unset or "off", profiling is disabled entirely and
+@profiled returns the function unchanged, so the overhead is zero.
+"""
+
+load_dotenv()
+
+PROFILE_KINDS = ("cpu", "memory", "wall")
+
+_settings = {item.strip() for item in os.getenv("RECIPE_PROFILE", "off").lower().split(",")}
+DEFAULT_KINDS = frozenset(PROFILE_KINDS if "all" in _settings else _settings & set(PROFILE_KINDS))
+REQUEST_FLAGS_ENABLED = "request" in _settings
+PROFILING_AVAILABLE = bool(DEFAULT_KINDS) or REQUEST_FLAGS_ENABLED
+
+# Request IDs end up in artifact file names
+_REQUEST_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# The profiling session of the request running in this context, if any
+_current_session = contextvars.ContextVar("profiling_session", default=None)
+# Only one cProfile profiler can be active per thread; nested stages rely on the outer one
+_cpu_profiling = threading.local()
+
+
+def safe_request_id(request_id):
+    """
+    Returns:
+        str: The request ID when it is safe to use in file names, otherwise a generated one.
+    """
+    if request_id and _REQUEST_ID.fullmatch(request_id):
+        return request_id
+    return uuid.uuid4().hex[:12]
+
+
+def parse_kinds(flag):
+    """
+    Returns:
+        frozenset: Profile kinds requested by a request flag (True, "all", or "cpu,wall").
+    """
+    if flag is True or flag == "all":
+        return frozenset(PROFILE_KINDS)
+    if not flag:
+        return frozenset()
+    return frozenset(kind.strip() for kind in str(flag).split(",") if kind.strip() in PROFILE_KINDS)
+
+
+class WallClockSampler:
+    """
+    Samples the stacks of some threads at a fixed interval from a background thread.
+    """
+
+    def __init__(self, thread_ids, interval=0.005):
+        """
+        Args:
+            thread_ids (callable): Returns the IDs of the threads to sample; called at every sample.
+            interval (float): Seconds between samples.
+        """
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfilingSession:
+    """
+    Profiling state of one request.
+    """
+
+    def __init__(self, request_id, kinds, directory):
+        self.request_id = request_id
+        self.kinds = kinds
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._stage_counts = Counter()
+        self._lock = threading.Lock()
+        # Threads running a stage of this request, and the CPU profiles of stages on other threads
+        self._threads = Counter()
+        self._thread_profiles = []
+
+    def threads(self):
+        """
+        Returns:
+            list: IDs of the threads currently running a stage of this session.
+        """
+        with self._lock:
+            return list(self._threads)
+
+    def _path(self, stage, suffix):
+        return os.path.join(self.directory, f"{self.request_id}.{stage}.{suffix}")
+
+    def _stage_name(self, stage):
+        # A tool called several times in one request gets one artifact set per call
+        with self._lock:
+            self._stage_counts[stage] += 1
+            count = self._stage_counts[stage]
+        return stage if count == 1 else f"{stage}.{count}"
+
+    @contextmanager
+    def stage(self, stage, all_threads=False):
+        """
+        Profiles the enclosed block and writes its artifacts under the stage name.
+
+        Args:
+            stage (str): Stage name used in artifact file names.
+            all_threads (bool): Also cover the stages running on other threads meanwhile:
+                their stacks are sampled and their CPU profiles merged into this one.
+        """
+        stage = self._stage_name(stage)
+        thread_id = threading.get_ident()
+        profiler = None
+        sampler = None
+        started_tracemalloc = False
+        with self._lock:
+            self._threads[thread_id] += 1
+
+        if "memory" in self.kinds and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            started_tracemalloc = True
+        if "wall" in self.kinds:
+            sampler = WallClockSampler(self.threads if all_threads else lambda: (thread_id,))
+            sampler.start()
+        if "cpu" in self.kinds and not getattr(_cpu_profiling, "active", False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+            _cpu_profiling.active = True
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._threads[thread_id] -= 1
+                if not self._threads[thread_id]:
+                    del self._threads[thread_id]
+            if profiler is not None:
+                profiler.disable()
+                _cpu_profiling.active = False
+                if all_threads:
+                    with self._lock:
+                        thread_profiles, self._thread_profiles = self._thread_profiles, []
+                    stats = pstats.Stats(profiler)
+                    for thread_profile in thread_profiles:
+                        stats.add(thread_profile)
+                    stats.dump_stats(self._path(stage, "prof"))
+                else:
+                    profiler.dump_stats(self._path(stage, "prof"))
+                    with self._lock:
+                        self._thread_profiles.append(profiler)
+            if sampler is not None:
+                sampler.stop()
+                sampler.dump(self._path(stage, "wall.txt"))
+            if "memory" in self.kinds and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                with open(self._path(stage, "memory.txt"), "w", encoding="utf-8") as f:
+                    for statistic in snapshot.statistics("lineno")[:50]:
+                        f.write(f"{statistic}\n")
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            logging.info("Profiled %s/%s in %.3fs (%s).", self.request_id, stage, elapsed, ",".join(sorted(self.kinds)))
+
+
+@contextmanager
+def profile_request(request_id=None, flag=None):
+    """
+    Opens a profiling session for one request when the environment or the request flag asks for it.
+
+    Args:
+        request_id (str): Used in artifact file names. Generated when omitted or unsafe.
+        flag: Per-request flag: True, "all", or a comma-separated list of kinds. Ignored
+            unless RECIPE_PROFILE includes "request".
+
+    Yields:
+        ProfilingSession: The session, or None when profiling is off for this request.
+    """
+    kinds = DEFAULT_KINDS | parse_kinds(flag) if REQUEST_FLAGS_ENABLED else DEFAULT_KINDS
+    if not kinds:
+        yield None
+        return
+
+    session = ProfilingSession(safe_request_id(request_id), kinds, os.getenv("RECIPE_PROFILE_DIR", "profiles"))
+    token = _current_session.set(session)
+    try:
+        with session.stage("request", all_threads=True):
+            yield session
+    finally:
+        _current_session.reset(token)
+
+
+def profiled(stage):
+    """
+    Decorator profiling a function as its own stage when its request is being profiled.
+
+    With RECIPE_PROFILE unset or "off" the function is returned unchanged.
+    """
+    def decorator(func):
+        if not PROFILING_AVAILABLE:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = _current_session.get()
+            if session is None:
+                return func(*args, **kwargs)
+            with session.stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,287 @@
+import argparse
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from dotenv import load_dotenv
+
+"""
+Read-only binary recipe corpus, opened with mmap.
+
+Every worker process that opens the same file maps the same page-cache pages,
+so a large catalog is held in memory once per host rather than once per worker.
+RecipeCorpus.get decodes only the record asked for.
+
+Layout (little-endian, sections aligned to 8 bytes):
+- header:          magic, version, recipe count, string count, section offsets
+- string offsets:  (string count + 1) x u64 into the string data
+- string data:     UTF-8 bytes of every distinct string, each stored once
+- ID index:        recipe count x (u32 string ID, u32 record number), sorted by recipe ID bytes
+- record offsets:  (recipe count + 1) x u64 into the record data
+- record data:     per recipe, u32 words: recipe_id, name, cuisine, dish_type, notes,
+                   ingredient count + string IDs, step count + string IDs,
+                   nutrition count + (key string ID, float32 value) pairs
+- columns:         recipe count x i32 cooking_time, i32 servings, f32 calories
+                   (-1 / NaN when missing)
+"""
+
+load_dotenv()
+
+MAGIC = b"RCORPUS1"
+VERSION = 1
+NO_STRING = 0xFFFFFFFF
+_HEADER = struct.Struct("<8sIIIIQQQQQQ")
+COLUMNS = ("cooking_time", "servings", "calories")
+
+
+def _align(f):
+    padding = -f.tell() % 8
+    f.write(b"\0" * padding)
+    return f.tell()
+
+
+def write_corpus(recipes, path):
+    """
+    Writes recipes to a corpus file, replacing it atomically.
+
+    Args:
+        recipes (iterable): RecipeDetail-shaped dicts (or models).
+        path (str): Destination file.
+
+    Returns:
+        int: Number of recipes written.
+    """
+    strings = {}
+
+    def intern(value):
+        if value is None or value == "":
+            return NO_STRING
+        value = str(value)
+        string_id = strings.get(value)
+        if string_id is None:
+            string_id = strings[value] = len(strings)
+        return string_id
+
+    records = array("I")
+    record_offsets = array("Q", [0])
+    ids = []
+    cooking_times, servings, calories = array("i"), array("i"), array("f")
+
+    for recipe in recipes:
+        if hasattr(recipe, "model_dump"):
+            recipe = recipe.model_dump()
+        record_number = len(ids)
+        id_string = intern(recipe["recipe_id"])
+        ids.append((str(recipe["recipe_id"]).encode("utf-8"), id_string, record_number))
+
+        records.extend(intern(recipe.get(field)) for field in ("recipe_id", "name", "cuisine", "dish_type", "notes"))
+        for field in ("ingredients", "steps"):
+            values = recipe.get(field) or []
+            records.append(len(values))
+            records.extend(intern(value) for value in values)
+        nutrition = recipe.get("nutrition") or {}
+        records.append(len(nutrition))
+        for key, value in nutrition.items():
+            records.append(intern(key))
+            records.append(struct.unpack("<I", struct.pack("<f", float(value)))[0])
+        record_offsets.append(len(records) * 4)
+
+        cooking_times.append(recipe.get("cooking_time") if recipe.get("cooking_time") is not None else -1)
+        servings.append(recipe.get("servings") if recipe.get("servings") is not None else -1)
+        calories.append(float(nutrition.get("calories", math.nan)))
+
+    ids.sort()
+    id_index = array("I")
+    for _, string_id, record_number in ids:
+        id_index.extend((string_id, record_number))
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+
+        encoded = [value.encode("utf-8") for value in strings]
+        string_offsets = array("Q", [0])
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        string_offsets_at = _align(f)
+        string_offsets.tofile(f)
+        string_data_at = _align(f)
+        f.write(b"".join(encoded))
+        id_index_at = _align(f)
+        id_index.tofile(f)
+        record_offsets_at = _align(f)
+        record_offsets.tofile(f)
+        records_at = _align(f)
+        records.tofile(f)
+        columns_at = _align(f)
+        cooking_times.tofile(f)
+        servings.tofile(f)
+        calories.tofile(f)
+
+        f.seek(0)
+        f.write(_HEADER.pack(
+            MAGIC, VERSION, len(ids), len(strings), 0,
+            string_offsets_at, string_data_at, id_index_at, record_offsets_at, records_at, columns_at,
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    return len(ids)
+
+
+class RecipeCorpus:
+    """
+    Zero-copy reader over a corpus file.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("Recipe corpus files are little-endian only.")
+
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        (magic, version, self._count, string_count, _, string_offsets_at, self._string_data_at,
+         id_index_at, record_offsets_at, self._records_at, columns_at) = _HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} recipe corpus.")
+
+        self._string_offsets = self._buffer[string_offsets_at:string_offsets_at + 8 * (string_count + 1)].cast("Q")
+        self._id_index = self._buffer[id_index_at:id_index_at + 8 * self._count].cast("I")
+        self._record_offsets = self._buffer[record_offsets_at:record_offsets_at + 8 * (self._count + 1)].cast("Q")
+        self._columns = {}
+        for position, (name, code) in enumerate(zip(COLUMNS, "iif")):
+            start = columns_at + position * 4 * self._count
+            self._columns[name] = self._buffer[start:start + 4 * self._count].cast(code)
+
+    def __len__(self):
+        return self._count
+
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        start = self._string_data_at + self._string_offsets[string_id]
+        end = self._string_data_at + self._string_offsets[string_id + 1]
+        return str(self._buffer[start:end], "utf-8")
+
+    def _string_bytes(self, string_id):
+        start = self._string_data_at + self._string_offsets[string_id]
+        return self._buffer[start:self._string_data_at + self._string_offsets[string_id + 1]].tobytes()
+
+    def column(self, name):
+        """
+        Returns:
+            memoryview: A zero-copy view of a numeric column, indexed by record number.
+                `numpy.frombuffer(corpus.column(name), ...)` also shares the mapped pages.
+        """
+        return self._columns[name]
+
+    def record_number(self, recipe_id):
+        """
+        Returns:
+            int: The record number for recipe_id, or None. Binary search over the ID index.
+        """
+        key = str(recipe_id).encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string_bytes(self._id_index[2 * middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._string_bytes(self._id_index[2 * low]) == key:
+            return self._id_index[2 * low + 1]
+        return None
+
+    def record(self, record_number):
+        """
+        Decodes one record.
+
+        Returns:
+            dict: A RecipeDetail-shaped dict.
+        """
+        start = self._records_at + self._record_offsets[record_number]
+        end = self._records_at + self._record_offsets[record_number + 1]
+        words = self._buffer[start:end].cast("I")
+
+        recipe = {
+            field: self.string(words[position]) or ""
+            for position, field in enumerate(("recipe_id", "name", "cuisine", "dish_type", "notes"))
+        }
+        recipe["cuisine"] = recipe["cuisine"] or None
+        recipe["dish_type"] = recipe["dish_type"] or None
+        position = 5
+        for field in ("ingredients", "steps"):
+            length = words[position]
+            recipe[field] = [self.string(string_id) for string_id in words[position + 1:position + 1 + length]]
+            position += 1 + length
+        nutrition = {}
+        for _ in range(words[position]):
+            value = struct.unpack("<f", struct.pack("<I", words[position + 2]))[0]
+            nutrition[self.string(words[position + 1])] = value
+            position += 2
+        recipe["nutrition"] = nutrition
+
+        cooking_time = self._columns["cooking_time"][record_number]
+        servings = self._columns["servings"][record_number]
+        recipe["cooking_time"] = cooking_time if cooking_time >= 0 else None
+        recipe["servings"] = servings if servings >= 0 else None
+        return recipe
+
+    def get(self, recipe_id):
+        """
+        Returns:
+            dict: The recipe with that ID, or None.
+        """
+        record_number = self.record_number(recipe_id)
+        return None if record_number is None else self.record(record_number)
+
+    def __iter__(self):
+        for record_number in range(self._count):
+            yield self.record(record_number)
+
+    def close(self):
+        for view in (self._string_offsets, self._id_index, self._record_offsets, *self._columns.values()):
+            view.release()
+        self._buffer.release()
+        self._mmap.close()
+
+
+_default_corpus = None
+_default_corpus_lock = threading.Lock()
+
+
+def get_recipe_corpus():
+    """
+    Returns the process-wide corpus from RECIPE_CORPUS_PATH, or None when it is not configured.
+    """
+    global _default_corpus
+
+    path = os.getenv("RECIPE_CORPUS_PATH")
+    if not path:
+        return None
+    with _default_corpus_lock:
+        if _default_corpus is None:
+            _default_corpus = RecipeCorpus(path)
+        return _default_corpus
+
+
+if __name__ == "__main__":
+    from recipe_index import RecipeIndex
+
+    parser = argparse.ArgumentParser(description="Build a recipe corpus file from a recipe index.")
+    parser.add_argument("index_dir", help="Recipe index directory to export.")
+    parser.add_argument("output", help="Corpus file to write.")
+    args = parser.parse_args()
+
+    # Read-only, so exporting while ingest.py writes leaves its WAL alone
+    snapshot = RecipeIndex(args.index_dir, read_only=True).snapshot()
+    count = write_corpus((recipe for _, recipe in snapshot.recipes.items()), args.output)
+    print(f"Wrote {count} recipes to {args.output}.")
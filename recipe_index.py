@@ -0,0 +1,590 @@
+import bisect
+import glob
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from dotenv import load_dotenv
+
+from tokenization import tokenize
+
+"""
+Local recipe index with incremental updates and a write-ahead log.
+
+The index maps recipe IDs to recipe records (RecipeDetail-shaped dicts) and
+keeps posting lists from ingredient and facet terms to recipe IDs, as sorted
+tuples, so a page of matches is found by bisecting from the previous page's last
+ID rather than by collecting and sorting every match. Terms come from
+tokenization.tokenize, so English, French and Darija/Arabic spellings of an
+ingredient or dish share one posting list.
+
+Updates:
+- add/update/delete (or a batch via apply) are appended to the current WAL
+  segment and fsynced before they become visible.
+- Each write publishes a new IndexSnapshot. Snapshots are immutable and share
+  every shard and posting list the write did not touch, so a write costs
+  roughly the size of the touched posting lists, not a rebuild.
+- Readers call snapshot() and query it without taking any lock; a snapshot
+  never changes under them.
+- Compaction rotates the WAL segment, writes the snapshot taken at that point
+  to disk and deletes the segments it covers. It runs in a background thread
+  once enough operations have accumulated.
+
+One process writes to an index directory at a time. Any number of processes can
+open it read-only alongside (get_recipe_index does, for serving processes): they
+never truncate or delete files, and pick up the writer's changes by polling the
+WAL segments from where they last stopped reading.
+"""
+
+load_dotenv()
+
+_SHARDS = 256
+# compact() writes the sequence first, so read-only indexes can check it without parsing the whole file
+_SNAPSHOT_SEQUENCE = re.compile(rb'^\{"sequence":(\d+),')
+
+
+def recipe_terms(recipe):
+    """
+    Returns:
+        set: Every term a recipe is indexed under.
+    """
+    terms = set()
+    language = recipe.get("language")
+    for ingredient in recipe.get("ingredients", []):
+        terms.update(tokenize(ingredient, language))
+    for facet in ("dish_type", "cuisine"):
+        if recipe.get(facet):
+            terms.add(f"{facet}:{' '.join(tokenize(recipe[facet], language))}")
+    return terms
+
+
+class _PersistentMap:
+    """
+    Immutable hash map split into shards; set/delete copy only the touched shard.
+    """
+
+    __slots__ = ("_shards", "_size")
+
+    def __init__(self, shards=None, size=0):
+        self._shards = shards or tuple({} for _ in range(_SHARDS))
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def get(self, key, default=None):
+        return self._shards[hash(key) % _SHARDS].get(key, default)
+
+    def __contains__(self, key):
+        return key in self._shards[hash(key) % _SHARDS]
+
+    def items(self):
+        for shard in self._shards:
+            yield from shard.items()
+
+    def update(self, changes):
+        """
+        Args:
+            changes (dict): key -> new value, or None to delete the key.
+
+        Returns:
+            _PersistentMap: A new map with the changes applied.
+        """
+        shards = list(self._shards)
+        copied = set()
+        size = self._size
+        for key, value in changes.items():
+            position = hash(key) % _SHARDS
+            if position not in copied:
+                shards[position] = dict(shards[position])
+                copied.add(position)
+            shard = shards[position]
+            existed = key in shard
+            if value is None:
+                if existed:
+                    del shard[key]
+                    size -= 1
+            else:
+                shard[key] = value
+                size += 0 if existed else 1
+        return _PersistentMap(tuple(shards), size)
+
+
+class IndexSnapshot:
+    """
+    A consistent, immutable view of the index.
+    """
+
+    def __init__(self, recipes, postings, sequence):
+        self.recipes = recipes
+        self.postings = postings
+        self.sequence = sequence
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def get(self, recipe_id):
+        """
+        Returns:
+            dict: The recipe record, or None.
+        """
+        return self.recipes.get(str(recipe_id))
+
+    def search(self, ingredient_filters=(), dish_type=None, cuisine=None):
+        """
+        Finds recipes containing every filter term and matching the given facets.
+
+        Returns:
+            list: Matching recipe IDs, sorted.
+        """
+        return list(self.iter_search(ingredient_filters, dish_type, cuisine))
+
+    def iter_search(self, ingredient_filters=(), dish_type=None, cuisine=None, after=None):
+        """
+        Yields matching recipe IDs in sorted order, starting after the given ID.
+
+        Used for keyset pagination: pass the last ID of the previous page as `after`.
+        The rarest term's posting list is walked from `after`; every other list is only
+        bisected, from where its previous bisection ended, so a page costs
+        O(page size * terms * log postings) rather than the size of the match set.
+        """
+        postings = self._postings(ingredient_filters, dish_type, cuisine)
+        if not postings:
+            return
+        first, others = postings[0], postings[1:]
+        start = bisect.bisect_right(first, after) if after is not None else 0
+        cursors = [bisect.bisect_right(posting, after) if after is not None else 0 for posting in others]
+        for index in range(start, len(first)):
+            recipe_id = first[index]
+            for position, posting in enumerate(others):
+                cursor = cursors[position] = bisect.bisect_left(posting, recipe_id, cursors[position])
+                if cursor == len(posting):
+                    return
+                if posting[cursor] != recipe_id:
+                    break
+            else:
+                yield recipe_id
+
+    def _postings(self, ingredient_filters, dish_type, cuisine):
+        # The sorted posting lists of every query term, shortest first; empty when nothing can match
+        terms = set()
+        for ingredient in ingredient_filters:
+            terms.update(tokenize(ingredient))
+        if dish_type:
+            terms.add(f"dish_type:{' '.join(tokenize(dish_type))}")
+        if cuisine:
+            terms.add(f"cuisine:{' '.join(tokenize(cuisine))}")
+        if not terms:
+            return []
+        postings = sorted((self.postings.get(term, ()) for term in terms), key=len)
+        return postings if postings[0] else []
+
+
+class RecipeIndex:
+    """
+    Durable, incrementally updated recipe index.
+    """
+
+    def __init__(self, directory, compact_every=10000, sync=True, read_only=False, refresh_interval=1.0):
+        """
+        Args:
+            directory (str): Directory holding the snapshot and WAL segments.
+            compact_every (int): WAL operations after which a background compaction starts.
+            sync (bool): fsync the WAL after every write.
+            read_only (bool): Open without writing: recovery leaves torn WAL tails and covered
+                segments to the writer, and writes raise RuntimeError.
+            refresh_interval (float): Seconds between polls for the writer's changes when read-only.
+        """
+        self.directory = directory
+        self.compact_every = compact_every
+        self.sync = sync
+        self.read_only = read_only
+        self.refresh_interval = refresh_interval
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        # One compaction at a time, background or explicit: each writes the snapshot file and deletes segments
+        self._compaction_lock = threading.Lock()
+        self._compaction = None
+        self._refresh_lock = threading.Lock()
+        self._next_refresh = time.monotonic() + refresh_interval
+        self._snapshot, self._offsets, self._ops_since_compaction, self._segment = self._load()
+
+    # -- Reads ---------------------------------------------------------------
+
+    def snapshot(self):
+        """
+        Returns:
+            IndexSnapshot: The latest published snapshot; read-only indexes poll for new writes first,
+                at most every refresh_interval seconds.
+        """
+        if self.read_only and time.monotonic() >= self._next_refresh:
+            self.refresh()
+        return self._snapshot
+
+    def get(self, recipe_id):
+        return self.snapshot().get(recipe_id)
+
+    def search(self, ingredient_filters=(), dish_type=None, cuisine=None):
+        return self.snapshot().search(ingredient_filters, dish_type, cuisine)
+
+    def refresh(self):
+        """
+        Picks up the writes another process made since the last refresh of this read-only index.
+
+        New WAL lines are read from where the last refresh stopped. When the writer compacted
+        away entries this index had not read yet, the snapshot file is loaded again.
+        Concurrent calls return at once while one refresh runs.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_refresh = time.monotonic() + self.refresh_interval
+            snapshot, offsets, _ = self._catch_up(self._snapshot, self._offsets)
+            if snapshot is None or self._snapshot_file_sequence() > snapshot.sequence:
+                snapshot, offsets, _, _ = self._load()
+            if snapshot.sequence != self._snapshot.sequence:
+                logging.info("Refreshed recipe index to sequence %d.", snapshot.sequence)
+            self._snapshot, self._offsets = snapshot, offsets
+        finally:
+            self._refresh_lock.release()
+
+    # -- Writes --------------------------------------------------------------
+
+    def add(self, recipe):
+        self.apply([("add", recipe)])
+
+    def update(self, recipe):
+        self.apply([("update", recipe)])
+
+    def delete(self, recipe_id):
+        self.apply([("delete", str(recipe_id))])
+
+    def apply(self, operations):
+        """
+        Applies a batch of operations atomically: readers see all of them or none.
+
+        Args:
+            operations (list): (op, payload) pairs. op is "add" or "update" with a recipe
+                dict (or model) as payload, or "delete" with a recipe ID.
+
+        Raises:
+            KeyError: On adding an existing ID, or updating/deleting a missing one.
+            RuntimeError: When the index was opened read-only.
+        """
+        self._check_writable()
+        with self._write_lock:
+            entries = []
+            present = {}
+            for op, payload in operations:
+                if op == "delete":
+                    recipe_id, recipe = str(payload), None
+                else:
+                    recipe = payload.model_dump() if hasattr(payload, "model_dump") else dict(payload)
+                    recipe_id = recipe["recipe_id"] = str(recipe["recipe_id"])
+                exists = present[recipe_id] if recipe_id in present else recipe_id in self._snapshot.recipes
+                if op == "add" and exists:
+                    raise KeyError(f"Recipe '{recipe_id}' already exists.")
+                if op in ("update", "delete") and not exists:
+                    raise KeyError(f"Recipe '{recipe_id}' does not exist.")
+                if op not in ("add", "update", "delete"):
+                    raise ValueError(f"Unknown index operation '{op}'.")
+                present[recipe_id] = op != "delete"
+                entries.append({"op": op, "recipe_id": recipe_id, "recipe": recipe})
+
+            sequence = self._snapshot.sequence
+            for entry in entries:
+                sequence += 1
+                entry["seq"] = sequence
+            self._append_wal(entries)
+            self._snapshot = self._apply_entries(self._snapshot, entries)
+
+            self._ops_since_compaction += len(entries)
+            if self._ops_since_compaction >= self.compact_every and self._compaction is None:
+                self._compaction = threading.Thread(target=self.compact, daemon=True)
+                self._compaction.start()
+
+    @staticmethod
+    def _apply_entries(snapshot, entries):
+        recipe_changes = {}
+        posting_adds = {}
+        posting_removes = {}
+
+        for entry in entries:
+            recipe_id = entry["recipe_id"]
+            previous = recipe_changes[recipe_id] if recipe_id in recipe_changes else snapshot.recipes.get(recipe_id)
+            if previous is not None:
+                for term in recipe_terms(previous):
+                    posting_removes.setdefault(term, set()).add(recipe_id)
+                    posting_adds.get(term, set()).discard(recipe_id)
+            recipe = entry["recipe"]
+            if recipe is not None:
+                for term in recipe_terms(recipe):
+                    posting_adds.setdefault(term, set()).add(recipe_id)
+                    posting_removes.get(term, set()).discard(recipe_id)
+            recipe_changes[recipe_id] = recipe
+
+        # Posting lists stay sorted tuples: the kept IDs keep their order and the added ones are merged in
+        posting_changes = {}
+        for term in posting_adds.keys() | posting_removes.keys():
+            adds = posting_adds.get(term, set())
+            dropped = posting_removes.get(term, set()) | adds
+            kept = [recipe_id for recipe_id in snapshot.postings.get(term, ()) if recipe_id not in dropped]
+            posting = tuple(heapq.merge(kept, sorted(adds)))
+            posting_changes[term] = posting or None
+
+        return IndexSnapshot(
+            snapshot.recipes.update(recipe_changes),
+            snapshot.postings.update(posting_changes),
+            entries[-1]["seq"] if entries else snapshot.sequence,
+        )
+
+    # -- Durability ----------------------------------------------------------
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"wal.{segment:08d}")
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"The recipe index in {self.directory} was opened read-only.")
+
+    def _append_wal(self, entries):
+        lines = []
+        for entry in entries:
+            encoded = json.dumps(entry, separators=(",", ":"))
+            lines.append(f"{zlib.crc32(encoded.encode('utf-8')):08x}\t{encoded}\n")
+        with open(self._segment_path(self._segment), "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+
+    def _read_segment(self, path, offset=0):
+        """
+        Returns:
+            tuple: (the valid entries of a WAL segment from a byte offset, the offset after the last one).
+        """
+        entries = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                try:
+                    checksum, encoded = raw.decode("utf-8").rstrip("\n").split("\t", 1)
+                    if not raw.endswith(b"\n") or int(checksum, 16) != zlib.crc32(encoded.encode("utf-8")):
+                        raise ValueError("checksum mismatch")
+                    entries.append(json.loads(encoded))
+                except ValueError:
+                    # The writer may be appending this line right now; it is read again on the next refresh
+                    if self.read_only:
+                        break
+                    # A torn write at the tail of the log from a crash; drop it
+                    logging.warning("Truncating corrupt WAL tail in %s at byte %d.", path, offset)
+                    with open(path, "r+b") as truncate:
+                        truncate.truncate(offset)
+                    break
+                offset += len(raw)
+        return entries, offset
+
+    def _segments(self):
+        return sorted(int(path.rsplit(".", 1)[1]) for path in glob.glob(os.path.join(self.directory, "wal.*")))
+
+    def _snapshot_file_sequence(self):
+        try:
+            with open(os.path.join(self.directory, "snapshot.json"), "rb") as f:
+                match = _SNAPSHOT_SEQUENCE.match(f.read(64))
+        except FileNotFoundError:
+            return 0
+        return int(match.group(1)) if match else 0
+
+    def _catch_up(self, snapshot, offsets, covered_segment=-1):
+        """
+        Applies the WAL entries past the given per-segment offsets.
+
+        Returns:
+            tuple: (new snapshot, new offsets, entries applied); the snapshot is None when
+                entries are missing, i.e. a compaction deleted segments while they were read.
+        """
+        new_offsets = {}
+        applied = 0
+        for segment in self._segments():
+            path = self._segment_path(segment)
+            if segment <= covered_segment:
+                if not self.read_only:
+                    os.remove(path)
+                continue
+            try:
+                entries, new_offsets[segment] = self._read_segment(path, offsets.get(segment, 0))
+            except FileNotFoundError:
+                return None, new_offsets, applied
+            entries = [entry for entry in entries if entry["seq"] > snapshot.sequence]
+            if entries:
+                if self.read_only and entries[0]["seq"] != snapshot.sequence + 1:
+                    return None, new_offsets, applied
+                snapshot = self._apply_entries(snapshot, entries)
+                applied += len(entries)
+        return snapshot, new_offsets, applied
+
+    def _load(self):
+        """
+        Reads the snapshot file and the WAL segments after it.
+
+        Returns:
+            tuple: (IndexSnapshot, segment offsets read up to, WAL entries applied, segment to append to).
+        """
+        while True:
+            snapshot = IndexSnapshot(_PersistentMap(), _PersistentMap(), 0)
+            snapshot_path = os.path.join(self.directory, "snapshot.json")
+            covered_segment = -1
+            if os.path.exists(snapshot_path):
+                with open(snapshot_path, encoding="utf-8") as f:
+                    data = json.load(f)
+                covered_segment = data["segment"]
+                entries = [
+                    {"op": "add", "recipe_id": recipe["recipe_id"], "recipe": recipe, "seq": data["sequence"]}
+                    for recipe in data["recipes"]
+                ]
+                snapshot = self._apply_entries(snapshot, entries)
+                snapshot = IndexSnapshot(snapshot.recipes, snapshot.postings, data["sequence"])
+
+            loaded, offsets, applied = self._catch_up(snapshot, {}, covered_segment)
+            if loaded is not None:
+                return loaded, offsets, applied, max(list(offsets) + [covered_segment + 1])
+            # Only a read-only index races with a compaction; the snapshot file is newer now
+            logging.info("Recipe index compacted while loading; loading again.")
+
+    def compact(self):
+        """
+        Persists the current snapshot and drops the WAL segments it covers.
+
+        Writers are only blocked while the WAL segment is rotated. A call made while
+        another compaction runs waits for it, then compacts again.
+
+        Raises:
+            RuntimeError: When the index was opened read-only.
+        """
+        self._check_writable()
+        try:
+            with self._compaction_lock:
+                with self._write_lock:
+                    snapshot = self._snapshot
+                    covered_segment = self._segment
+                    self._segment += 1
+                    self._ops_since_compaction = 0
+
+                # The sequence goes first, see _SNAPSHOT_SEQUENCE
+                data = {
+                    "sequence": snapshot.sequence,
+                    "segment": covered_segment,
+                    "recipes": [recipe for _, recipe in snapshot.recipes.items()],
+                }
+                snapshot_path = os.path.join(self.directory, "snapshot.json")
+                temporary_path = snapshot_path + ".tmp"
+                with open(temporary_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporary_path, snapshot_path)
+
+                for path in glob.glob(os.path.join(self.directory, "wal.*")):
+                    if int(path.rsplit(".", 1)[1]) <= covered_segment:
+                        os.remove(path)
+                logging.info("Compacted recipe index at sequence %d (%d recipes).", snapshot.sequence, len(snapshot))
+        finally:
+            # Only the background compaction clears its own handle; an explicit call leaves a running one tracked
+            if self._compaction is threading.current_thread():
+                self._compaction = None
+
+    def close(self):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+
+class DerivedIndex:
+    """
+    Holds a structure derived from the local catalog (pantry bitsets, dietary masks,
+    full-text index) and keeps it current without making readers wait.
+
+    The first build runs in the caller. Once the catalog has changed, callers keep
+    getting the previous build while one background thread builds the next, which is
+    then swapped in; a catalog write never puts a full rebuild on the request path.
+    Both builds are held in memory during the swap.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._value = None
+        self._source = None
+        self._building = False
+
+    def get(self, source, build):
+        """
+        Args:
+            source (tuple): (catalog identity, catalog version); a new version is rebuilt.
+            build (callable): Builds the structure for that version.
+
+        Returns:
+            The latest finished build for this catalog, or None if the first build failed.
+        """
+        with self._lock:
+            if self._source == source:
+                return self._value
+            if self._value is not None and self._source[0] == source[0]:
+                if not self._building:
+                    self._building = True
+                    threading.Thread(target=self._build_in_background, args=(source, build), daemon=True).start()
+                return self._value
+            # Nothing to serve for this catalog yet; concurrent callers wait for this build
+            value = self._build(build)
+            if value is not None:
+                self._value, self._source = value, source
+            return value
+
+    def _build(self, build):
+        start = time.perf_counter()
+        try:
+            value = build()
+        except Exception:
+            # The source is not updated, so the next call tries again
+            logging.exception("Could not build the %s; keeping the previous one.", self.name)
+            return None
+        logging.info("Built the %s for %d recipes in %.2fs.", self.name, len(value), time.perf_counter() - start)
+        return value
+
+    def _build_in_background(self, source, build):
+        value = self._build(build)
+        with self._lock:
+            if value is not None:
+                self._value, self._source = value, source
+            self._building = False
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_recipe_index():
+    """
+    Returns the process-wide recipe index from RECIPE_INDEX_DIR, or None when it is not configured.
+
+    It is opened read-only, polling for new writes every RECIPE_INDEX_REFRESH_SECONDS
+    (default 1): serving processes read the catalog, ingest.py writes it.
+    """
+    global _default_index
+
+    directory = os.getenv("RECIPE_INDEX_DIR")
+    if not directory:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = RecipeIndex(
+                directory, read_only=True, refresh_interval=float(os.getenv("RECIPE_INDEX_REFRESH_SECONDS", "1"))
+            )
+        return _default_index
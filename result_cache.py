@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+"""
+End-to-end cache of formatted recipes, keyed on coalescing.request_key.
+
+Two backends share the same API:
+- ResultCache: in-process, TTL plus LRU eviction.
+- SQLiteResultCache: a file shared by every process on the host (pre-forked
+  workers, the cache-warming job), TTL plus least-recently-used eviction.
+
+Values must be JSON-serializable; callers store `model_dump()` output.
+"""
+
+load_dotenv()
+
+
+class ResultCache:
+    """
+    In-memory TTL cache with a bounded number of entries.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600.0):
+        """
+        Args:
+            max_entries (int): Entries kept before the least recently used is evicted.
+            ttl (float): Default time to live in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns:
+            The cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(entry[1])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        encoded = json.dumps(value)
+        with self._lock:
+            self._entries[key] = (expires_at, encoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Returns:
+            bool: True if an entry was removed.
+        """
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteResultCache:
+    """
+    SQLite-backed cache shared across processes.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=3600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # Connections must not cross a fork, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                connection.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+                connection.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._connect().execute("DELETE FROM results WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the process-wide result cache, configured from environment variables.
+
+    Set RESULT_CACHE_PATH to share one SQLite cache file between processes.
+    """
+    global _default_cache
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+            ttl = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+            path = os.getenv("RESULT_CACHE_PATH")
+            if path:
+                _default_cache = SQLiteResultCache(path, max_entries=max_entries, ttl=ttl)
+            else:
+                _default_cache = ResultCache(max_entries=max_entries, ttl=ttl)
+        return _default_cache
@@ -0,0 +1,102 @@
+import re
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+"""
+Typed results passed between the recipe pipeline stages.
+
+Each stage asks the LLM for JSON matching one of these models and validates the
+answer with structured_output.parse_model, so later stages receive typed data
+instead of prose.
+"""
+
+
+def _leading_int(value):
+    # LLMs like to answer "30 minutes" or "4 servings" where we want 30 or 4
+    if isinstance(value, str):
+        match = re.search(r"\d+", value)
+        return int(match.group()) if match else None
+    return value
+
+
+class RecipeSummary(BaseModel):
+    recipe_id: str
+    name: str = ""
+    # Set by pantry-match searches
+    coverage: Optional[float] = None
+    missing_ingredients: List[str] = Field(default_factory=list)
+    # Set by full-text searches
+    score: Optional[float] = None
+
+    @field_validator("recipe_id", mode="before")
+    @classmethod
+    def _stringify_id(cls, value):
+        return str(value)
+
+
+class SearchResults(BaseModel):
+    recipes: List[RecipeSummary] = Field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+    @property
+    def recipe_ids(self):
+        return [recipe.recipe_id for recipe in self.recipes]
+
+
+class RecipeDetail(BaseModel):
+    recipe_id: str = ""
+    name: str = ""
+    ingredients: List[str] = Field(default_factory=list)
+    steps: List[str] = Field(default_factory=list)
+    cooking_time: Optional[int] = None  # minutes
+    servings: Optional[int] = None
+    cuisine: Optional[str] = None
+    dish_type: Optional[str] = None
+    nutrition: Dict[str, float] = Field(default_factory=dict)
+    notes: str = ""
+
+    @field_validator("recipe_id", mode="before")
+    @classmethod
+    def _stringify_id(cls, value):
+        return "" if value is None else str(value)
+
+    @field_validator("cooking_time", "servings", mode="before")
+    @classmethod
+    def _coerce_int(cls, value):
+        return _leading_int(value)
+
+
+class RecipeDetails(BaseModel):
+    recipes: List[RecipeDetail] = Field(default_factory=list)
+
+
+class CustomRecipe(RecipeDetail):
+    """
+    A recipe generated by the Recipe Creator rather than fetched from the database.
+    """
+
+
+class FormattedRecipe(RecipeDetail):
+    text: str = ""
+
+    def render(self):
+        """
+        Returns:
+            str: The formatted text, or a plain rendering of the structured fields.
+        """
+        if self.text:
+            return self.text
+
+        lines = [f"# {self.name}"]
+        if self.cooking_time is not None:
+            lines.append(f"Cooking Time: {self.cooking_time} minutes")
+        if self.servings is not None:
+            lines.append(f"Servings: {self.servings}")
+        lines.append("\n## Ingredients")
+        lines.extend(f"- {ingredient}" for ingredient in self.ingredients)
+        lines.append("\n## Step-by-step Instructions")
+        lines.extend(f"{number}. {step}" for number, step in enumerate(self.steps, 1))
+        if self.notes:
+            lines.append(f"\n## Additional Notes\n{self.notes}")
+        return "\n".join(lines)
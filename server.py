@@ -0,0 +1,404 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, TCPServer
+
+from dotenv import dotenv_values, load_dotenv
+
+from crew import invalidate_recipe_request, preload, run_recipe_request
+import metrics
+from profiling import safe_request_id
+from recipe_corpus import get_recipe_corpus
+from recipe_index import get_recipe_index
+from result_cache import get_result_cache
+from agents import RecipeAgents
+
+"""
+Pre-forking HTTP service for RecipeCrew.
+
+The master process binds the listening socket, imports the crew modules and
+forks a fixed number of workers. Each worker builds its warm state (agents,
+tools, HTTP client) once and then serves requests on the shared socket.
+
+Endpoints:
+- POST /recipes   JSON body with user_preferences, ingredient_filters, dish_type and
+                  an optional "profile" flag (see profiling.py); the X-Request-ID
+                  header names the profiling artifacts
+- GET  /healthz   liveness: the worker process is up
+- GET  /readyz    readiness: warm state is built and the worker is not draining
+- GET  /metrics   Prometheus metrics; set PROMETHEUS_MULTIPROC_DIR so any worker
+                  reports the totals of all workers
+- POST /cache/invalidate  {"all": true} or a request body; drops cached results.
+  With the in-memory cache this only affects the worker that handles the call,
+  set RESULT_CACHE_PATH to share one cache between workers.
+
+Set RECIPE_REQUEST_LOG to append every recipe request as a JSON line; warm_cache.py
+can mine that log for the most popular requests.
+
+Signals sent to the master:
+- SIGHUP: graceful reload. The master re-executes itself (same pid, same
+  listening socket), so changed code, .env and model settings take effect; the
+  old workers keep serving until the new master has started its generation,
+  then stop accepting and exit once their in-flight requests have finished.
+  When the new code does not import, the reload is refused and logged.
+  Keep-alive connections are closed after their next response, or after
+  RECIPE_SERVER_KEEPALIVE_TIMEOUT seconds (default 5) of idleness.
+- SIGTERM / SIGINT: graceful shutdown of all workers.
+"""
+
+load_dotenv()
+
+request_log_path = os.getenv("RECIPE_REQUEST_LOG")
+
+
+def log_request(payload):
+    """
+    Appends a recipe request to the request log as one JSON line.
+    """
+    entry = {key: payload[key] for key in ("user_preferences", "ingredient_filters", "dish_type")}
+    entry["ts"] = time.time()
+    # Single small O_APPEND writes from several workers do not interleave
+    with open(request_log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+class WorkerState:
+    """
+    Per-worker state built once after fork and reused by every request.
+    """
+
+    def __init__(self, max_concurrency):
+        self.ready = False
+        self.draining = False
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def warm_up(self):
+        start = time.monotonic()
+        # The corpus is mmapped read-only, so all workers share its page-cache pages
+        self.recipe_agents = RecipeAgents(index=get_recipe_index(), corpus=get_recipe_corpus())
+        self.ready = True
+        logging.info("Worker %d ready in %.2fs.", os.getpid(), time.monotonic() - start)
+
+
+class RecipeRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON request handler. The worker state is attached to the server as `state`.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed after this many seconds, so a draining worker can exit
+    timeout = float(os.getenv("RECIPE_SERVER_KEEPALIVE_TIMEOUT", "5"))
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+    def end_headers(self):
+        if self.server.state.draining:
+            # Sets close_connection, so the old worker stops serving this connection
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == "/healthz":
+            self._send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/readyz":
+            if state.ready and not state.draining:
+                self._send_json(200, {"status": "ready", "pid": os.getpid()})
+            else:
+                self._send_json(503, {"status": "not ready", "pid": os.getpid()})
+        elif self.path == "/metrics":
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path not in ("/recipes", "/cache/invalidate"):
+            self._send_json(404, {"error": "Not found."})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": "Request body must be valid JSON."})
+            return
+        if not isinstance(payload, dict):
+            self._send_json(400, {"error": "Request body must be a JSON object."})
+            return
+
+        if self.path == "/cache/invalidate" and payload.get("all"):
+            get_result_cache().clear()
+            self._send_json(200, {"invalidated": "all"})
+            return
+
+        missing = [key for key in ("user_preferences", "ingredient_filters", "dish_type") if key not in payload]
+        if missing:
+            self._send_json(400, {"error": f"Missing required keys: {', '.join(missing)}"})
+            return
+
+        if self.path == "/cache/invalidate":
+            invalidated = invalidate_recipe_request(
+                payload["user_preferences"], payload["ingredient_filters"], payload["dish_type"]
+            )
+            self._send_json(200, {"invalidated": invalidated})
+            return
+
+        state = self.server.state
+        if not state.ready:
+            self._send_json(503, {"error": "Worker is warming up."}, {"Retry-After": "1"})
+            return
+        if not state.slots.acquire(blocking=False):
+            self._send_json(503, {"error": "Worker is at its concurrency limit."}, {"Retry-After": "1"})
+            return
+
+        try:
+            # Only requests that are actually served count towards popularity
+            if request_log_path:
+                log_request(payload)
+            formatted_recipe = run_recipe_request(
+                payload["user_preferences"],
+                payload["ingredient_filters"],
+                payload["dish_type"],
+                recipe_agents=state.recipe_agents,
+                profile=payload.get("profile"),
+                request_id=safe_request_id(self.headers.get("X-Request-ID")),
+            )
+        except KeyError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.error("An unexpected error occurred: %s", e)
+            self._send_json(500, {"error": "Internal server error."})
+            return
+        finally:
+            state.slots.release()
+
+        if formatted_recipe is None:
+            self._send_json(502, {"error": "Failed to generate a formatted recipe."})
+        else:
+            self._send_json(200, {"formatted_recipe": formatted_recipe.model_dump()})
+
+
+class WorkerHTTPServer(ThreadingMixIn, TCPServer):
+    """
+    Threaded HTTP server that serves on a socket inherited from the master.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, listen_socket, state):
+        super().__init__(listen_socket.getsockname(), RecipeRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listen_socket
+        self.state = state
+
+
+def run_worker(listen_socket, max_concurrency):
+    """
+    Worker entry point, called in the child right after fork.
+    """
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    state = WorkerState(max_concurrency)
+    server = WorkerHTTPServer(listen_socket, state)
+
+    def drain(signum, frame):
+        state.draining = True
+        # shutdown() blocks until serve_forever returns, so it must not run on the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+
+    try:
+        state.warm_up()
+    except Exception as e:
+        logging.error("Worker %d failed to warm up: %s", os.getpid(), e)
+        os._exit(1)
+
+    server.serve_forever()
+    # Waits for in-flight request threads to finish
+    server.server_close()
+    logging.info("Worker %d drained and exiting.", os.getpid())
+    # os._exit skips atexit handlers
+    metrics.REGISTRY.flush()
+    os._exit(0)
+
+
+class PreforkMaster:
+    """
+    Supervises worker processes: spawns, respawns, reloads and shuts them down.
+    """
+
+    def __init__(self, host, port, workers, max_concurrency, backlog=128, listen_fd=None, retiring=()):
+        """
+        Args:
+            listen_fd (int): Listening socket inherited from the master this one replaced on reload.
+            retiring (iterable): PIDs of that master's workers, stopped once this master's are up.
+        """
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        if listen_fd is not None:
+            self.listen_socket = socket.socket(fileno=listen_fd)
+        else:
+            self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen_socket.bind((host, port))
+            self.listen_socket.listen(backlog)
+        # pid -> generation; the replaced master's workers, still our children after exec, are generation -1
+        self.children = {pid: -1 for pid in retiring}
+        self.generation = 0
+        # Values this process got from .env; the next master must read the file again instead
+        self._dotenv = dotenv_values()
+        self._reload_requested = False
+        self._stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.listen_socket, self.max_concurrency)
+        self.children[pid] = self.generation
+        return pid
+
+    def reload(self):
+        """
+        Re-executes the master in place, handing over the listening socket and the current workers.
+
+        Returns only when the new code fails to import; the current master keeps running then.
+        """
+        env = {
+            key: value for key, value in os.environ.items()
+            if key not in self._dotenv or self._dotenv[key] != value
+        }
+        check = subprocess.run(
+            [sys.executable, "-c", "import server"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if check.returncode != 0:
+            logging.error("Reload refused, the new code does not import:\n%s", check.stderr.strip())
+            return
+        self.listen_socket.set_inheritable(True)
+        env["RECIPE_SERVER_LISTEN_FD"] = str(self.listen_socket.fileno())
+        env["RECIPE_SERVER_RETIRING"] = ",".join(str(pid) for pid in self.children)
+        logging.info("Reloading: re-executing the master.")
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self._stopping:
+                logging.warning("Worker %d exited unexpectedly (status %d), respawning.", pid, status)
+                self.spawn()
+
+    def serve_forever(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "_reload_requested", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "_stopping", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "_stopping", True))
+
+        logging.info("Master %d listening on %s:%d.", os.getpid(), *self.listen_socket.getsockname()[:2])
+        retiring = list(self.children)
+        for _ in range(self.workers):
+            self.spawn()
+        for pid in retiring:
+            self._signal(pid, signal.SIGTERM)
+
+        while not self._stopping:
+            if self._reload_requested:
+                self._reload_requested = False
+                self.reload()
+            self._reap()
+            time.sleep(0.5)
+
+        logging.info("Shutting down %d workers.", len(self.children))
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        while self.children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            self.children.pop(pid, None)
+        self.listen_socket.close()
+
+
+if __name__ == "__main__":
+    # crew.py configured logging on import already; replace that so worker lines carry their pid
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(process)d - %(levelname)s - %(message)s", force=True
+    )
+
+    parser = argparse.ArgumentParser(description="Serve RecipeCrew over HTTP with pre-forked workers.")
+    parser.add_argument("--host", default=os.getenv("RECIPE_SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RECIPE_SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("RECIPE_SERVER_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=int(os.getenv("RECIPE_SERVER_MAX_CONCURRENCY", "4")),
+        help="Maximum concurrent requests per worker; extra requests get a 503.",
+    )
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("The pre-forking server requires a platform with os.fork().")
+
+    listen_fd = os.environ.pop("RECIPE_SERVER_LISTEN_FD", None)
+    retiring = [int(pid) for pid in os.environ.pop("RECIPE_SERVER_RETIRING", "").split(",") if pid]
+
+    # Totals from a previous run must not leak into this one; a reload continues the run
+    if metrics.REGISTRY.multiprocess_dir and listen_fd is None:
+        for filename in os.listdir(metrics.REGISTRY.multiprocess_dir):
+            if filename.startswith("metrics_"):
+                os.remove(os.path.join(metrics.REGISTRY.multiprocess_dir, filename))
+
+    # The crew modules import crewai lazily; load it in the master so forked workers share
+    # the loaded modules copy-on-write
+    preload()
+    PreforkMaster(
+        args.host,
+        args.port,
+        args.workers,
+        args.max_concurrency,
+        listen_fd=int(listen_fd) if listen_fd is not None else None,
+        retiring=retiring,
+    ).serve_forever()
@@ -0,0 +1,236 @@
+import re
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pantry import canonical_ingredient
+from recipe_index import tokenize
+
+"""
+Combined shopping lists for several recipes, built locally without an LLM.
+
+Each ingredient line is parsed into a quantity, a unit and a canonical
+ingredient ("1 1/2 cups flour" -> 1.5, cup, "flour"). Units are normalized to a
+base unit per dimension: grams for mass, millilitres for volume, and their own
+unit for countable things like cloves or cans. All lines of all recipes are then
+summed in one vectorized pass, keyed by (ingredient, base unit). The same
+ingredient in different dimensions (cups and grams of flour) stays on separate
+lines, since converting would need its density.
+
+Works directly on the structured recipe_details of the fetch stage (and on
+formatted or custom recipes, which have the same fields).
+"""
+
+load_dotenv()
+
+# Unit alias -> (base unit, factor to the base unit)
+UNITS = {}
+for aliases, base, factor in (
+    (("g", "gram", "grams", "gr"), "g", 1.0),
+    (("kg", "kilogram", "kilograms"), "g", 1000.0),
+    (("mg", "milligram", "milligrams"), "g", 0.001),
+    (("oz", "ounce", "ounces"), "g", 28.35),
+    (("lb", "lbs", "pound", "pounds"), "g", 453.6),
+    (("ml", "millilitre", "milliliter", "millilitres", "milliliters"), "ml", 1.0),
+    (("l", "litre", "liter", "litres", "liters"), "ml", 1000.0),
+    (("tsp", "teaspoon", "teaspoons"), "ml", 4.93),
+    (("tbsp", "tablespoon", "tablespoons"), "ml", 14.79),
+    (("cup", "cups"), "ml", 240.0),
+    (("clove", "cloves"), "clove", 1.0),
+    (("can", "cans", "tin", "tins"), "can", 1.0),
+    (("bunch", "bunches"), "bunch", 1.0),
+    (("pinch", "pinches"), "pinch", 1.0),
+    (("slice", "slices"), "slice", 1.0),
+    (("handful", "handfuls"), "handful", 1.0),
+    (("sprig", "sprigs"), "sprig", 1.0),
+    (("piece", "pieces", "pc", "pcs"), "", 1.0),
+):
+    for alias in aliases:
+        UNITS[alias] = (base, factor)
+
+# Words (whole canonical names first, then their last word, then any word) -> store aisle
+AISLE_KEYWORDS = {
+    "produce": {
+        "tomato", "onion", "garlic", "basil", "spinach", "carrot", "potato", "capsicum", "lemon", "lime", "apple",
+        "banana", "lettuce", "cucumber", "parsley", "cilantro", "coriander", "ginger", "mushroom", "zucchini",
+        "celery", "avocado", "mint", "berry", "strawberry", "shallot", "leek", "cabbage", "broccoli", "kale",
+    },
+    "dairy & eggs": {"milk", "butter", "cheese", "cream", "yogurt", "egg", "parmesan", "mozzarella", "feta", "ghee"},
+    "meat & seafood": {
+        "beef", "pork", "chicken", "turkey", "lamb", "bacon", "ham", "sausage", "fish", "salmon", "tuna", "cod",
+        "shrimp", "prawn", "mince", "steak",
+    },
+    "bakery": {"bread", "bun", "tortilla", "pita", "baguette", "roll"},
+    "pantry": {
+        "flour", "sugar", "rice", "pasta", "spaghetti", "noodle", "oil", "vinegar", "lentil", "chickpea", "bean",
+        "oat", "stock", "broth", "sauce", "honey", "paste", "couscous", "quinoa", "nut", "almond", "yeast",
+    },
+    "spices": {
+        "salt", "pepper", "black pepper", "cumin", "paprika", "cinnamon", "oregano", "thyme", "chili", "turmeric",
+        "nutmeg", "bay leaf", "curry powder", "vanilla",
+    },
+}
+_AISLES = {" ".join(tokenize(word)): aisle for aisle, words in AISLE_KEYWORDS.items() for word in words}
+
+_FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75, "⅛": 0.125}
+_NUMBER = re.compile(r"^(\d+(?:[.,]\d+)?)?([½⅓⅔¼¾⅛])?$")
+_NUMBER_WITH_UNIT = re.compile(r"^(\d+(?:[.,]\d+)?)([a-z]+)$")
+
+
+def _number(token):
+    # "2", "1.5", "1/2", "1½", "½", and ranges like "2-3" (the upper bound, to not buy too little)
+    if "-" in token or "–" in token:
+        parts = [_number(part) for part in re.split(r"[-–]", token) if part]
+        return max(parts) if parts and None not in parts else None
+    if "/" in token:
+        numerator, _, denominator = token.partition("/")
+        if numerator.isdigit() and denominator.isdigit() and int(denominator):
+            return int(numerator) / int(denominator)
+        return None
+    match = _NUMBER.match(token)
+    if not match or not any(match.groups()):
+        return None
+    return float((match.group(1) or "0").replace(",", ".")) + _FRACTIONS.get(match.group(2), 0.0)
+
+
+def parse_ingredient(line):
+    """
+    Splits an ingredient line into quantity, unit and canonical ingredient.
+
+    Returns:
+        tuple: (quantity in the base unit or None, base unit, canonical ingredient or None).
+            e.g. "1 1/2 cups flour" -> (360.0, "ml", "flour"), "salt to taste" -> (None, "", "salt").
+    """
+    # Parenthesized package sizes ("1 (400 g) can tomatoes") describe the unit, not extra quantity
+    tokens = re.sub(r"\([^)]*\)", " ", str(line)).lower().split()
+    quantity = None
+    position = 0
+    while position < len(tokens):
+        value = _number(tokens[position])
+        if value is None:
+            attached = _NUMBER_WITH_UNIT.match(tokens[position])
+            if attached and attached.group(2) in UNITS:
+                # "400g": split into number and unit
+                value = float(attached.group(1))
+                tokens[position] = attached.group(2)
+                quantity = (quantity or 0.0) + value
+            break
+        quantity = (quantity or 0.0) + value
+        position += 1
+
+    unit, factor = "", 1.0
+    if position < len(tokens) and tokens[position].rstrip(".") in UNITS:
+        unit, factor = UNITS[tokens[position].rstrip(".")]
+        position += 1
+        if position < len(tokens) and tokens[position] == "of":
+            position += 1
+    elif quantity is None and tokens[:1] in (["a"], ["an"]) and len(tokens) > 1 and tokens[1].rstrip(".") in UNITS:
+        # "a pinch of salt"
+        quantity = 1.0
+        unit, factor = UNITS[tokens[1].rstrip(".")]
+        position = 3 if len(tokens) > 2 and tokens[2] == "of" else 2
+
+    name = canonical_ingredient(" ".join(tokens[position:]))
+    return (quantity * factor if quantity is not None else None), unit, name
+
+
+def aisle_for(ingredient):
+    """
+    Returns:
+        str: The store aisle of a canonical ingredient, or "other".
+    """
+    words = ingredient.split()
+    for key in [ingredient, words[-1]] + words:
+        if key in _AISLES:
+            return _AISLES[key]
+    return "other"
+
+
+def _display(quantity, unit):
+    if unit == "g" and quantity >= 1000:
+        return round(quantity / 1000, 2), "kg"
+    if unit == "ml" and quantity >= 1000:
+        return round(quantity / 1000, 2), "l"
+    return round(quantity, 2 if quantity < 10 else 0), unit
+
+
+def _parse_lines(recipe_details, servings):
+    # Every parsed ingredient line of the recipes, scaled, and the lines that could not be read
+    names, units, quantities, recipe_ids = [], [], [], []
+    unparsed = []
+    for recipe in recipe_details:
+        if hasattr(recipe, "model_dump"):
+            recipe = recipe.model_dump()
+        if not isinstance(recipe, dict) or "error" in recipe:
+            continue
+        scale = servings / recipe["servings"] if servings and recipe.get("servings") else 1.0
+        for line in recipe.get("ingredients") or []:
+            quantity, unit, name = parse_ingredient(line)
+            if name is None:
+                unparsed.append(line)
+                continue
+            names.append(name)
+            units.append(unit)
+            quantities.append(np.nan if quantity is None else quantity * scale)
+            recipe_ids.append(recipe.get("recipe_id", ""))
+    return names, units, quantities, recipe_ids, unparsed
+
+
+def build_shopping_list(recipe_details, servings=None):
+    """
+    Sums the ingredients of several recipes into one shopping list grouped by aisle.
+
+    Args:
+        recipe_details (list): RecipeDetail-shaped dicts or models, e.g. the fetch stage output,
+            or a compact_recipes.RecipeBatch, whose lines are already parsed.
+        servings (int): Scale every recipe with known servings to this many servings.
+
+    Returns:
+        dict: "aisles" mapping each aisle to its items (ingredient, quantity, unit, recipes),
+            and "unparsed" lines no ingredient could be read from.
+    """
+    if hasattr(recipe_details, "shopping_rows"):
+        names, units, quantities, recipe_ids, unparsed = recipe_details.shopping_rows(servings)
+    else:
+        names, units, quantities, recipe_ids, unparsed = _parse_lines(recipe_details, servings)
+
+    if not names:
+        return {"aisles": {}, "unparsed": unparsed}
+
+    # One pass over all lines: group by (ingredient, unit) and sum the known quantities
+    keys, groups = np.unique(np.array([f"{name}\t{unit}" for name, unit in zip(names, units)]), return_inverse=True)
+    quantities = np.array(quantities, dtype=np.float64)
+    known = ~np.isnan(quantities)
+    totals = np.bincount(groups, weights=np.where(known, quantities, 0.0), minlength=len(keys))
+    known_counts = np.bincount(groups, weights=known, minlength=len(keys))
+
+    sources = [set() for _ in keys]
+    for group, recipe_id in zip(groups, recipe_ids):
+        sources[group].add(recipe_id)
+
+    aisles = {}
+    for group, key in enumerate(keys):
+        name, unit = str(key).split("\t")
+        quantity, display_unit = _display(float(totals[group]), unit) if known_counts[group] else (None, unit)
+        aisles.setdefault(aisle_for(name), []).append({
+            "ingredient": name,
+            "quantity": quantity,
+            "unit": display_unit,
+            "recipes": sorted(recipe_id for recipe_id in sources[group] if recipe_id),
+        })
+    return {"aisles": dict(sorted(aisles.items())), "unparsed": unparsed}
+
+
+def render_shopping_list(shopping_list):
+    """
+    Returns:
+        str: The shopping list as Markdown, one section per aisle.
+    """
+    lines = []
+    for aisle, items in shopping_list["aisles"].items():
+        lines.append(f"## {aisle.capitalize()}")
+        for item in items:
+            amount = "" if item["quantity"] is None else f"{item['quantity']:g} {item['unit']}".rstrip() + " "
+            lines.append(f"- {amount}{item['ingredient']}")
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
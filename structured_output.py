@@ -0,0 +1,175 @@
+import json
+import re
+
+from pydantic import ValidationError
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser gives the same results, slower
+    _loads = json.loads
+
+"""
+Parsing of JSON-mode LLM answers into the typed models in schemas.py.
+
+LLM answers are often wrapped in code fences, followed by prose, or cut off by
+max_tokens. parse_json handles all three: it extracts the first JSON value and,
+if that value is truncated, repairs it by closing open strings and containers
+and dropping the trailing partial member.
+"""
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+_CLOSERS = {"{": "}", "[": "]"}
+_MAX_REPAIR_ATTEMPTS = 64
+
+
+class StructuredOutputError(ValueError):
+    """
+    Raised when an LLM answer cannot be parsed or validated into the expected model.
+    """
+
+
+def json_instructions(example):
+    """
+    Builds the JSON-mode suffix appended to prompts.
+
+    Args:
+        example (dict): An example of the expected JSON shape.
+
+    Returns:
+        str: Instructions asking for a single JSON value and nothing else.
+    """
+    return (
+        "\nRespond with a single JSON object and nothing else, no prose and no code fences. "
+        f"Use exactly this shape: {json.dumps(example)}"
+    )
+
+
+def repair_truncated_json(text):
+    """
+    Attempts to turn a truncated JSON document into a valid one.
+
+    Returns:
+        The parsed value.
+
+    Raises:
+        StructuredOutputError: If no repair candidate parses.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    # (cut position, open containers at that position), latest last
+    safe_points = []
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            # Cutting before a container drops it whole rather than leaving it empty
+            safe_points.append((index, tuple(stack)))
+            stack.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            safe_points.append((index + 1, tuple(stack)))
+        elif char == ",":
+            safe_points.append((index, tuple(stack)))
+
+    candidates = []
+    tail = text[:-1] if escaped else text
+    if in_string:
+        tail += '"'
+    candidates.append(tail + "".join(_CLOSERS[c] for c in reversed(stack)))
+    for cut, open_containers in reversed(safe_points[-_MAX_REPAIR_ATTEMPTS:]):
+        candidates.append(text[:cut] + "".join(_CLOSERS[c] for c in reversed(open_containers)))
+
+    for candidate in candidates:
+        try:
+            return _loads(candidate)
+        except ValueError:
+            continue
+    raise StructuredOutputError("Could not repair truncated JSON output.")
+
+
+def parse_json(text):
+    """
+    Extracts and parses the first JSON object or array in an LLM answer.
+
+    Raises:
+        StructuredOutputError: If the answer contains no usable JSON.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+
+    starts = [position for position in (text.find("{"), text.find("[")) if position != -1]
+    if not starts:
+        raise StructuredOutputError("No JSON found in output.")
+    text = text[min(starts):].strip()
+
+    try:
+        return _loads(text)
+    except ValueError:
+        pass
+    try:
+        # Complete JSON followed by trailing prose
+        value, _ = json.JSONDecoder().raw_decode(text)
+        return value
+    except ValueError:
+        return repair_truncated_json(text)
+
+
+def parse_model(output, model):
+    """
+    Parses and validates an LLM answer into a schema model.
+
+    Args:
+        output: A model instance, a dict, or raw LLM text.
+        model (type): The pydantic model to validate into.
+
+    Returns:
+        An instance of model.
+
+    Raises:
+        StructuredOutputError: If the output cannot be parsed or does not match the model.
+    """
+    if isinstance(output, model):
+        return output
+
+    data = output if isinstance(output, (dict, list)) else parse_json(output)
+    if isinstance(data, list) and "recipes" in model.model_fields:
+        # A bare list where a {"recipes": [...]} wrapper was asked for
+        data = {"recipes": data}
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        raise StructuredOutputError(f"Output does not match {model.__name__}: {e}") from e
+
+
+def parse_stage_output(result, model):
+    """
+    Converts a `Crew.kickoff` result into a schema model.
+
+    Prefers the typed output crewai already produced (`pydantic`, then `json_dict`)
+    and falls back to parsing the raw text.
+    """
+    typed = getattr(result, "pydantic", None)
+    if isinstance(typed, model):
+        return typed
+    json_dict = getattr(result, "json_dict", None)
+    if json_dict:
+        return parse_model(json_dict, model)
+    return parse_model(getattr(result, "raw", result), model)
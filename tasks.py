@@ -1,7 +1,6 @@
-from crewai import Task
-from tools import SearchFilterTool, RecipeDatabaseTool, RecipeFormatterTool
 from dotenv import load_dotenv
-from agents import RecipeAgents
+from cassette import replay_enabled
+from schemas import CustomRecipe, FormattedRecipe, RecipeDetails, SearchResults
 from textwrap import dedent
 import os
 
@@ -10,24 +9,17 @@ load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 model_name = os.getenv("OPENAI_MODEL_NAME", "ruslandev/llama-3-8b-gpt-4o")
 
-if not api_key or not model_name:
+# Replaying a cassette needs no API key
+if not model_name or (not api_key and not replay_enabled()):
     raise EnvironmentError("Missing OPENAI_API_KEY or OPENAI_MODEL_NAME in environment variables.")
 
 llm = {"model": model_name, "api_key": api_key}
 
-# Initialize tools
-search_filter_tool = SearchFilterTool(name="Search Filter", description="Filter recipe searches based on criteria.")
-recipe_database_tool = RecipeDatabaseTool(name="Recipe Database", description="Search in recipe database.")
-recipe_formatter_tool = RecipeFormatterTool(name="Recipe Formatter", description="Format recipes into easy-to-follow instructions.")
-
-# Initialize agents
-recipe_agents = RecipeAgents()
-recipe_researcher = recipe_agents.recipe_researcher()
-recipe_creator = recipe_agents.recipe_creator()
-recipe_formatter = recipe_agents.recipe_formatter()
-
 class RecipeTasks:
     def search_recipes(self, agent, user_preferences, ingredient_filters, dish_type):
+        from crewai import Task
+        from tools import SearchFilterTool
+
         return Task(
             description=dedent(f"""
             **Task**: Search for Recipes
@@ -41,16 +33,25 @@ class RecipeTasks:
             - Dish Type: {dish_type}
 
             **Note**: Ensure results are highly relevant by accurately applying filters.
+            If the user preferences include a "pantry" list, pass it to the SearchFilterTool as "pantry" to rank
+            recipes by how many of their ingredients the user already has.
+            Always pass the user's "dietary_restrictions" and "avoid_ingredients" to the SearchFilterTool as well.
+            For free-text requests (e.g. "slow-cooked with preserved lemon"), pass the text as "search_query" with
+            "mode": "full_text" to rank recipes by their titles, ingredients and steps; quote exact phrases.
             """),
             agent=agent,
             tool=SearchFilterTool,
             inputs={"user_preferences": user_preferences, "ingredient_filters": ingredient_filters, "dish_type": dish_type},
             outputs=["recipe_ids"],    
-            expected_output="A list of recipe IDs matching the search criteria.",
+            output_pydantic=SearchResults,
+            expected_output='A JSON object {"recipes": [{"recipe_id": ..., "name": ...}]} matching the search criteria.',
             instructions="Use the SearchFilterTool to look up recipes and return a list of recipe IDs."
         )
 
     def fetch_recipe_details(self, agent, recipe_ids):
+        from crewai import Task
+        from tools import RecipeDatabaseTool
+
         return Task(
             description=dedent(f"""
             **Task**: Fetch Recipe Details
@@ -66,12 +67,18 @@ class RecipeTasks:
             tool=RecipeDatabaseTool,
             inputs={"recipe_ids": recipe_ids},
             outputs=["recipe_details"],
-            expected_output="Detailed information for the provided recipe IDs (name, ingredients, steps, cooking time).",
+            output_pydantic=RecipeDetails,
+            expected_output=(
+                'A JSON object {"recipes": [...]} with the details of each provided recipe ID '
+                "(recipe_id, name, ingredients, steps, cooking_time)."
+            ),
 
             instructions="Query the database using the RecipeDatabaseTool to get full details of the recipes."
         )
 
     def generate_custom_recipe(self, agent, user_preferences, ingredient_filters):
+        from crewai import Task
+
         return Task(
             description=dedent(f"""
             **Task**: Generate a Custom Recipe
@@ -88,12 +95,16 @@ class RecipeTasks:
             tool=None,  # No specific tool, as this task uses the LLM directly
             inputs={"user_preferences": user_preferences, "ingredient_filters": ingredient_filters},
             outputs=["custom_recipe"],
-            expected_output="A fully generated recipe with ingredients, steps, and additional notes.",
+            output_pydantic=CustomRecipe,
+            expected_output="A JSON object with the generated recipe's name, ingredients, steps, and notes.",
 
             instructions="Use the LLM to generate a complete recipe with detailed instructions."
         )
 
     def format_recipe(self, agent, recipe_details, custom_recipe):
+        from crewai import Task
+        from tools import RecipeFormatterTool
+
         return Task(
             description=dedent(f"""
             **Task**: Format the Recipe
@@ -110,7 +121,11 @@ class RecipeTasks:
             tool=RecipeFormatterTool,
             inputs={"recipe_details": recipe_details, "custom_recipe": custom_recipe},
             outputs=["formatted_recipe"],
-            expected_output="A user-friendly and visually appealing formatted recipe.",
+            output_pydantic=FormattedRecipe,
+            expected_output=(
+                "A JSON object with the recipe's structured fields and a user-friendly, "
+                "visually appealing formatted version in 'text'."
+            ),
 
             instructions=(
                 "Use the RecipeFormatterTool to structure the recipe. Ensure the result includes sections like: "
@@ -120,6 +135,8 @@ class RecipeTasks:
 
     def main_task(self, agent, user_preferences, ingredient_filters, dish_type):
        
+        from crewai import Task
+
         return Task(
             description=dedent(f"""
             **Task**: Generate and Format a Complete Recipe
@@ -150,12 +167,21 @@ class RecipeTasks:
             )
         )
 
-# Example usage
-recipe_tasks = RecipeTasks()
+# Example usage; building agents and tools imports crewai, so only when run as a script
+if __name__ == "__main__":
+    from agents import RecipeAgents
+
+    # Initialize agents
+    recipe_agents = RecipeAgents()
+    recipe_researcher = recipe_agents.recipe_researcher()
+    recipe_creator = recipe_agents.recipe_creator()
+    recipe_formatter = recipe_agents.recipe_formatter()
+
+    recipe_tasks = RecipeTasks()
 
-main_task = recipe_tasks.main_task(
-    agent=recipe_researcher,
-    user_preferences={"diet": "vegan", "cuisine": "Italian"},
-    ingredient_filters=["tomatoes", "basil"],
-    dish_type="main_course"
-)
+    main_task = recipe_tasks.main_task(
+        agent=recipe_researcher,
+        user_preferences={"diet": "vegan", "cuisine": "Italian"},
+        ingredient_filters=["tomatoes", "basil"],
+        dish_type="main_course"
+    )
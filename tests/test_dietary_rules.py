@@ -0,0 +1,25 @@
+import pytest
+
+from dietary_rules import Restrictions
+
+
+@pytest.mark.parametrize("ingredient", ["sugar", "sucre", "Sugar"])
+def test_avoided_sugar_stays_forbidden(ingredient):
+    restrictions = Restrictions({"avoid_ingredients": [ingredient]})
+
+    assert restrictions
+    assert restrictions.words == {"sugar"}
+    assert not restrictions.allows({"ingredients": ["2 tbsp sugar", "1 cup flour"]})
+    assert restrictions.allows({"ingredients": ["1 cup flour", "2 eggs"]})
+
+
+def test_sugar_free_diet_forbids_nothing():
+    assert not Restrictions({"dietary_restrictions": ["sans sucre"]})
+
+
+def test_french_diet_names_keep_their_categories():
+    restrictions = Restrictions({"avoid_ingredients": ["porc"], "dietary_restrictions": ["sans gluten"]})
+
+    assert not restrictions.allows({"ingredients": ["200 g lardons"]})
+    assert not restrictions.allows({"ingredients": ["1 cup flour"]})
+    assert restrictions.allows({"ingredients": ["rice", "carrot"]})
@@ -0,0 +1,17 @@
+import pytest
+
+from shopping_list import aisle_for, parse_ingredient
+
+
+@pytest.mark.parametrize("line", ["2 red bell peppers", "1 poivron", "1 green capsicum"])
+def test_bell_peppers_are_produce(line):
+    _, _, ingredient = parse_ingredient(line)
+
+    assert aisle_for(ingredient) == "produce"
+
+
+@pytest.mark.parametrize("line", ["1 tsp ground pepper", "salt and pepper to taste", "1/2 tsp black pepper"])
+def test_pepper_is_a_spice(line):
+    _, _, ingredient = parse_ingredient(line)
+
+    assert aisle_for(ingredient) == "spices"
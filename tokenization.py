@@ -0,0 +1,257 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+"""
+Multilingual tokenization for recipe text and queries.
+
+Recipes and queries mix English, French and Darija/Arabic ("tajine", "tagine",
+"طاجين", "poulet", "djaj"). Every text goes through the same pipeline, both
+when it is indexed and when it is searched for, so these meet on one term:
+1. language detection per text (English, French) and per word (Arabic script);
+2. folding: case, accents and ligatures ("bœuf" -> "boeuf"), and for Arabic
+   the diacritics, tatweel and letter variants;
+3. dropping quantities, units and stop words of the detected language;
+4. per-language light stemming (plurals, the Arabic article);
+5. a lexicon of spelling variants and translations to one canonical term
+   ("tagine", "طاجين" -> "tajine"; "poulet", "djaj" -> "chicken"). Arabic words
+   not in the lexicon are transliterated to Latin letters;
+6. multi-word names ("pois chiches", "bell pepper") joined into their one
+   canonical term.
+
+Canonical terms are stable under tokenize, so keyword sets written in plain
+English can be normalized through it.
+"""
+
+load_dotenv()
+
+LANGUAGES = ("en", "fr", "ar")
+
+_WORD = re.compile(r"[^\W\d_]+")
+_ARABIC = re.compile(r"[؀-ۿ]")
+_ARABIC_PREFIXES = ("وال", "بال", "فال", "كال", "لل", "ال")
+
+_STOP_WORDS = {
+    "en": {
+        "a", "an", "and", "of", "or", "the", "to", "with", "for", "fresh", "chopped", "large", "small", "medium",
+        "g", "kg", "mg", "ml", "l", "oz", "lb", "lbs", "cup", "cups", "tbsp", "tsp", "tablespoon", "tablespoons",
+        "teaspoon", "teaspoons", "pinch", "bunch", "clove", "cloves", "handful", "slice", "slices", "can", "cans",
+    },
+    "fr": {
+        "a", "au", "aux", "avec", "c", "d", "de", "des", "du", "en", "et", "l", "la", "le", "les", "ou", "pour",
+        "sur", "un", "une", "frais", "fraiche", "hache", "hachee", "emince", "g", "kg", "mg", "ml", "cl", "dl",
+        "cuillere", "cuilleres", "cas", "cac", "pincee", "pincees", "gousse", "gousses", "tasse", "tasses",
+        "verre", "verres", "botte", "bottes", "tranche", "tranches", "boite", "boites", "sans",
+    },
+    "ar": {"و", "في", "من", "مع", "على", "او", "غ", "كغ", "مل", "ملعقه", "كاس", "حبه", "حبات", "رشه"},
+}
+# Words that mark a Latin-script text as French rather than English
+_FRENCH_MARKERS = {"au", "aux", "avec", "de", "des", "du", "et", "la", "le", "les", "pour", "sans", "une"}
+_ENGLISH_MARKERS = {"and", "of", "the", "with", "for"}
+
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss", "ø": "o", "đ": "d", "ł": "l"})
+_ARABIC_LETTERS = str.maketrans({"ة": "ه", "ى": "ي", "ٱ": "ا", "ـ": None})
+_TRANSLITERATION = str.maketrans({
+    "ا": "a", "ب": "b", "ت": "t", "ث": "t", "ج": "j", "ح": "h", "خ": "kh", "د": "d", "ذ": "d", "ر": "r",
+    "ز": "z", "س": "s", "ش": "ch", "ص": "s", "ض": "d", "ط": "t", "ظ": "d", "ع": "a", "غ": "gh", "ف": "f",
+    "ق": "q", "ك": "k", "گ": "g", "ل": "l", "م": "m", "ن": "n", "ه": "h", "و": "ou", "ي": "i", "ء": None,
+    "ڤ": "v", "پ": "p",
+})
+
+# Canonical term -> spelling variants and translations, written as people type them
+LEXICON = {
+    "tajine": ["tagine", "tajin", "tagin", "طاجين", "طجين"],
+    "couscous": ["kuskus", "seksu", "seksou", "كسكس", "كسكسو"],
+    "kefta": ["kofta", "kafta", "kufta", "kefte", "كفتة"],
+    "harira": ["hrira", "حريرة"],
+    "pastilla": ["bastilla", "bastila", "bstilla", "pastila", "بسطيلة", "بسطيله"],
+    "msemen": ["msemmen", "msemmne", "مسمن"],
+    "zaalouk": ["zaaluk", "zalouk", "زعلوك"],
+    "chermoula": ["charmoula", "chermula", "شرمولة"],
+    "briouat": ["briwat", "briouate", "بريوات"],
+    "rfissa": ["rfisa", "رفيسة"],
+    "chicken": ["poulet", "poule", "djaj", "dajaj", "دجاج"],
+    "lamb": ["agneau", "ghanmi", "خروف", "غنمي"],
+    "beef": ["boeuf", "bagri", "بقري"],
+    "meat": ["viande", "lham", "لحم"],
+    "fish": ["poisson", "hout", "حوت", "سمك"],
+    "shrimp": ["crevette", "قمرون"],
+    "egg": ["oeuf", "bid", "bayd", "بيض"],
+    "onion": ["oignon", "bsal", "bsla", "بصل"],
+    "garlic": ["ail", "touma", "تومة", "ثوم"],
+    "tomato": ["tomate", "maticha", "matecha", "طماطم", "مطيشة"],
+    "potato": ["batata", "بطاطا", "بطاطس"],
+    "carrot": ["carotte", "khizzou", "خيزو", "جزر"],
+    "lemon": ["citron", "limoun", "ليمون"],
+    "olive": ["zitoun", "زيتون"],
+    "oil": ["huile", "zit", "زيت"],
+    "chickpea": ["hommos", "حمص"],
+    "lentil": ["lentille", "aads", "عدس"],
+    "honey": ["miel", "aassel", "عسل"],
+    "almond": ["amande", "louz", "لوز"],
+    "cinnamon": ["cannelle", "qarfa", "قرفة"],
+    "cumin": ["kamoun", "كمون"],
+    "ginger": ["gingembre", "skinjbir", "سكنجبير", "زنجبيل"],
+    "saffron": ["safran", "zaafran", "زعفران"],
+    "coriander": ["coriandre", "qasbour", "kosbor", "قزبر", "كزبرة"],
+    "parsley": ["persil", "maadnous", "معدنوس", "بقدونس"],
+    "mint": ["menthe", "naanaa", "نعناع"],
+    "semolina": ["semoule", "smida", "سميدة"],
+    "flour": ["farine", "dqiq", "دقيق", "طحين"],
+    "butter": ["beurre", "zebda", "زبدة"],
+    "milk": ["lait", "hlib", "حليب"],
+    "bread": ["pain", "khobz", "خبز"],
+    "salt": ["sel", "melha", "ملحة", "ملح"],
+    "pepper": ["poivre", "bzar", "ibzar", "إبزار", "فلفل"],
+    "capsicum": ["poivron", "felfla", "فلفلة"],
+    "sugar": ["sucre", "sokkar", "سكر"],
+    "rice": ["riz", "rouz", "أرز", "رز"],
+    "eggplant": ["aubergine", "bdenjal", "باذنجان", "دنجال"],
+    "zucchini": ["courgette", "كوسة", "قرعة"],
+    "soup": ["soupe", "chorba", "shorba", "شربة", "حساء"],
+    "salad": ["salade", "chlada", "شلاضة", "سلطة"],
+    "breakfast": ["ftour", "فطور"],
+    "lunch": ["dejeuner", "ghda", "غداء", "غذاء"],
+    "dinner": ["diner", "aacha", "عشاء"],
+    "vegetarian": ["vegetarien", "vegetarienne", "نباتي"],
+    "vegan": ["vegane", "vegetalien", "vegetalienne"],
+}
+# Canonical term -> names of several words, matched after the words went through steps 1-5
+COMPOUNDS = {
+    "chickpea": ["pois chiches", "pois chiche", "garbanzo beans"],
+    "capsicum": ["bell pepper", "sweet pepper"],
+}
+
+
+def fold(text):
+    """
+    Returns:
+        str: The text casefolded, without accents or Arabic diacritics, and with
+            ligatures and Arabic letter variants replaced.
+    """
+    text = str(text).casefold().translate(_LIGATURES)
+    if not text.isascii():
+        text = "".join(
+            char for char in unicodedata.normalize("NFKD", text) if unicodedata.category(char) != "Mn"
+        ).translate(_ARABIC_LETTERS)
+    return text
+
+
+def detect_language(words):
+    """
+    Guesses the language of a text from its folded words.
+
+    Returns:
+        str: "ar" when most words are in Arabic script, "fr" when French markers
+            outnumber English ones, else "en".
+    """
+    arabic = sum(1 for word in words if _ARABIC.match(word))
+    if arabic * 2 > len(words):
+        return "ar"
+    latin = set(words)
+    if len(latin & _FRENCH_MARKERS) > len(latin & _ENGLISH_MARKERS):
+        return "fr"
+    return "en"
+
+
+def _stem_en(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _stem_fr(word):
+    if len(word) > 4 and word.endswith("eaux"):
+        return word[:-1]
+    if len(word) > 3 and word[-1] in "sx" and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _stem_ar(word):
+    # The article, alone or after a clitic ("بالزيتون" -> "زيتون")
+    for prefix in _ARABIC_PREFIXES:
+        if len(word) > len(prefix) + 2 and word.startswith(prefix):
+            word = word[len(prefix):]
+            break
+    if len(word) > 4 and word.endswith("ات"):
+        word = word[:-2]
+    return word
+
+
+_STEMMERS = {"en": _stem_en, "fr": _stem_fr, "ar": _stem_ar}
+
+
+def _canonical_forms():
+    # Folded variants (and their stems) -> canonical term in its stemmed form
+    forms = {}
+    for term, variants in LEXICON.items():
+        canonical = _stem_en(fold(term))
+        for variant in [term] + variants:
+            folded = fold(variant)
+            stem = _stem_ar(folded) if _ARABIC.match(folded) else _stem_en(folded)
+            for form in (folded, stem, _stem_fr(folded)):
+                forms.setdefault(form, canonical)
+    return forms
+
+
+_CANONICAL = _canonical_forms()
+
+
+@lru_cache(maxsize=65536)
+def _term(word, language):
+    # One folded word -> its index term, or None for stop words
+    if _ARABIC.match(word):
+        language = "ar"
+    elif language == "ar":
+        language = "en"
+    if word in _STOP_WORDS[language] or (language != "en" and word in _STOP_WORDS["en"]):
+        return None
+    if word in _CANONICAL:
+        return _CANONICAL[word]
+    stem = _STEMMERS[language](word)
+    if stem in _CANONICAL:
+        return _CANONICAL[stem]
+    if language == "ar":
+        return stem.translate(_TRANSLITERATION)
+    return stem
+
+
+def tokenize(text, language=None):
+    """
+    Splits recipe or query text into index terms, dropping quantities, units and filler words.
+
+    Args:
+        text (str): Text in English, French or Darija/Arabic, possibly mixed.
+        language (str): One of LANGUAGES, to skip detection (e.g. a recipe's known language).
+
+    Returns:
+        list: Normalized terms.
+    """
+    words = _WORD.findall(fold(text))
+    if language not in LANGUAGES:
+        language = detect_language(words)
+    terms = []
+    for word in words:
+        term = _term(word, language)
+        if term:
+            if terms and (terms[-1], term) in _COMPOUND_TERMS:
+                term = _COMPOUND_TERMS[terms.pop(), term]
+            terms.append(term)
+    return terms
+
+
+# Term pairs of the compound names -> canonical term; filled once tokenize exists, in every language's stemming
+_COMPOUND_TERMS = {}
+_COMPOUND_TERMS.update({
+    tuple(tokenize(name, language)): _stem_en(fold(term))
+    for term, names in COMPOUNDS.items()
+    for name in names
+    for language in ("en", "fr")
+})
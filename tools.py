@@ -1,18 +1,116 @@
 from crewai_tools import BaseTool
-import openai
+from itertools import islice
+from typing import Any, Optional
+import json
+import logging
 import os
+import sqlite3
+import time
 from dotenv import load_dotenv
 from langchain.tools import tool
+from cassette import replay_enabled
+from circuit_breaker import CircuitBreaker, CircuitOpenError, StaleResultCache
+from coalescing import SingleFlight
+from dietary_rules import Restrictions, get_recipe_masks
+from full_text import get_full_text_index
+from llm_client import get_client
+from metrics import ERRORS, LLM_CALLS, LLM_COST, LLM_IN_FLIGHT, LLM_LATENCY, LLM_TOKENS, TOOL_LATENCY
+from model_routing import get_model_router
+from pantry import get_pantry_index
+from profiling import profiled
+from pagination import InvalidCursorError, decode_cursor, encode_cursor, iter_pages, query_fingerprint
+from recipe_corpus import get_recipe_corpus
+from recipe_index import get_recipe_index
+from schemas import FormattedRecipe, RecipeDetail, SearchResults
+from structured_output import json_instructions, parse_model
 
 # Load environment variables for API
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 model_name = os.getenv("OPENAI_MODEL_NAME", "ruslandev/llama-3-8b-gpt-4o")
 
-if not api_key or not model_name:
+# Replaying a cassette needs no API key
+if not model_name or (not api_key and not replay_enabled()):
     raise EnvironmentError("Missing OPENAI_API_KEY or OPENAI_MODEL_NAME in environment variables.")
 
-openai.api_key = api_key
+# Circuit breaker around the completion endpoint
+completion_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5")),
+    latency_threshold=float(os.getenv("LLM_BREAKER_LATENCY_THRESHOLD", "10")),
+    recovery_timeout=float(os.getenv("LLM_BREAKER_RECOVERY_TIMEOUT", "30")),
+    half_open_max_calls=int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1")),
+)
+stale_results = StaleResultCache(max_entries=int(os.getenv("LLM_STALE_CACHE_SIZE", "1024")))
+search_page_size = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+
+# Identical concurrent completion calls share one request
+completion_flight = SingleFlight()
+
+# Example shapes shown to the LLM in JSON-mode prompts
+SEARCH_EXAMPLE = {"recipes": [{"recipe_id": "r123", "name": "Tomato basil pasta"}]}
+RECIPE_EXAMPLE = {
+    "recipe_id": "r123",
+    "name": "Tomato basil pasta",
+    "ingredients": ["400 g spaghetti", "6 tomatoes", "1 bunch basil"],
+    "steps": ["Boil the pasta.", "Simmer the tomatoes.", "Toss with basil."],
+    "cooking_time": 25,
+    "servings": 4,
+    "cuisine": "Italian",
+    "dish_type": "main course",
+    "nutrition": {"calories": 520},
+    "notes": "",
+}
+FORMAT_EXAMPLE = dict(RECIPE_EXAMPLE, text="# Tomato basil pasta\n...")
+
+
+def complete(
+    prompt: str, max_tokens: int, temperature: float = 0.7, client=None, tool: str = "unknown", router=None
+):
+    """
+    Send a completion request through the circuit breaker.
+
+    The model comes from the route picked for the calling tool and the prompt size.
+    Concurrent calls with the same prompt and parameters are coalesced into one request,
+    whose calls, errors, tokens and cost are recorded once, by the caller that made it.
+
+    Args:
+        client (CompletionClient): Client to use. Defaults to the shared client for the route's endpoint.
+        tool (str): Name of the calling tool, used for routing and as a metrics label.
+        router (ModelRouter): Router to use. Defaults to the shared per-process router.
+
+    Raises:
+        CircuitOpenError: If the LLM provider is currently considered down.
+    """
+    router = router or get_model_router()
+    route = router.route(tool=tool, input_chars=len(prompt))
+    client = client or get_client(route.base_url, route.api_key)
+
+    def call():
+        LLM_CALLS.inc(tool=tool, model=route.model)
+        start = time.perf_counter()
+        try:
+            with LLM_IN_FLIGHT.track_inprogress():
+                response = completion_breaker.call(
+                    client.create, model=route.model, prompt=prompt, max_tokens=max_tokens, temperature=temperature
+                )
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            router.record("tool", tool, route, time.perf_counter() - start, error=True)
+            raise
+
+        elapsed = time.perf_counter() - start
+        usage = (response or {}).get("usage") or {}
+        tokens_in = usage.get("prompt_tokens", 0)
+        tokens_out = usage.get("completion_tokens", 0)
+        LLM_TOKENS.inc(tokens_in, direction="in", model=route.model)
+        LLM_TOKENS.inc(tokens_out, direction="out", model=route.model)
+        LLM_LATENCY.observe(elapsed, route=route.name)
+        cost = router.record("tool", tool, route, elapsed, tokens_in, tokens_out)
+        LLM_COST.inc(cost, route=route.name, model=route.model)
+        return response
+
+    # Only the caller that makes the request runs call(), so coalesced waiters record nothing
+    return completion_flight.do((id(client), route.model, prompt, max_tokens, temperature), call)
 
 
 class CalculatorTools:
@@ -49,36 +147,198 @@ class SearchFilterTool(BaseTool):
         "A tool that searches for content based on user queries, filters, and date ranges. "
         "It leverages GPT models to simulate search results."
     )
-
+    client: Optional[Any] = None
+    router: Optional[Any] = None
+    index: Optional[Any] = None
+    pantry_index: Optional[Any] = None
+    recipe_masks: Optional[Any] = None
+    full_text_index: Optional[Any] = None
+
+    @TOOL_LATENCY.time(tool="search_filter_tool")
+    @profiled("search_filter_tool")
     def _run(self, inputs: dict) -> dict:
         query = inputs.get("search_query", "")
         filters = ", ".join(inputs.get("filters", []))
         date_range = inputs.get("date_range", "last_30_days")
+        page_size = int(inputs.get("page_size", search_page_size))
+
+        # Cursors are bound to the query they were issued for
+        page_query = {
+            "search_query": query,
+            "filters": inputs.get("filters", []),
+            "dish_type": inputs.get("dish_type"),
+            "date_range": date_range,
+        }
+        pantry = inputs.get("pantry") or []
+        if pantry:
+            page_query["pantry"] = sorted(pantry)
+        full_text = inputs.get("mode") == "full_text" and bool(query) and not pantry
+        if full_text:
+            page_query["mode"] = "full_text"
+        restrictions = Restrictions(inputs)
+        # Diets without an ingredient category ("low carb") are not in restrictions, only in the prompt
+        stated_restrictions = bool(inputs.get("dietary_restrictions") or inputs.get("avoid_ingredients"))
+        if stated_restrictions:
+            page_query["dietary_restrictions"] = inputs.get("dietary_restrictions")
+            page_query["avoid_ingredients"] = inputs.get("avoid_ingredients")
+        try:
+            position = decode_cursor(inputs.get("cursor"), page_query)
+        except InvalidCursorError as e:
+            return {"error": str(e)}
 
-        if not query:
+        # Diets and allergens are a hard filter on local results, not a hint to the model
+        recipe_masks = (self.recipe_masks or get_recipe_masks(self.index)) if restrictions else None
+        index = self.index or get_recipe_index()
+        # The snapshot every local path searches; masks older than it fall back to the recipe records
+        snapshot = index.snapshot() if index is not None else None
+
+        def allowed(recipe_id):
+            return recipe_masks.allows(recipe_id, restrictions, snapshot)
+
+        # Pantry mode: rank the local catalog by how much of each recipe the user already has
+        pantry_index = (self.pantry_index or get_pantry_index(self.index)) if pantry else None
+        if pantry_index is not None:
+            offset = position.get("offset", 0)
+            matches = pantry_index.match(
+                pantry,
+                max_missing=inputs.get("max_missing"),
+                min_coverage=float(inputs.get("min_coverage", 0.0)),
+                dish_type=inputs.get("dish_type"),
+                eligible=(
+                    recipe_masks.eligible_rows(restrictions, pantry_index.recipe_ids)
+                    if recipe_masks is not None and recipe_masks.current(snapshot)
+                    else None
+                ),
+                accept=allowed if recipe_masks is not None and not recipe_masks.current(snapshot) else None,
+                offset=offset,
+                limit=page_size + 1,
+            )
+            has_more = len(matches) > page_size
+            matches = matches[:page_size]
+            return {
+                "search_results": matches,
+                "recipe_ids": [match["recipe_id"] for match in matches],
+                "next_cursor": encode_cursor(page_query, {"offset": offset + page_size}) if has_more else None,
+            }
+
+        # Full-text mode: rank the local catalog's titles, ingredients and steps against the query
+        full_text_index = (self.full_text_index or get_full_text_index(self.index)) if full_text else None
+        if full_text_index is not None:
+            offset = position.get("offset", 0)
+            try:
+                matches = full_text_index.search(
+                    query,
+                    dish_type=inputs.get("dish_type"),
+                    offset=offset,
+                    limit=page_size + 1,
+                    accept=allowed if recipe_masks is not None else None,
+                )
+            except sqlite3.OperationalError as e:
+                # The SQLite backend is busy past its timeout; answer like without a local catalog
+                logging.warning("Full-text search failed, falling back to the model: %s", e)
+                full_text_index = None
+        if full_text_index is not None:
+            has_more = len(matches) > page_size
+            matches = matches[:page_size]
+            return {
+                "search_results": matches,
+                "recipe_ids": [match["recipe_id"] for match in matches],
+                "next_cursor": encode_cursor(page_query, {"offset": offset + page_size}) if has_more else None,
+            }
+
+        # Answer from the local recipe index when one is configured and it has matches
+        has_filters = inputs.get("filters") or inputs.get("dish_type")
+        if index is not None and has_filters and "offset" not in position and not pantry and not full_text:
+            matches = snapshot.iter_search(
+                inputs.get("filters", []), dish_type=inputs.get("dish_type"), after=position.get("after")
+            )
+            if recipe_masks is not None:
+                matches = filter(allowed, matches)
+            recipe_ids = list(islice(matches, page_size + 1))
+            if recipe_ids or "after" in position:
+                has_more = len(recipe_ids) > page_size
+                recipe_ids = recipe_ids[:page_size]
+                return {
+                    "search_results": [
+                        {"recipe_id": recipe_id, "name": snapshot.get(recipe_id).get("name", "")}
+                        for recipe_id in recipe_ids
+                    ],
+                    "recipe_ids": recipe_ids,
+                    "next_cursor": encode_cursor(page_query, {"after": recipe_ids[-1]}) if has_more else None,
+                }
+
+        if not query and not pantry:
             return {"error": "Search query is missing."}
 
+        offset = position.get("offset", 0)
+        pantry_note = f"Prefer recipes that mostly use these pantry ingredients: '{', '.join(pantry)}'. " if pantry else ""
+        if stated_restrictions:
+            pantry_note += (
+                f"Only include recipes that are '{inputs.get('dietary_restrictions')}' and contain none of: "
+                f"'{inputs.get('avoid_ingredients')}'. "
+            )
         prompt = (
-            f"Search for the following query: '{query}', with filters: '{filters}', "
-            f"within the date range: '{date_range}'."
+            f"Search for recipes matching the query: '{query}', with filters: '{filters}', "
+            f"within the date range: '{date_range}'. "
+            + pantry_note
+            + f"Return results {offset + 1} to {offset + page_size} of the full result list, "
+            f"at most {page_size} recipes."
+            + json_instructions(SEARCH_EXAMPLE)
         )
 
+        # Everything the cursor is bound to (pantry, dish type, restrictions, ...) is part of the key
+        cache_key = ("search", query_fingerprint(page_query), offset, page_size)
+        empty_page = {"search_results": [], "recipe_ids": [], "next_cursor": None}
         try:
-            response = openai.Completion.create(
-                model=model_name,
-                prompt=prompt,
-                max_tokens=200,
-                temperature=0.7,
+            response = complete(
+                prompt,
+                max_tokens=50 + 30 * page_size,
+                client=self.client,
+                tool="search_filter_tool",
+                router=self.router,
             )
 
             if response and "choices" in response:
-                search_results = response["choices"][0]["text"].strip().split("\n")
-                return {"search_results": search_results}
+                search_results = parse_model(response["choices"][0]["text"], SearchResults)
+                recipes = search_results.recipes[:page_size]
+                result = {
+                    "search_results": [recipe.model_dump() for recipe in recipes],
+                    "recipe_ids": [recipe.recipe_id for recipe in recipes],
+                    "next_cursor": (
+                        encode_cursor(page_query, {"offset": offset + page_size})
+                        if len(recipes) == page_size
+                        else None
+                    ),
+                }
+                stale_results.put(cache_key, result)
+                return result
             else:
-                return {"search_results": []}
+                return empty_page
+        except CircuitOpenError:
+            return stale_results.degraded(cache_key, empty_page)
         except Exception as e:
             return {"error": str(e)}
 
+    def pages(self, inputs: dict):
+        """
+        Iterates over search results one page at a time, following continuation cursors.
+
+        Only the page being consumed is fetched, so callers can stop early on broad queries.
+
+        Args:
+            inputs (dict): The same inputs as _run; "cursor" optionally sets the starting page.
+
+        Yields:
+            list: The search results of one page.
+        """
+        def fetch_page(cursor):
+            result = self._run(dict(inputs, cursor=cursor))
+            if "error" in result:
+                raise ValueError(result["error"])
+            return result["search_results"], result.get("next_cursor")
+
+        return iter_pages(fetch_page, inputs.get("cursor"))
+
 
 class RecipeDatabaseTool(BaseTool):
     """
@@ -87,33 +347,71 @@ class RecipeDatabaseTool(BaseTool):
 
     name: str = "Recipe Database Tool"
     description: str = "Fetches detailed information about specific result IDs using GPT."
+    client: Optional[Any] = None
+    router: Optional[Any] = None
+    index: Optional[Any] = None
+    corpus: Optional[Any] = None
 
+    @TOOL_LATENCY.time(tool="recipe_database_tool")
+    @profiled("recipe_database_tool")
     def _run(self, inputs: dict) -> dict:
         result_ids = inputs.get("result_ids", [])
 
         if not result_ids:
             return {"error": "Result IDs are missing."}
 
+        index = self.index or get_recipe_index()
+        snapshot = index.snapshot() if index is not None else None
+        corpus = self.corpus or get_recipe_corpus()
+
         result_details = []
+        degraded = False
         for result_id in result_ids:
-            prompt = f"Provide detailed information about the result ID: {result_id}."
+            local = snapshot.get(result_id) if snapshot is not None else None
+            if local is None and corpus is not None:
+                local = corpus.get(result_id)
+            if local is not None:
+                result_details.append(RecipeDetail.model_validate(local).model_dump())
+                continue
+
+            prompt = (
+                f"Provide detailed information about the recipe with ID: {result_id}."
+                + json_instructions(RECIPE_EXAMPLE)
+            )
+            cache_key = ("details", result_id)
             try:
-                response = openai.Completion.create(
-                    model=model_name,
-                    prompt=prompt,
-                    max_tokens=150,
-                    temperature=0.7,
+                response = complete(
+                    prompt,
+                    max_tokens=400,
+                    client=self.client,
+                    tool="recipe_database_tool",
+                    router=self.router,
                 )
 
                 if response and "choices" in response:
-                    result_details.append(response["choices"][0]["text"].strip())
+                    detail = parse_model(response["choices"][0]["text"], RecipeDetail)
+                    detail.recipe_id = str(result_id)
+                    detail = detail.model_dump()
+                    stale_results.put(cache_key, detail)
+                    result_details.append(detail)
                 else:
-                    result_details.append(f"No details found for result ID {result_id}.")
+                    result_details.append(
+                        {"recipe_id": str(result_id), "error": f"No details found for result ID {result_id}."}
+                    )
+            except CircuitOpenError:
+                degraded = True
+                fallback = stale_results.degraded(
+                    cache_key, RecipeDetail(recipe_id=str(result_id), notes="Details unavailable.").model_dump()
+                )
+                fallback.pop("degraded")
+                result_details.append(fallback)
             except Exception as e:
                 result_details.append(
-                    f"Error fetching data for result ID {result_id}: {str(e)}"
+                    {"recipe_id": str(result_id), "error": f"Error fetching data for result ID {result_id}: {str(e)}"}
                 )
 
+        if degraded:
+            return {"result_details": result_details, "degraded": True}
         return {"result_details": result_details}
 
 
@@ -126,7 +424,11 @@ class RecipeFormatterTool(BaseTool):
     description: str = (
         "Formats search results into a clean, readable structure using GPT."
     )
+    client: Optional[Any] = None
+    router: Optional[Any] = None
 
+    @TOOL_LATENCY.time(tool="recipe_formatter_tool")
+    @profiled("recipe_formatter_tool")
     def _run(self, inputs: dict) -> dict:
         result_details = inputs.get("result_details", [])
 
@@ -134,23 +436,45 @@ class RecipeFormatterTool(BaseTool):
             return {"error": "Result details are missing."}
 
         formatted_results = []
+        degraded = False
         for result in result_details:
+            if isinstance(result, dict) and "error" in result:
+                continue
+            recipe = json.dumps(result, sort_keys=True) if isinstance(result, dict) else str(result)
             prompt = (
-                f"Format the following recipe into a clear and structured format: {result}"
+                f"Format the following recipe into a clear and structured format: {recipe}"
+                + json_instructions(FORMAT_EXAMPLE)
             )
+            cache_key = ("format", recipe)
             try:
-                response = openai.Completion.create(
-                    model=model_name,
-                    prompt=prompt,
-                    max_tokens=200,
-                    temperature=0.7,
+                response = complete(
+                    prompt,
+                    max_tokens=600,
+                    client=self.client,
+                    tool="recipe_formatter_tool",
+                    router=self.router,
                 )
 
                 if response and "choices" in response:
-                    formatted_results.append(response["choices"][0]["text"].strip())
+                    formatted = parse_model(response["choices"][0]["text"], FormattedRecipe).model_dump()
+                    stale_results.put(cache_key, formatted)
+                    formatted_results.append(formatted)
+                else:
+                    formatted_results.append({"error": "Formatting failed for this recipe."})
+            except CircuitOpenError:
+                # A locally rendered recipe is still a usable answer while the provider is down
+                degraded = True
+                if isinstance(result, dict):
+                    local = FormattedRecipe.model_validate(result)
+                    local.text = local.render()
                 else:
-                    formatted_results.append("Formatting failed for this recipe.")
+                    local = FormattedRecipe(text=recipe)
+                fallback = stale_results.degraded(cache_key, local.model_dump())
+                fallback.pop("degraded")
+                formatted_results.append(fallback)
             except Exception as e:
-                formatted_results.append(f"Error formatting result: {str(e)}")
+                formatted_results.append({"error": f"Error formatting result: {str(e)}"})
 
+        if degraded:
+            return {"formatted_results": formatted_results, "degraded": True}
         return {"formatted_results": formatted_results}
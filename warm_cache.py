@@ -0,0 +1,145 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from agents import RecipeAgents
+from coalescing import request_key
+from crew import run_recipe_request
+from result_cache import SQLiteResultCache, get_result_cache
+
+"""
+Offline cache-warming job.
+
+Runs popular requests through the pipeline ahead of peak hours and stores the
+formatted recipes in the result cache, so those requests are then served with
+zero LLM calls.
+
+Popular requests come either from a JSON file (a list of request objects) or are
+mined from a JSONL request log such as the one written by server.py when
+RECIPE_REQUEST_LOG is set. Point RESULT_CACHE_PATH at the same SQLite file as the
+serving processes, otherwise the warmed results die with this process.
+
+Usage:
+    python warm_cache.py --requests popular.json --parallelism 4
+    python warm_cache.py --from-log requests.log --top 300
+"""
+
+load_dotenv()
+
+REQUEST_KEYS = ("user_preferences", "ingredient_filters", "dish_type")
+
+
+def load_requests(path):
+    """
+    Returns:
+        list: Request dicts from a JSON file holding a list of requests.
+    """
+    with open(path, encoding="utf-8") as f:
+        requests = json.load(f)
+    return [request for request in requests if all(key in request for key in REQUEST_KEYS)]
+
+
+def mine_requests(log_path, top):
+    """
+    Finds the most frequent logically distinct requests in a JSONL request log.
+
+    Args:
+        log_path (str): Path to a log with one JSON request object per line.
+        top (int): Number of requests to return.
+
+    Returns:
+        list: The top requests, most frequent first.
+    """
+    counts = Counter()
+    representatives = {}
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(request, dict) or not all(key in request for key in REQUEST_KEYS):
+                continue
+            key = request_key(*(request[name] for name in REQUEST_KEYS))
+            counts[key] += 1
+            representatives.setdefault(key, {name: request[name] for name in REQUEST_KEYS})
+
+    return [representatives[key] for key, _ in counts.most_common(top)]
+
+
+def warm(requests, parallelism=4, refresh=False):
+    """
+    Runs requests through the pipeline with bounded parallelism, filling the result cache.
+
+    Args:
+        requests (list): Request dicts with user_preferences, ingredient_filters and dish_type.
+        parallelism (int): Maximum number of pipelines running at once.
+        refresh (bool): Recompute requests that are already cached.
+
+    Returns:
+        dict: Counts of warmed, skipped and failed requests.
+    """
+    result_cache = get_result_cache()
+    recipe_agents = RecipeAgents()
+    summary = {"warmed": 0, "skipped": 0, "failed": 0}
+
+    pending = []
+    for request in requests:
+        if not refresh and result_cache.get(request_key(*(request[name] for name in REQUEST_KEYS))) is not None:
+            summary["skipped"] += 1
+        else:
+            pending.append(request)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = {
+            executor.submit(
+                run_recipe_request,
+                request["user_preferences"],
+                request["ingredient_filters"],
+                request["dish_type"],
+                recipe_agents=recipe_agents,
+                use_cache=False,
+            ): request
+            for request in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                formatted_recipe = future.result()
+            except Exception as e:
+                logging.error("Warming failed for %s: %s", futures[future], e)
+                formatted_recipe = None
+            summary["warmed" if formatted_recipe is not None else "failed"] += 1
+            logging.info("Warmed %d/%d requests (%.1fs).", done, len(pending), time.monotonic() - start)
+
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Precompute popular recipe requests into the result cache.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--requests", help="JSON file with a list of popular requests.")
+    source.add_argument("--from-log", help="JSONL request log to mine popular requests from.")
+    parser.add_argument("--top", type=int, default=300, help="Number of requests to mine from the log.")
+    parser.add_argument("--parallelism", type=int, default=int(os.getenv("WARM_CACHE_PARALLELISM", "4")))
+    parser.add_argument("--refresh", action="store_true", help="Recompute requests that are already cached.")
+    args = parser.parse_args()
+
+    if not isinstance(get_result_cache(), SQLiteResultCache):
+        logging.warning("RESULT_CACHE_PATH is not set; warmed results will not outlive this process.")
+
+    requests = load_requests(args.requests) if args.requests else mine_requests(args.from_log, args.top)
+    logging.info("Warming %d requests with parallelism %d.", len(requests), args.parallelism)
+
+    summary = warm(requests, parallelism=args.parallelism, refresh=args.refresh)
+    logging.info("Done: %s", summary)
+    sys.exit(1 if summary["failed"] else 0)